@@ -0,0 +1,61 @@
+"""
+JWT verification with a small cache of already verified tokens.
+
+Dashboard clients send the same bearer token on every call, so the signature
+check and claim parsing are done once per token and reused until the token
+expires (or the cache TTL runs out, whichever comes first).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 4096))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+
+
+class TokenVerifier:
+    def __init__(self, secret_key, algorithms=('HS256',), max_entries=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.secret_key = secret_key
+        self.algorithms = list(algorithms)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache = OrderedDict()  # token -> (valid_until, claims)
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        """
+        Returns the token's claims. Raises jwt.ExpiredSignatureError or
+        jwt.InvalidTokenError like jwt.decode.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None:
+                valid_until, claims = entry
+                if valid_until > now:
+                    self._cache.move_to_end(token)
+                    return claims
+                del self._cache[token]
+
+        claims = jwt.decode(token, self.secret_key, algorithms=self.algorithms)
+        self.remember(token, claims)
+        return claims
+
+    def remember(self, token, claims):
+        """
+        Caches claims for a verified token (also used to enrich older tokens' claims).
+        """
+        valid_until = time.time() + self.ttl
+        if claims.get('exp') is not None:
+            valid_until = min(valid_until, claims['exp'])
+        with self._lock:
+            self._cache[token] = (valid_until, claims)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
@@ -0,0 +1,515 @@
+"""
+End-to-end HTTP benchmark of the API.
+
+Seeds a dedicated database (BENCH_DB_NAME, default bems_bench) on a local
+MySQL-compatible server with synthetic houses, starts the Ollama stub and the
+API (Flask or ASGI mode) as subprocesses, then drives every endpoint at each
+requested concurrency. For every (endpoint, concurrency) it records latency
+percentiles, throughput, status codes, bytes received, the statements the
+database server executed (the `Questions` status counter) and the query-cache
+hits and misses, and writes them as JSON so two versions can be compared:
+
+    python bench-api.py --houses 20 --days 120 --concurrency 1,8,32 --output before.json
+    python bench-api.py --compare before.json after.json
+
+The data, the request mix and the report days are drawn from --seed, so two
+runs with the same arguments send the same requests.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import mysql.connector
+import numpy as np
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+import fleet
+
+load_dotenv()
+
+DB_HOST = os.getenv('BENCH_DB_HOST', os.getenv('DB_HOST', '127.0.0.1'))
+DB_USER = os.getenv('BENCH_DB_USER', os.getenv('DB_USER'))
+DB_PASSWORD = os.getenv('BENCH_DB_PASSWORD', os.getenv('DB_PASSWORD'))
+DB_PORT = int(os.getenv('BENCH_DB_PORT', os.getenv('DB_PORT', 3306)))
+BENCH_DB_NAME = os.getenv('BENCH_DB_NAME', 'bems_bench')
+BENCH_DATA_DIR = os.getenv('BENCH_DATA_DIR', 'bench-data')
+
+BENCH_TODAY = datetime(2025, 6, 1, 12, 0, 0)  # server-api.DATE_TODAY, the data ends there
+BENCH_HOUSE_BASE = 100000                     # ids of the synthetic houses start here
+BENCH_PASSWORD = 'bench'
+
+DOCKER_IMAGE = 'mysql:8.0'
+DOCKER_CONTAINER = 'bems-bench-db'
+
+DEFAULT_ENDPOINTS = ['today', 'lastweek', 'range', 'range_hourly', 'quarter', 'bills', 'user',
+                     'download', 'download_raw', 'bills_download', 'report']
+
+
+def random_window(rng, manifest, days):
+    """
+    (start, end) YYYY-MM-DD of a random window of `days` days inside the seeded data.
+    """
+    first = datetime.fromisoformat(manifest['first_day'])
+    span = max((BENCH_TODAY - first).days - days, 0)
+    start = first + timedelta(days=rng.randint(0, span))
+    end = min(start + timedelta(days=days - 1), BENCH_TODAY)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+def endpoint_path(name, rng, manifest):
+    """
+    Request path of one call to the endpoint `name`.
+    """
+    if name == 'today':
+        return '/api/consumption/today'
+    if name == 'lastweek':
+        return '/api/consumption/lastweek'
+    if name == 'range':
+        return '/api/consumption/%s/%s' % random_window(rng, manifest, 30)
+    if name == 'range_hourly':
+        return '/api/consumption/%s/%s?resolution=hourly&max_points=500' % random_window(rng, manifest, 7)
+    if name == 'quarter':
+        return f"/api/consumption/quarter/{rng.choice([1, 2])}/{BENCH_TODAY.year}"
+    if name == 'bills':
+        return '/api/bills'
+    if name == 'user':
+        return '/api/user'
+    if name == 'download':
+        return '/api/consumption/download/%s/%s' % random_window(rng, manifest, 30)
+    if name == 'download_raw':
+        return '/api/consumption/download/raw/%s/%s' % random_window(rng, manifest, 7)
+    if name == 'bills_download':
+        return f"/api/bills/download/{rng.choice([1, 2])}/{BENCH_TODAY.year}"
+    if name == 'report':
+        day = BENCH_TODAY - timedelta(days=rng.randint(1, min(14, manifest['days'] - 1)))
+        return f"/api/report/{day.strftime('%Y-%m-%d')}?stream=1"
+    raise ValueError(f"Unknown endpoint '{name}', expected one of {', '.join(DEFAULT_ENDPOINTS)}")
+
+
+# ---------------------------------------------------------------- data
+
+def server_connection(database=None):
+    return mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, port=DB_PORT,
+                                   database=database, connection_timeout=10)
+
+
+def bench_env(data_dir, **extra):
+    """
+    Environment of the subprocesses: the repo scripts read DB_* and CSV_FILE_PATH.
+    """
+    env = dict(os.environ, DB_HOST=DB_HOST, DB_USER=DB_USER or '', DB_PASSWORD=DB_PASSWORD or '',
+               DB_PORT=str(DB_PORT), DB_NAME=BENCH_DB_NAME,
+               CSV_FILE_PATH=os.path.join(data_dir, 'houses') + os.sep,
+               WEATHER_FILE=os.path.join(data_dir, 'weather_data.csv'))
+    env.update(extra)
+    return env
+
+
+def run_script(args, env):
+    print(f"$ {' '.join(args)}")
+    result = subprocess.run([sys.executable] + args, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"{args[0]} exited with {result.returncode}")
+
+
+def seed(data_dir, houses, days, seed_value, workers, reseed=False):
+    """
+    Creates and loads the benchmark database unless it already holds the same
+    data (bench-data/seed.json). Returns the manifest of the seeded data.
+    """
+    manifest_path = os.path.join(data_dir, 'seed.json')
+    manifest = {'database': BENCH_DB_NAME, 'houses': houses, 'days': days, 'seed': seed_value,
+                'first_day': (BENCH_TODAY - timedelta(days=days - 1)).strftime('%Y-%m-%d'),
+                'today': BENCH_TODAY.isoformat()}
+    if not reseed and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+        if {k: existing.get(k) for k in manifest} == manifest:
+            print(f"Benchmark database '{BENCH_DB_NAME}' already seeded ({houses} houses, {days} days).")
+            return existing
+
+    conn = server_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{BENCH_DB_NAME}`")
+    cursor.close()
+    conn.close()
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(os.path.join(data_dir, 'houses'))
+
+    env = bench_env(data_dir)
+    run_script(['init-db.py'], env)
+
+    start = datetime.fromisoformat(manifest['first_day'])
+    # Readings up to the end of BENCH_TODAY's day, as a meter would have sent them by then
+    periods = days * fleet.SLOTS_PER_DAY
+    started = time.perf_counter()
+    house_ids = [BENCH_HOUSE_BASE + i for i in range(houses)]
+    fleet.generate_fleet(house_ids, start, periods, seed_value, out_dir=os.path.join(data_dir, 'houses'),
+                         weather_path=env['WEATHER_FILE'], workers=workers, progress=lambda message: None)
+    print(f"Generated {houses * periods:,} readings in {time.perf_counter() - started:.1f}s")
+
+    conn = server_connection(BENCH_DB_NAME)
+    cursor = conn.cursor()
+    for i, house in enumerate(house_ids):
+        cursor.execute("INSERT INTO users (username, email, password, address) VALUES (%s, %s, %s, %s)",
+                       (f"bench{i}", f"bench{i}@bench.local", BENCH_PASSWORD, f"{i} Bench St"))
+        cursor.execute("INSERT INTO houses (id, user_id, construction_year, state, city, building_type) "
+                       "VALUES (%s, %s, %s, %s, %s, %s)",
+                       (house, cursor.lastrowid, 2000, 'texas', 'austin', 'single-family home'))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    started = time.perf_counter()
+    run_script(['seed-db.py', '--all', '--workers', str(workers)], env)
+    manifest['seed_seconds'] = round(time.perf_counter() - started, 1)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def start_docker(port):
+    """
+    Starts a throwaway MySQL server in docker and waits until it accepts connections.
+    """
+    global DB_HOST, DB_USER, DB_PASSWORD, DB_PORT
+    subprocess.run(['docker', 'rm', '-f', DOCKER_CONTAINER], capture_output=True)
+    subprocess.run(['docker', 'run', '-d', '--rm', '--name', DOCKER_CONTAINER,
+                    '-e', f"MYSQL_ROOT_PASSWORD={BENCH_PASSWORD}", '-p', f"{port}:3306",
+                    DOCKER_IMAGE, '--local-infile=1'], check=True)
+    DB_HOST, DB_USER, DB_PASSWORD, DB_PORT = '127.0.0.1', 'root', BENCH_PASSWORD, port
+    deadline = time.monotonic() + 180
+    while True:
+        try:
+            server_connection().close()
+            return
+        except Error:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(2)
+
+
+# ---------------------------------------------------------------- servers
+
+def start_process(args, env, name):
+    log = open(os.path.join(tempfile.gettempdir(), f"bench-{name}.log"), 'w')
+    return subprocess.Popen(args, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for(url, path='/', timeout=60):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            conn.request('GET', path)
+            conn.getresponse().read()
+            conn.close()
+            return
+        except (OSError, http.client.HTTPException):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up within {timeout}s")
+            time.sleep(0.5)
+
+
+def start_servers(args, data_dir):
+    """
+    Starts the Ollama stub and the API on a fresh REPORTS_DIR. Returns (base url, processes).
+    """
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    env = bench_env(data_dir, OLLAMA_HOST=stub_url, REPORTS_DIR=tempfile.mkdtemp(prefix='bench-reports-'))
+    processes = [start_process([sys.executable, 'ollama-stub.py', '--port', str(args.stub_port),
+                                '--token-delay', str(args.stub_token_delay),
+                                '--first-token-delay', str(args.stub_first_token_delay)], env, 'ollama')]
+    if args.mode == 'asgi':
+        server = [sys.executable, '-m', 'uvicorn', 'server-asgi:app', '--port', str(args.port),
+                  '--log-level', 'warning']
+    else:
+        # The threaded server of `python server-api.py`, without the debugger and reloader
+        server = [sys.executable, '-c',
+                  "import importlib; importlib.import_module('server-api').app.run("
+                  f"port={args.port}, threaded=True, debug=False)"]
+    processes.append(start_process(server, env, 'api'))
+    url = f"http://127.0.0.1:{args.port}"
+    wait_for(stub_url)  # the stub answers GET with 501, which is enough to know it is up
+    wait_for(url)
+    return url, processes
+
+
+def stop_processes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# ---------------------------------------------------------------- load
+
+class Client:
+    """
+    One keep-alive HTTP connection per worker thread.
+    """
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host, self.port, self.timeout = parts.hostname, parts.port, timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        (status, body bytes) of one request; the body is read to its end (downloads and SSE included).
+        """
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (OSError, http.client.HTTPException):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def login_all(url, houses):
+    client = Client(url, 30)
+    tokens = []
+    for i in range(houses):
+        body = json.dumps({'email': f"bench{i}@bench.local", 'password': BENCH_PASSWORD})
+        status, data = client.request('POST', '/login', body, {'Content-Type': 'application/json'})
+        if status != 200:
+            raise RuntimeError(f"Login of bench{i} failed with {status}: {data[:200]!r}")
+        tokens.append(json.loads(data)['token'])
+    client.close()
+    return tokens
+
+
+def db_questions(conn):
+    """
+    Statements executed by the database server so far, minus this one.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    value = int(cursor.fetchone()[1])
+    cursor.close()
+    return value - 1
+
+
+def cache_counters(url):
+    client = Client(url, 30)
+    try:
+        status, data = client.request('GET', '/api/stats/cache')
+        stats = json.loads(data) if status == 200 else {}
+    finally:
+        client.close()
+    return stats.get('hits', 0), stats.get('misses', 0)
+
+
+def percentile(latencies, q):
+    return round(float(np.percentile(latencies, q)), 3) if len(latencies) else None
+
+
+def run_endpoint(url, name, concurrency, requests, tokens, manifest, seed_value, timeout, db_conn):
+    """
+    `requests` calls of one endpoint spread over `concurrency` worker threads.
+    """
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+    totals = {'bytes': 0, 'errors': 0}
+
+    def worker(index):
+        rng = random.Random(f"{seed_value}:{name}:{concurrency}:{index}")
+        client = Client(url, timeout)
+        try:
+            while next(counter) < requests:
+                path = endpoint_path(name, rng, manifest)
+                headers = {'Authorization': f"Bearer {rng.choice(tokens)}", 'Accept-Encoding': 'gzip'}
+                started = time.perf_counter()
+                try:
+                    status, body = client.request('GET', path, headers=headers)
+                except (OSError, http.client.HTTPException):
+                    status, body = 'connection-error', b''
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+                    totals['bytes'] += len(body)
+                    if status == 'connection-error' or status >= 400:
+                        totals['errors'] += 1
+        finally:
+            client.close()
+
+    hits, misses = cache_counters(url)
+    questions = db_questions(db_conn)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    queries = db_questions(db_conn) - questions - 1
+    hits_after, misses_after = cache_counters(url)
+
+    latencies = np.array(latencies)
+    return {
+        'endpoint': name,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': totals['errors'],
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': round(float(latencies.mean()), 3) if len(latencies) else None,
+            'max': round(float(latencies.max()), 3) if len(latencies) else None,
+        },
+        'bytes': totals['bytes'],
+        'db_queries': queries,
+        'db_queries_per_request': round(queries / len(latencies), 3) if len(latencies) else None,
+        'query_cache': {'hits': hits_after - hits, 'misses': misses_after - misses},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(args, manifest, url):
+    tokens = login_all(url, manifest['houses'])
+    db_conn = server_connection(BENCH_DB_NAME)
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            for name in args.endpoints:
+                result = run_endpoint(url, name, concurrency, args.requests, tokens, manifest,
+                                      args.seed, args.timeout, db_conn)
+                latency = result['latency_ms']
+                print(f"{name:<15} c={concurrency:<4} {result['throughput_rps']:>9} req/s  "
+                      f"p50 {latency['p50']:>9} ms  p95 {latency['p95']:>9} ms  p99 {latency['p99']:>9} ms  "
+                      f"{result['db_queries_per_request']} queries/req  {result['errors']} errors")
+                results.append(result)
+    finally:
+        db_conn.close()
+    return {
+        'benchmark': 'bench-api',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'mode': args.mode,
+        'url': url,
+        'data': manifest,
+        'settings': {'requests': args.requests, 'concurrency': args.concurrency, 'endpoints': args.endpoints,
+                     'seed': args.seed, 'stub_token_delay': args.stub_token_delay,
+                     'stub_first_token_delay': args.stub_first_token_delay},
+        'results': results,
+    }
+
+
+def compare(base_path, new_path):
+    """
+    Prints p95 latency, throughput and queries per request of two result files side by side.
+    """
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base = {(r['endpoint'], r['concurrency']): r for r in json.load(f)['results']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = {(r['endpoint'], r['concurrency']): r for r in json.load(f)['results']}
+
+    def change(before, after):
+        if not before or after is None:
+            return '     n/a'
+        return f"{100 * (after - before) / before:+7.1f}%"
+
+    print(f"{'endpoint':<15} {'c':>4} {'p95 ms':>21} {'':>8} {'req/s':>21} {'':>8} {'queries/req':>15}")
+    for key in [k for k in base if k in new]:
+        b, n = base[key], new[key]
+        print(f"{key[0]:<15} {key[1]:>4} "
+              f"{b['latency_ms']['p95']:>10} {n['latency_ms']['p95']:>10} {change(b['latency_ms']['p95'], n['latency_ms']['p95'])} "
+              f"{b['throughput_rps']:>10} {n['throughput_rps']:>10} {change(b['throughput_rps'], n['throughput_rps'])} "
+              f"{b['db_queries_per_request']:>7} {n['db_queries_per_request']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a benchmark database and load-test the API endpoints.")
+    parser.add_argument('--houses', type=int, default=20, help="synthetic houses (one user each)")
+    parser.add_argument('--days', type=int, default=120, help="days of 15-minute readings per house, ending at DATE_TODAY")
+    parser.add_argument('--seed', type=int, default=42, help="seed of the data and of the request mix")
+    parser.add_argument('--reseed', action='store_true', help="drop and reload the benchmark database")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="seed-db.py worker processes")
+    parser.add_argument('--docker', action='store_true', help=f"run the database in a throwaway {DOCKER_IMAGE} container")
+    parser.add_argument('--docker-port', type=int, default=3307)
+    parser.add_argument('--mode', choices=['flask', 'asgi'], default='flask', help="serve server-api.py or server-asgi.py")
+    parser.add_argument('--url', help="benchmark an already running API on the benchmark database instead of starting one")
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--stub-port', type=int, default=11534)
+    parser.add_argument('--stub-token-delay', type=float, default=0.01)
+    parser.add_argument('--stub-first-token-delay', type=float, default=0.2)
+    parser.add_argument('--endpoints', default=','.join(DEFAULT_ENDPOINTS), help="comma-separated endpoints to drive")
+    parser.add_argument('--concurrency', default='1,8,32', help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds per request")
+    parser.add_argument('--output', help="results file (default: bench-results/<timestamp>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        exit(0)
+
+    args.endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(',')]
+    for name in args.endpoints:
+        if name not in DEFAULT_ENDPOINTS:
+            parser.error(f"unknown endpoint '{name}', expected one of {', '.join(DEFAULT_ENDPOINTS)}")
+    if args.days < 2:
+        parser.error("--days must be at least 2")
+
+    processes = []
+    try:
+        if args.docker:
+            start_docker(args.docker_port)
+            args.reseed = True  # a new container starts empty
+        manifest = seed(BENCH_DATA_DIR, args.houses, args.days, args.seed, args.workers, args.reseed)
+        if args.url:
+            url = args.url.rstrip('/')
+        else:
+            url, processes = start_servers(args, BENCH_DATA_DIR)
+        results = run_benchmark(args, manifest, url)
+    except (Error, RuntimeError) as e:
+        print(f"Benchmark failed: {e}")
+        exit(1)
+    finally:
+        stop_processes(processes)
+        if args.docker:
+            subprocess.run(['docker', 'stop', DOCKER_CONTAINER], capture_output=True)
+
+    output = args.output or os.path.join('bench-results', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
@@ -0,0 +1,98 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import mysql.connector
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+import downsample
+import exports
+import rollups
+
+load_dotenv()
+
+DB_HOST = os.getenv('DB_HOST')
+DB_USER = os.getenv('DB_USER')  # Replace with your MySQL username
+DB_PASSWORD = os.getenv('DB_PASSWORD')  # Replace with your MySQL password
+DB_NAME = os.getenv('DB_NAME','bems_db')  # Name of the database to create/use
+DB_PORT = int(os.getenv('DB_PORT', 3306))  # Default MySQL port is 3306
+
+BILLS_START = datetime(1970,1,1,0,0,0)
+
+
+def connect():
+    return mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        port=DB_PORT
+    )
+
+
+def endpoint_queries(house_id, today):
+    """
+    endpoint -> (SQL, arguments) as built by server-api.py for `today`.
+    """
+    midnight = datetime(today.year, today.month, today.day)
+    quarter_start = datetime(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
+    return {
+        '/api/consumption/lastweek': rollups.daily_totals_query(house_id, midnight - timedelta(days=7), today),
+        '/api/consumption/<start>/<end>': rollups.daily_totals_query(house_id, midnight - timedelta(days=30), today),
+        '/api/consumption/<start>/<end> (monthly)': downsample.series_query(house_id, BILLS_START, today, 'monthly'),
+        '/api/consumption/quarter': rollups.daily_totals_query(house_id, quarter_start, today),
+        '/api/bills': rollups.monthly_bills_query(house_id, BILLS_START, today),
+        '/api/consumption/download (daily)': exports.export_query(house_id, quarter_start, today, 'daily'),
+        '/api/consumption/download (hourly)': exports.export_query(house_id, quarter_start, today, 'hourly'),
+        '/api/consumption/download (15min)': exports.export_query(house_id, quarter_start, today, '15min'),
+        '/api/consumption/download/raw': exports.raw_readings_query(house_id, quarter_start, today),
+    }
+
+
+def check_plans(conn, house_id, today, verbose=False):
+    """
+    EXPLAINs every endpoint query and prints its verdict. Returns the number of endpoints with problems.
+    """
+    cursor = conn.cursor(dictionary=True)
+    failed = 0
+    try:
+        for endpoint, (query, args) in endpoint_queries(house_id, today).items():
+            plan, problems = rollups.plan_problems(cursor, query, args)
+            print(f"{'OK  ' if not problems else 'FAIL'} {endpoint}" + (f": {'; '.join(problems)}" if problems else ''))
+            if verbose or problems:
+                for row in plan:
+                    print(f"       {row.get('table')}: type={row.get('type')} key={row.get('key')} "
+                          f"rows={row.get('rows')} extra={row.get('Extra')}")
+            failed += bool(problems)
+    finally:
+        cursor.close()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check with EXPLAIN that the aggregate endpoints group by index order, "
+                    "without full scans, filesorts or temporary tables on houses_consumption and the rollups.")
+    parser.add_argument('--house', type=int, help="house id to plan for (default: the first house)")
+    parser.add_argument('--today', help="'YYYY-MM-DD HH:MM:SS' the endpoints run at (default: now)")
+    parser.add_argument('--verbose', action='store_true', help="print the plan of every endpoint")
+    args = parser.parse_args()
+
+    try:
+        conn = connect()
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        exit(1)
+    try:
+        house_id = args.house
+        if house_id is None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(id) FROM houses")
+            house_id = cursor.fetchone()[0]
+            cursor.close()
+        today = datetime.fromisoformat(args.today) if args.today else datetime.now()
+        failed = check_plans(conn, house_id, today, args.verbose)
+    finally:
+        conn.close()
+    exit(1 if failed else 0)
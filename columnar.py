@@ -0,0 +1,65 @@
+"""
+Columnar JSON layout of the consumption endpoints (?layout=columnar).
+
+The default layout is one object per row, repeating every column name on
+every row. The columnar layout sends the time column once as `timestamps`
+and every other column as one array of numbers:
+
+    {"time_column": "date_time", "timestamps": ["2025-06-01T00:00:00", ...],
+     "columns": {"bathroom1": [0.0123, ...], ..., "total_energy": [...]}}
+
+Decimals become floats while transposing, and the body is encoded with
+orjson, which serializes datetimes natively (ISO 8601) and runs several
+times faster than the json module. Without orjson the json module is used
+with the same output.
+"""
+import json
+from datetime import date
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LAYOUTS = ('rows', 'columnar')
+
+
+def check_layout(layout):
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {', '.join(LAYOUTS)}")
+
+
+def _number(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def to_columnar(rows, time_column, exclude=(), **extra):
+    """
+    Transposes dict rows into the columnar layout; `exclude` columns are
+    dropped (e.g. a constant house_id) and `extra` keys are added at the top level.
+    """
+    rows = list(rows)
+    names = [name for name in (rows[0] if rows else ()) if name != time_column and name not in exclude]
+    payload = dict(extra)
+    payload['time_column'] = time_column
+    payload['timestamps'] = [row[time_column] for row in rows]
+    payload['columns'] = {name: [_number(row[name]) for row in rows] for name in names}
+    return payload
+
+
+def _default(o):
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """
+    Encoded JSON body (bytes).
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
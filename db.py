@@ -0,0 +1,294 @@
+"""
+Pooled MySQL connections shared by the API server, the report pipeline and
+seed-db.py.
+
+A ConnectionPool keeps between DB_POOL_MIN and DB_POOL_MAX open connections.
+A request borrows one with `acquire` (or the `connection()` context manager)
+and hands it back with `release`, so connection setup is paid once per
+connection instead of once per request. Connections idle for more than
+DB_POOL_PING_AFTER seconds are pinged before being handed out, connections
+older than DB_POOL_RECYCLE seconds are replaced, and a broken one is dropped
+instead of being returned. When every connection is busy, `acquire` waits up
+to DB_POOL_TIMEOUT seconds and then raises PoolTimeout; `stats` reports the
+saturation and the time spent waiting.
+
+`execute_prepared` runs a query as a server-side prepared statement. The
+statements are cached per connection (DB_STATEMENT_CACHE of them, least
+recently used closed first), so a hot query is parsed once per pooled
+connection and later calls only send the parameters.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_HOST = os.getenv('DB_HOST')
+DB_USER = os.getenv('DB_USER')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_NAME = os.getenv('DB_NAME', 'bems_db')
+DB_PORT = int(os.getenv('DB_PORT', 3306))
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 2))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))        # seconds to wait for a free connection
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 1800))      # seconds before a connection is replaced
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))  # idle seconds before a health check
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', 64))    # prepared statements per connection
+
+# %s placeholders become ?, %% (escaped for the client-side formatting) becomes %
+PLACEHOLDER = re.compile(r'%([s%])')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connect(**options):
+    """
+    A new mysql.connector connection with the DB_* settings, `options` override them.
+    """
+    settings = dict(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME, port=DB_PORT)
+    settings.update(options)
+    return mysql.connector.connect(**settings)
+
+
+def to_prepared(query):
+    return PLACEHOLDER.sub(lambda m: '?' if m.group(1) == 's' else '%', query)
+
+
+class _Entry:
+    __slots__ = ('conn', 'created', 'last_used', 'statements')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.last_used = time.monotonic()
+        self.statements = OrderedDict()
+
+
+class ConnectionPool:
+    """
+    connect() must return a new DB-API connection with ping(), rollback() and close().
+    """
+
+    def __init__(self, connect=connect, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE, ping_after=DB_POOL_PING_AFTER,
+                 statement_cache=DB_STATEMENT_CACHE):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.statement_cache = statement_cache
+        self._idle = []
+        self._busy = {}
+        self._opening = 0
+        self._condition = threading.Condition()
+        self.created = 0
+        self.closed = 0
+        self.acquired = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.failed_checks = 0
+        self.prepared = 0
+        self.statement_hits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.peak_busy = 0
+
+    def fill(self):
+        """
+        Opens connections until min_size are available. Errors are left to the first acquire.
+        """
+        while True:
+            with self._condition:
+                if len(self._idle) + len(self._busy) + self._opening >= self.min_size:
+                    return
+                self._opening += 1
+            try:
+                entry = self._open()
+            except Exception as e:
+                print(f"Opening a pooled connection failed: {e}")
+                with self._condition:
+                    self._opening -= 1
+                return
+            with self._condition:
+                self._opening -= 1
+                self._idle.append(entry)
+                self._condition.notify()
+
+    def _open(self):
+        conn = self.connect()
+        with self._condition:
+            self.created += 1
+        return _Entry(conn)
+
+    def _close(self, entry):
+        for cursor, _ in entry.statements.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._condition:
+            self.closed += 1
+
+    def _healthy(self, entry, now):
+        if self.recycle and now - entry.created > self.recycle:
+            return False
+        if now - entry.last_used > self.ping_after:
+            try:
+                entry.conn.ping()
+            except Exception:
+                with self._condition:
+                    self.failed_checks += 1
+                return False
+        return True
+
+    def acquire(self, timeout=None):
+        """
+        Borrows a connection, waiting up to `timeout` (DB_POOL_TIMEOUT) seconds for one to free up.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        waited = False
+        while True:
+            entry = None
+            opened = False
+            with self._condition:
+                while not self._idle and len(self._busy) + self._opening >= self.max_size:
+                    remaining = started + timeout - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"no free database connection after {timeout:g}s "
+                                          f"({len(self._busy)} of {self.max_size} in use)")
+                    waited = True
+                    self._condition.wait(remaining)
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._opening += 1
+            if entry is None:
+                try:
+                    entry = self._open()
+                    opened = True
+                except Exception:
+                    with self._condition:
+                        self._opening -= 1
+                        self._condition.notify()
+                    raise
+            elif not self._healthy(entry, time.monotonic()):
+                self._close(entry)
+                continue
+            with self._condition:
+                if opened:
+                    self._opening -= 1
+                elapsed = time.monotonic() - started
+                self._busy[id(entry.conn)] = entry
+                self.acquired += 1
+                self.peak_busy = max(self.peak_busy, len(self._busy))
+                if waited:
+                    self.waits += 1
+                self.wait_seconds += elapsed
+                self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+            return entry.conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool. Its open transaction is rolled back;
+        a connection that cannot be rolled back, or `discard`, is closed instead.
+        """
+        with self._condition:
+            entry = self._busy.pop(id(conn), None)
+        if entry is None:
+            return
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close(entry)
+        else:
+            entry.last_used = time.monotonic()
+            with self._condition:
+                self._idle.append(entry)
+        with self._condition:
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=not conn.is_connected())
+            raise
+        else:
+            self.release(conn)
+
+    def execute_prepared(self, conn, query, args=None, fetchone=False):
+        """
+        Runs a query on a borrowed connection as a server-side prepared statement
+        and returns dict rows (one row or None with `fetchone`).
+        """
+        entry = self._busy[id(conn)]
+        cached = entry.statements.get(query)
+        if cached is None:
+            cached = entry.statements[query] = (conn.cursor(prepared=True), to_prepared(query))
+            if len(entry.statements) > self.statement_cache:
+                _, (oldest, _) = entry.statements.popitem(last=False)
+                oldest.close()
+            with self._condition:
+                self.prepared += 1
+        else:
+            entry.statements.move_to_end(query)
+            with self._condition:
+                self.statement_hits += 1
+        cursor, statement = cached
+        # The cursor only re-prepares when it is given a different statement
+        cursor.execute(statement, tuple(args or ()))
+        names = cursor.column_names
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        if fetchone:
+            return rows[0] if rows else None
+        return rows
+
+    def stats(self):
+        with self._condition:
+            busy = len(self._busy)
+            return {
+                'size': busy + len(self._idle),
+                'in_use': busy,
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'saturation': round(busy / self.max_size, 3),
+                'peak_in_use': self.peak_busy,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(1000 * self.wait_seconds / self.acquired, 3) if self.acquired else 0.0,
+                'max_wait_ms': round(1000 * self.max_wait_seconds, 3),
+                'created': self.created,
+                'closed': self.closed,
+                'failed_health_checks': self.failed_checks,
+                'statements_prepared': self.prepared,
+                'statement_cache_hits': self.statement_hits,
+            }
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._close(entry)
@@ -0,0 +1,186 @@
+"""
+Chart series of the consumption endpoints: ?resolution= and ?max_points=.
+
+`resolution` picks the bucket size of the rows (15min, hourly, daily, weekly
+or monthly); the rows are read from the raw readings or the rollup tables by
+exports.export_query / rollups.totals_query, weekly rows are merged from the
+daily ones. A resolution may not read more than SERIES_MAX_BUCKETS rows, so a
+wide range at a fine resolution is refused instead of scanning years of raw
+readings.
+
+`max_points` (at most SERIES_MAX_POINTS, which is also the default) bounds the
+rows sent back. Longer series are downsampled on total consumption with one of:
+
+- lttb: Largest-Triangle-Three-Buckets, keeps the first and last rows and the
+  row of each bucket spanning the largest triangle with its neighbours
+- minmax: the lowest and highest row of each of max_points / 2 buckets
+
+Both keep whole rows, so every column of a kept row is the stored value.
+"""
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from dotenv import load_dotenv
+
+import exports
+import rollups
+
+load_dotenv()
+
+SERIES_MAX_POINTS = int(os.getenv('SERIES_MAX_POINTS', 2000))    # rows per response
+SERIES_MAX_BUCKETS = int(os.getenv('SERIES_MAX_BUCKETS', 50000))  # rows read per request
+
+# resolution -> (shortest bucket of the rows read, name of the time column); weeks are merged from days
+RESOLUTIONS = {
+    '15min': (timedelta(minutes=15), 'date_time'),
+    'hourly': (timedelta(hours=1), 'hour'),
+    'daily': (timedelta(days=1), 'day'),
+    'weekly': (timedelta(days=1), 'week'),
+    'monthly': (timedelta(days=28), 'month'),
+}
+
+METHODS = ('lttb', 'minmax')
+
+VALUE_COLUMN = exports.EXPORT_ALIASES['total_energy']
+
+
+def time_column(resolution):
+    return RESOLUTIONS[resolution][1]
+
+
+def downsample_params(args):
+    """
+    (max_points, method) of a request's query parameters (any mapping with get).
+    Raises ValueError for an invalid max_points or downsample method.
+    """
+    try:
+        max_points = int(args.get('max_points', SERIES_MAX_POINTS))
+    except ValueError:
+        raise ValueError("max_points must be an integer")
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    method = args.get('downsample', 'lttb')
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsample method '{method}', expected one of {', '.join(METHODS)}")
+    return min(max_points, SERIES_MAX_POINTS), method
+
+
+def series_params(args, default_resolution, start, end):
+    """
+    (resolution, max_points, method) of a request's query parameters for the
+    range [start, end]. Raises ValueError for an unknown or too fine resolution
+    and as downsample_params.
+    """
+    resolution = args.get('resolution', default_resolution)
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution}', expected one of {', '.join(RESOLUTIONS)}")
+    span = rollups.as_datetime(end) - rollups.as_datetime(start)
+    buckets = span // RESOLUTIONS[resolution][0] + 1
+    if buckets > SERIES_MAX_BUCKETS:
+        coarser = [r for r, (width, _) in RESOLUTIONS.items() if span // width + 1 <= SERIES_MAX_BUCKETS]
+        raise ValueError(f"Range too wide for resolution '{resolution}' (about {buckets} rows, at most "
+                         f"{SERIES_MAX_BUCKETS}), use {' or '.join(coarser) or 'a shorter range'}")
+    return (resolution,) + downsample_params(args)
+
+
+def series_query(house_id, start, end, resolution):
+    """
+    SQL (and arguments) of the rows read for a resolution; weekly reads daily rows (see finish).
+    """
+    if resolution in exports.RESOLUTIONS:
+        return exports.export_query(house_id, start, end, resolution)
+    if resolution == 'weekly':
+        return exports.export_query(house_id, start, end, 'daily')
+    return rollups.totals_query(
+        house_id, start, end, grain='month', columns=exports.EXPORT_COLUMNS,
+        aliases=exports.EXPORT_ALIASES, bucket_alias=time_column(resolution))
+
+
+def weekly(rows):
+    """
+    Merges daily rows into weeks starting on Monday, under 'week'.
+    """
+    weeks = []
+    for row in rows:
+        day = row['day']
+        week = day - timedelta(days=day.weekday())
+        if not weeks or weeks[-1]['week'] != week:
+            weeks.append(dict({'week': week}, **{k: v for k, v in row.items() if k != 'day'}))
+            continue
+        merged = weeks[-1]
+        for name, value in row.items():
+            if name != 'day' and value is not None:
+                merged[name] = value if merged[name] is None else merged[name] + value
+    return weeks
+
+
+def _seconds(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return value.toordinal() * 86400.0
+    return float(value)
+
+
+def _axes(rows, time_col, value_col):
+    x = np.fromiter((_seconds(row[time_col]) for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((float(row[value_col] or 0) for row in rows), dtype=np.float64, count=len(rows))
+    return x, y
+
+
+def lttb(rows, max_points, time_col, value_col=VALUE_COLUMN):
+    """
+    Largest-Triangle-Three-Buckets selection of at most max_points rows.
+    """
+    size = len(rows)
+    if size <= max_points or max_points < 3:
+        return list(rows)
+    x, y = _axes(rows, time_col, value_col)
+    every = (size - 2) / (max_points - 2)
+    kept = [0]
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * every) + 1
+        stop = int((i + 1) * every) + 1
+        next_stop = min(int((i + 2) * every) + 1, size)
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        # Twice the area of the triangle (a, candidate, average of the next bucket)
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        kept.append(a)
+    kept.append(size - 1)
+    return [rows[i] for i in kept]
+
+
+def minmax(rows, max_points, time_col, value_col=VALUE_COLUMN):
+    """
+    Lowest and highest row (in time order) of each of max_points // 2 equal buckets.
+    """
+    size = len(rows)
+    if size <= max_points:
+        return list(rows)
+    _, y = _axes(rows, time_col, value_col)
+    buckets = max(max_points // 2, 1)
+    kept = []
+    for chunk in np.array_split(np.arange(size), buckets):
+        low = int(chunk[y[chunk].argmin()])
+        high = int(chunk[y[chunk].argmax()])
+        kept.extend(sorted({low, high}))
+    return [rows[i] for i in kept]
+
+
+def downsample(rows, max_points, method, time_col, value_col=VALUE_COLUMN):
+    if method == 'minmax':
+        return minmax(rows, max_points, time_col, value_col)
+    return lttb(rows, max_points, time_col, value_col)
+
+
+def finish(rows, resolution, max_points, method):
+    """
+    Rows of series_query as sent: weeks merged, then downsampled to max_points.
+    """
+    if resolution == 'weekly':
+        rows = weekly(rows)
+    return downsample(rows, max_points, method, time_column(resolution))
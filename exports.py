@@ -0,0 +1,257 @@
+"""
+Streaming exports of houses_consumption.
+
+Rows are read from an unbuffered (server-side) cursor in batches and written
+out as they arrive, so an export of any length runs in constant memory and
+the first bytes leave the server as soon as the first batch is fetched.
+
+Formats:
+
+- csv: chunks of roughly EXPORT_CHUNK_SIZE bytes, optionally gzip-compressed
+- parquet: one zstd-compressed row group per EXPORT_BATCH_ROWS rows
+- arrow: Arrow IPC file, one record batch per EXPORT_BATCH_ROWS rows; left
+  uncompressed by default so clients can memory-map it without copying
+
+The columnar formats need pyarrow. Fetched batches are transposed straight
+into typed Arrow arrays (timestamps/dates and float64 readings), without
+building a dict per row.
+"""
+import csv
+import io
+import os
+import zlib
+
+from dotenv import load_dotenv
+
+import rollups
+from schema import DASHBOARD_CIRCUITS, ENERGY_COLUMNS, TABLE_NAME
+
+load_dotenv()
+
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 64 * 1024))  # bytes per yielded chunk
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', 2000))       # rows per fetchmany (csv)
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', 65536))      # rows per row group / record batch
+EXPORT_PARQUET_COMPRESSION = os.getenv('EXPORT_PARQUET_COMPRESSION', 'zstd')
+EXPORT_ARROW_COMPRESSION = os.getenv('EXPORT_ARROW_COMPRESSION') or None  # lz4 / zstd
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+# resolution -> (rollup grain, name of the time column), None for the raw readings
+RESOLUTIONS = {
+    '15min': (None, 'date_time'),
+    'hourly': ('hour', 'hour'),
+    'daily': ('day', 'day'),
+}
+
+EXPORT_COLUMNS = DASHBOARD_CIRCUITS + ['total_energy']
+EXPORT_ALIASES = {'total_energy': 'total_consumption'}
+
+
+def export_query(house_id, start, end, resolution='daily'):
+    """
+    SQL (and arguments) of a consumption export between start and end (inclusive),
+    ordered by time. Raw rows are read as stored, coarser resolutions come from the rollups.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution}', expected one of {', '.join(RESOLUTIONS)}")
+    grain, time_column = RESOLUTIONS[resolution]
+    if grain is None:
+        select = ', '.join(f"{c} AS {EXPORT_ALIASES[c]}" if c in EXPORT_ALIASES else c for c in EXPORT_COLUMNS)
+        query = (
+            f"SELECT date_time, {select} FROM {TABLE_NAME} "
+            f"WHERE house_id = %s AND date_time BETWEEN %s AND %s "
+            f"ORDER BY date_time ASC")
+        return query, (house_id, start, end)
+    return rollups.totals_query(
+        house_id, start, end, grain=grain, columns=EXPORT_COLUMNS,
+        aliases=EXPORT_ALIASES, bucket_alias=time_column)
+
+
+def raw_readings_query(house_id, start, end):
+    """
+    SQL (and arguments) returning every circuit reading of a house between
+    start and end (inclusive), as stored.
+    """
+    query = (
+        f"SELECT date_time, {', '.join(ENERGY_COLUMNS)} FROM {TABLE_NAME} "
+        f"WHERE house_id = %s AND date_time BETWEEN %s AND %s "
+        f"ORDER BY date_time ASC")
+    return query, (house_id, start, end)
+
+
+def check_format(fmt):
+    """
+    Raises ValueError for an unknown format, or a columnar one while pyarrow is missing.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"Format '{fmt}' is not available, pyarrow is not installed")
+
+
+def fetch_size(fmt):
+    return EXPORT_FETCH_SIZE if fmt == 'csv' else EXPORT_BATCH_ROWS
+
+
+def iter_batches(cursor, first_batch=None, size=EXPORT_FETCH_SIZE):
+    """
+    Yields the row batches of an executed cursor, starting with `first_batch`
+    when the caller already fetched one (e.g. to detect empty results).
+    """
+    batch = first_batch if first_batch is not None else cursor.fetchmany(size)
+    while batch:
+        yield batch
+        batch = cursor.fetchmany(size)
+
+
+def iter_rows(cursor, first_batch=None, fetch_size=EXPORT_FETCH_SIZE):
+    for batch in iter_batches(cursor, first_batch, fetch_size):
+        yield from batch
+
+
+def stream_csv(header, rows, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generator of CSV chunks (bytes) for `header` followed by `rows` (sequences).
+    With compress=True the chunks form one gzip stream.
+    """
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return gz.compress(data) if gz else data
+
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            chunk = drain()
+            if chunk:
+                yield chunk
+    chunk = drain()
+    if gz:
+        chunk += gz.flush()
+    if chunk:
+        yield chunk
+
+
+class _ChunkSink:
+    """
+    Write-only file object collecting what the Arrow writers emit until it is taken.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_schema(header):
+    """
+    Arrow schema of an export: the time column as timestamp (or date for
+    daily buckets), every reading as float64.
+    """
+    import pyarrow as pa
+    fields = []
+    for name in header:
+        if name in ('date_time', 'hour'):
+            fields.append(pa.field(name, pa.timestamp('s')))
+        elif name == 'day':
+            fields.append(pa.field(name, pa.date32()))
+        else:
+            fields.append(pa.field(name, pa.float64()))
+    return pa.schema(fields)
+
+
+def _float_array(values):
+    """
+    float64 array of a column of readings. DECIMAL values go through
+    decimal128 so no per-value float() is needed; the decimal -> float step
+    is done via their text form, which rounds correctly (1.2345 stays 1.2345).
+    """
+    import pyarrow as pa
+    sample = next((v for v in values if v is not None), None)
+    if sample is None or isinstance(sample, (int, float)):
+        return pa.array(values, type=pa.float64())
+    return pa.array(values, type=pa.decimal128(38, 4)).cast(pa.string()).cast(pa.float64())
+
+
+def record_batch(schema, rows):
+    """
+    Transposes a batch of row tuples into one typed Arrow record batch.
+    """
+    import pyarrow as pa
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_floating(field.type):
+            arrays.append(_float_array(values))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def stream_columnar(fmt, header, batches):
+    """
+    Generator of the bytes of a Parquet or Arrow IPC file holding `batches`
+    (lists of row tuples), yielded as each batch is written.
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema(header)
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression=EXPORT_PARQUET_COMPRESSION)
+        write = writer.write_batch
+    elif fmt == 'arrow':
+        options = pa.ipc.IpcWriteOptions(compression=EXPORT_ARROW_COMPRESSION)
+        writer = pa.ipc.new_file(pa.PythonFile(sink, mode='w'), schema, options=options)
+        write = writer.write_batch
+    else:
+        raise ValueError(f"Unknown columnar format '{fmt}'")
+
+    try:
+        for rows in batches:
+            write(record_batch(schema, rows))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    chunk = sink.take()
+    if chunk:
+        yield chunk
+
+
+def stream_export(fmt, header, batches, compress=False):
+    """
+    Generator of the export bytes in `fmt`; compress only applies to csv.
+    """
+    if fmt == 'csv':
+        return stream_csv(header, (row for batch in batches for row in batch), compress=compress)
+    return stream_columnar(fmt, header, batches)
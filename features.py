@@ -0,0 +1,28 @@
+"""
+Derived time features stored with every houses_consumption row.
+
+Weekday follows pandas' dayofweek (Monday=0), Hour is the hour of day and the
+cyclic encodings are sin/cos of Hour/24 and Weekday/7.
+"""
+import numpy as np
+import pandas as pd
+
+TIME_FEATURES = ['Weekday', 'Month', 'Hour', 'Hour_sin', 'Hour_cos', 'DoW_sin', 'DoW_cos']
+
+
+def time_features(timestamps):
+    """
+    DataFrame of the derived features for a sequence of timestamps.
+    """
+    index = pd.DatetimeIndex(timestamps)
+    hour = index.hour.to_numpy()
+    weekday = index.dayofweek.to_numpy()
+    return pd.DataFrame({
+        'Weekday': weekday,
+        'Month': index.month.to_numpy(),
+        'Hour': hour,
+        'Hour_sin': np.sin(2 * np.pi * hour / 24),
+        'Hour_cos': np.cos(2 * np.pi * hour / 24),
+        'DoW_sin': np.sin(2 * np.pi * weekday / 7),
+        'DoW_cos': np.cos(2 * np.pi * weekday / 7),
+    })
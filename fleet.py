@@ -0,0 +1,360 @@
+"""
+Synthetic fleet of houses with 15-minute readings, for load and scaling tests.
+
+Every circuit of schema.CIRCUITS has a profile (CIRCUIT_PROFILES):
+
+- continuous circuits: a base load plus daily peaks (gaussians over the hour
+  of day, shifted per house by up to an hour), scaled on weekends, with a
+  winter factor for lighting and heating/cooling terms driven by temperature
+- appliance circuits: cycles started at random, more likely around their
+  usual hours, each drawing a gamma-distributed amount of energy
+
+Each house gets a random size factor and random presence flags per circuit;
+absent circuits read 0. The weather (weather_series) is shared by the whole
+fleet and feeds the heating/cooling terms, so readings and weather match.
+
+Houses are generated in batches of about FLEET_BATCH_ROWS readings, each a
+set of (houses x slots) NumPy arrays per circuit, with no Python loop over
+rows. Batch b draws from SeedSequence(seed, spawn_key=(b,)), so the data only
+depends on the seed and the batch size, never on the number of workers.
+
+Batches are written as house_<id>.csv files in the source format read by
+seed-db.py (pyarrow's CSV writer when installed, pandas otherwise), or loaded
+straight into houses_consumption with LOAD DATA LOCAL INFILE.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+import ingest
+import layout
+import rollups
+from features import TIME_FEATURES, time_features
+from schema import CIRCUITS, CONSUMPTION_LAYOUT, ENERGY_COLUMNS, PRESENCE_COLUMNS, STORED_COLUMNS, TABLE_NAME
+from weather import WEATHER_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+load_dotenv()
+
+FLEET_BATCH_ROWS = int(os.getenv('FLEET_BATCH_ROWS', 2_000_000))  # readings generated per batch
+
+SLOTS_PER_DAY = 96
+SOURCE_COLUMNS = ['local_15min'] + ENERGY_COLUMNS + TIME_FEATURES + PRESENCE_COLUMNS
+
+# circuit -> profile, energies in kWh per 15 minutes:
+#   presence   share of houses that have the circuit
+#   base       constant load
+#   peaks      (hour, width in hours, weight) of the daily shape, scaled by `amplitude`
+#   weekend    factor on Saturdays and Sundays
+#   winter     extra share of the load at the winter solstice (lighting)
+#   heating    load per degree below HEATING_BASE, cooling per degree above COOLING_BASE
+#   cycles     (cycles per day, mean energy per 15 minutes) of appliances, started around the peaks
+#   noise      sigma of the multiplicative log-normal noise
+CIRCUIT_PROFILES = {
+    'bathroom1': dict(presence=0.85, base=0.002, amplitude=0.03, peaks=[(7, 1, 1.0), (21.5, 1.5, 0.5)],
+                      weekend=1.1, heating=0.003),
+    'bedroom1': dict(presence=0.9, base=0.01, amplitude=0.03, peaks=[(7, 1, 0.6), (22, 2, 1.0)],
+                     weekend=1.1, heating=0.002, cooling=0.006),
+    'bedroom2': dict(presence=0.7, base=0.008, amplitude=0.025, peaks=[(7, 1, 0.5), (21, 2, 1.0)],
+                     weekend=1.1, heating=0.002, cooling=0.005),
+    'clotheswasher1': dict(presence=0.8, base=0.0005, peaks=[(10, 2, 1.0), (18, 2, 0.7)],
+                           weekend=1.6, cycles=(0.5, 0.12)),
+    'livingroom1': dict(presence=0.9, base=0.015, amplitude=0.05, peaks=[(8, 1.5, 0.4), (20, 2.5, 1.0)],
+                        weekend=1.3, heating=0.004, cooling=0.01),
+    'dishwasher1': dict(presence=0.75, base=0.0005, peaks=[(20.5, 1.5, 1.0), (13, 1, 0.3)],
+                        weekend=1.2, cycles=(0.7, 0.25)),
+    'garage1': dict(presence=0.45, base=0.005, amplitude=0.02, peaks=[(18, 2, 1.0)], weekend=1.4),
+    'kitchen1': dict(presence=0.95, base=0.005, amplitude=0.04,
+                     peaks=[(7.5, 1, 0.7), (12.5, 1, 0.5), (18.5, 1.5, 1.0)], weekend=1.2),
+    'kitchenapp1': dict(presence=0.8, base=0.002, amplitude=0.03, peaks=[(7.5, 0.8, 1.0), (18.5, 1.2, 0.8)],
+                        weekend=1.2),
+    'kitchenapp2': dict(presence=0.6, base=0.001, amplitude=0.02, peaks=[(8, 1, 0.6), (18.5, 1.2, 1.0)],
+                        weekend=1.2),
+    'lights_plugs1': dict(presence=0.95, base=0.01, amplitude=0.06, peaks=[(7, 1, 0.4), (20.5, 2.5, 1.0)],
+                          weekend=1.1, winter=0.3),
+    'lights_plugs2': dict(presence=0.8, base=0.008, amplitude=0.05, peaks=[(7, 1, 0.4), (21, 2.5, 1.0)],
+                          weekend=1.1, winter=0.3),
+    'lights_plugs3': dict(presence=0.6, base=0.006, amplitude=0.04, peaks=[(7, 1, 0.3), (21, 2, 1.0)],
+                          weekend=1.1, winter=0.3),
+    'microwave1': dict(presence=0.85, base=0.001, peaks=[(7.5, 1, 0.6), (12.5, 1, 1.0), (19, 1.5, 0.8)],
+                       weekend=1.2, cycles=(2.0, 0.05)),
+    'office1': dict(presence=0.5, base=0.01, amplitude=0.05, peaks=[(10, 2, 1.0), (15, 2, 1.0)], weekend=0.6),
+    'range1': dict(presence=0.7, base=0.0005, peaks=[(18.5, 1, 1.0), (12.5, 1, 0.3)],
+                   weekend=1.3, cycles=(0.8, 0.4)),
+    'refrigerator1': dict(presence=0.98, base=0.03, amplitude=0.01, peaks=[(18, 3, 1.0)],
+                          weekend=1.0, cooling=0.003, noise=0.4),
+    'venthood1': dict(presence=0.5, base=0.0002, peaks=[(18.5, 1, 1.0)], weekend=1.3, cycles=(0.6, 0.02)),
+    'oven1': dict(presence=0.6, base=0.0005, peaks=[(18, 1, 1.0), (11, 1, 0.3)], weekend=1.5, cycles=(0.3, 0.6)),
+}
+
+HEATING_BASE = 15.0  # deg C
+COOLING_BASE = 22.0
+
+
+def slot_times(start, periods):
+    return pd.date_range(pd.Timestamp(start).floor('15min'), periods=periods, freq='15min')
+
+
+def daily_shape(peaks):
+    """
+    Shape of one day (SLOTS_PER_DAY values, max 1) from (hour, width, weight) peaks, wrapping at midnight.
+    """
+    hours = np.arange(SLOTS_PER_DAY) / 4
+    shape = np.zeros(SLOTS_PER_DAY)
+    for hour, width, weight in peaks:
+        distance = np.abs(hours - hour)
+        distance = np.minimum(distance, 24 - distance)
+        shape += weight * np.exp(-distance ** 2 / (2 * width ** 2))
+    return shape / shape.max()
+
+
+def weather_series(times, seed):
+    """
+    DataFrame (local_15min + WEATHER_COLUMNS) of a mid-latitude climate: a
+    seasonal and a diurnal cycle, multi-day warm/cold spells, rain that raises
+    the humidity and clouds, and matching dew point, pressure and wind.
+    """
+    # spawn key no batch uses, so the weather is independent of the readings
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(2 ** 31,)))
+    periods = len(times)
+    doy = np.asarray(times.dayofyear) - 1
+    hour = np.asarray(times.hour + times.minute / 60)
+    days = (periods + SLOTS_PER_DAY - 1) // SLOTS_PER_DAY + 10
+    # Warm/cold spells: daily noise smoothed over about five days
+    spells = np.convolve(rng.normal(0, 3.0, days), np.ones(5) / np.sqrt(5), mode='same')
+    spell = np.repeat(spells, SLOTS_PER_DAY)[:periods]
+    temp = (18 - 10 * np.cos(2 * np.pi * (doy - 15) / 365.25)
+            - 5 * np.cos(2 * np.pi * (hour - 4) / 24) + spell + rng.normal(0, 0.6, periods))
+    # Rain: wet days, showers mostly in the afternoon
+    wet = np.repeat(rng.random(days) < 0.25, SLOTS_PER_DAY)[:periods]
+    showers = wet & (rng.random(periods) < 0.08 + 0.1 * np.exp(-((hour - 16) ** 2) / 8))
+    prcp = np.where(showers, rng.exponential(1.2, periods), 0.0)
+    spread = np.where(wet, rng.uniform(0.5, 3, periods), rng.uniform(3, 12, periods))
+    dwpt = temp - spread
+    # Magnus formula
+    rhum = 100 * np.exp(17.625 * dwpt / (243.04 + dwpt) - 17.625 * temp / (243.04 + temp))
+    coco = np.select([prcp > 2, prcp > 0, wet, rng.random(periods) < 0.3], [8, 7, 4, 3], default=1)
+    return pd.DataFrame({
+        'local_15min': times,
+        'temp': np.round(temp, 1),
+        'dwpt': np.round(dwpt, 1),
+        'rhum': np.round(rhum, 0),
+        'prcp': np.round(prcp, 1),
+        'wdir': np.round(rng.uniform(0, 360, periods), 0),
+        'wspd': np.round(rng.gamma(2.0, 4.0, periods) + 5 * wet, 1),
+        'pres': np.round(1015 - 6 * wet + np.repeat(rng.normal(0, 4, days), SLOTS_PER_DAY)[:periods], 1),
+        'coco': coco,
+    })[['local_15min'] + WEATHER_COLUMNS]
+
+
+def generate_batch(houses, times, temp, seed, batch):
+    """
+    Readings of `houses` houses over `times`: (presence, values) with presence a
+    (houses, circuits) bool array and values a (circuits + total, houses, slots)
+    float32 array in ENERGY_COLUMNS order.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch,)))
+    periods = len(times)
+    slot = np.asarray(times.hour * 4 + times.minute // 15)
+    weekend = np.asarray(times.dayofweek >= 5)
+    doy = np.asarray(times.dayofyear)
+    winter = np.cos(2 * np.pi * (doy - 355) / 365.25).clip(0).astype(np.float32)
+    temp = np.asarray(temp, dtype=np.float32)
+    hdd = np.maximum(HEATING_BASE - temp, 0)
+    cdd = np.maximum(temp - COOLING_BASE, 0)
+
+    size = rng.lognormal(0, 0.35, houses).astype(np.float32)[:, None]
+    shift = rng.integers(-4, 5, houses)[:, None]  # daily routine offset, in 15-minute slots
+    shifted = (slot[None, :] + shift) % SLOTS_PER_DAY
+    presence = np.empty((houses, len(CIRCUITS)), dtype=bool)
+    values = np.zeros((len(ENERGY_COLUMNS), houses, periods), dtype=np.float32)
+
+    for i, circuit in enumerate(CIRCUITS):
+        profile = CIRCUIT_PROFILES[circuit]
+        presence[:, i] = rng.random(houses) < profile['presence']
+        shape = daily_shape(profile['peaks']).astype(np.float32)
+        day_factor = np.where(weekend, profile.get('weekend', 1.0), 1.0).astype(np.float32)
+        load = np.full((houses, periods), profile['base'], dtype=np.float32)
+        if profile.get('amplitude'):
+            load += profile['amplitude'] * shape[shifted] * day_factor
+        if profile.get('winter'):
+            load *= 1 + profile['winter'] * winter
+        if profile.get('heating'):
+            load += profile['heating'] * hdd
+        if profile.get('cooling'):
+            load += profile['cooling'] * cdd
+        noise = rng.standard_normal((houses, periods), dtype=np.float32)
+        load *= np.exp(profile.get('noise', 0.25) * noise)
+        if profile.get('cycles'):
+            per_day, energy = profile['cycles']
+            chance = (per_day * shape / shape.sum()).astype(np.float32)[shifted] * day_factor
+            started = rng.random((houses, periods), dtype=np.float32) < chance
+            load[started] += rng.gamma(2.0, energy / 2, int(started.sum())).astype(np.float32)
+        load *= size * presence[:, i:i + 1]
+        values[i] = load
+    values[:len(CIRCUITS)] = np.round(values[:len(CIRCUITS)], 4)
+    values[-1] = values[:len(CIRCUITS)].sum(axis=0)
+    return presence, values
+
+
+def batches(house_ids, periods, batch_rows=FLEET_BATCH_ROWS):
+    """
+    (batch index, house ids) of the batches of about batch_rows readings.
+    """
+    per_batch = max(batch_rows // max(periods, 1), 1)
+    return [(b, house_ids[i:i + per_batch]) for b, i in enumerate(range(0, len(house_ids), per_batch))]
+
+
+def _decimals(column):
+    # float32 -> float64 rounding so the text form is the 4-decimal value, not its float32 neighbour
+    return np.round(column.astype(np.float64), 4)
+
+
+def house_table(times_text, features, presence, values, h):
+    """
+    Columns of house `h` of a batch, in SOURCE_COLUMNS order.
+    """
+    columns = {'local_15min': times_text}
+    for i, name in enumerate(ENERGY_COLUMNS):
+        columns[name] = _decimals(values[i, h])
+    columns.update(features)
+    for i, name in enumerate(PRESENCE_COLUMNS):
+        columns[name] = np.full(len(times_text), int(presence[h, i]), dtype=np.int8)
+    return columns
+
+
+def write_csv(path, columns):
+    if pa_csv is not None:
+        pa_csv.write_csv(pa.table(columns), path)
+    else:
+        pd.DataFrame(columns).to_csv(path, index=False)
+
+
+def write_batch_csv(out_dir, batch, house_ids, start, periods, temp, seed):
+    """
+    Generates one batch and writes a house_<id>.csv per house. Returns (houses, rows).
+    """
+    times = slot_times(start, periods)
+    presence, values = generate_batch(len(house_ids), times, temp, seed, batch)
+    times_text = np.asarray(times.strftime('%Y-%m-%d %H:%M:%S'))
+    features = {c: v.to_numpy() for c, v in time_features(times).items()}
+    for h, house in enumerate(house_ids):
+        write_csv(os.path.join(out_dir, f"house_{house}.csv"), house_table(times_text, features, presence, values, h))
+    return len(house_ids), len(house_ids) * periods
+
+
+def table_rows(house_ids, times, presence, values):
+    """
+    DataFrame of a batch in STORED_COLUMNS order (houses_consumption rows).
+    """
+    houses, periods = len(house_ids), len(times)
+    data = {
+        'date_time': np.tile(np.asarray(times.strftime('%Y-%m-%d %H:%M:%S')), houses),
+        'house_id': np.repeat(np.asarray(house_ids), periods),
+    }
+    for i, name in enumerate(ENERGY_COLUMNS):
+        data[name] = _decimals(values[i].reshape(-1))
+    for name, column in time_features(times).items():
+        data[name] = np.tile(column.to_numpy(), houses)
+    for i, name in enumerate(PRESENCE_COLUMNS):
+        data[name] = np.repeat(presence[:, i].astype(np.int8), periods)
+    return pd.DataFrame(data)[STORED_COLUMNS]
+
+
+def load_batch(conn, batch, house_ids, start, periods, temp, seed):
+    """
+    Generates one batch and loads it into houses_consumption with LOAD DATA
+    LOCAL INFILE, then refreshes the rollups and watermarks of its houses.
+    Returns (houses, rows).
+    """
+    times = slot_times(start, periods)
+    presence, values = generate_batch(len(house_ids), times, temp, seed, batch)
+    df = table_rows(house_ids, times, presence, values)
+    cursor = conn.cursor()
+    if CONSUMPTION_LAYOUT == 'compact':
+        for h, house in enumerate(house_ids):
+            layout.update_house_circuits(cursor, house, {c for i, c in enumerate(CIRCUITS) if presence[h, i]})
+    fd, tmp_path = tempfile.mkstemp(prefix='fleet_', suffix='.csv')
+    os.close(fd)
+    try:
+        write_csv_rows(tmp_path, df)
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {TABLE_NAME} "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+            f"({', '.join(df.columns)})",
+            (tmp_path,))
+    finally:
+        os.remove(tmp_path)
+    conn.commit()
+    first, last = times[0].to_pydatetime(), times[-1].to_pydatetime()
+    ingest.create_watermark_table(cursor)
+    for house in house_ids:
+        rollups.refresh_rollups(cursor, house, first, last)
+        ingest.set_watermark(cursor, house, last)
+        conn.commit()
+    cursor.close()
+    return len(house_ids), len(df)
+
+
+def write_csv_rows(path, df):
+    """
+    Headerless CSV of a DataFrame, as read by LOAD DATA.
+    """
+    if pa_csv is not None:
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path,
+                         pa_csv.WriteOptions(include_header=False, quoting_style='none'))
+    else:
+        df.to_csv(path, index=False, header=False, lineterminator='\n')
+
+
+def _run_batch(task):
+    kind, out_dir, batch, house_ids, start, periods, temp, seed = task
+    if kind == 'csv':
+        return write_batch_csv(out_dir, batch, house_ids, start, periods, temp, seed)
+    import db
+    conn = db.connect(allow_local_infile=True)
+    try:
+        return load_batch(conn, batch, house_ids, start, periods, temp, seed)
+    finally:
+        conn.close()
+
+
+def generate_fleet(house_ids, start, periods, seed, out_dir=None, weather_path=None,
+                   load=False, workers=1, batch_rows=FLEET_BATCH_ROWS, progress=print):
+    """
+    Generates the fleet and writes it as house CSVs into out_dir, or with
+    load=True into the database (the houses must be registered). The weather
+    series is written to weather_path when given. Returns (houses, rows).
+    """
+    times = slot_times(start, periods)
+    weather = weather_series(times, seed)
+    if weather_path:
+        os.makedirs(os.path.dirname(weather_path) or '.', exist_ok=True)
+        weather.assign(local_15min=times.strftime('%Y-%m-%d %H:%M:%S')).to_csv(weather_path, index=False)
+    if not load:
+        os.makedirs(out_dir, exist_ok=True)
+    temp = weather['temp'].to_numpy(dtype=np.float32)
+    tasks = [('load' if load else 'csv', out_dir, b, ids, start, periods, temp, seed)
+             for b, ids in batches(list(house_ids), periods, batch_rows)]
+    houses = rows = 0
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_run_batch, tasks)
+            for done_houses, done_rows in results:
+                houses, rows = houses + done_houses, rows + done_rows
+                progress(f"{houses}/{len(house_ids)} houses, {rows:,} rows")
+    else:
+        for task in tasks:
+            done_houses, done_rows = _run_batch(task)
+            houses, rows = houses + done_houses, rows + done_rows
+            progress(f"{houses}/{len(house_ids)} houses, {rows:,} rows")
+    return houses, rows
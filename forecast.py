@@ -0,0 +1,202 @@
+"""
+Per-house energy forecasting.
+
+Each house gets a ridge regression of the 15-minute total_energy on the time
+features already stored in houses_consumption (Hour_sin/cos and their second
+harmonic, DoW_sin/cos, Month as sin/cos) and optionally the outdoor temperature
+from the weather store. Models are kept as sufficient statistics (X'X, X'y),
+so new readings are folded in without revisiting the history and a refit is a
+small linear solve. Forecasts for many houses share one design matrix.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+import weather
+from features import time_features
+
+load_dotenv()
+
+READINGS_PER_DAY = 96
+RIDGE_LAMBDA = float(os.getenv('FORECAST_RIDGE_LAMBDA', 1.0))
+HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', 365))
+REFRESH_SECONDS = int(os.getenv('FORECAST_REFRESH_SECONDS', 900))
+USE_WEATHER = os.getenv('FORECAST_USE_WEATHER', '0') == '1'
+
+# Columns the loader has to return, ordered by date_time
+TRAINING_COLUMNS = ['date_time', 'Hour_sin', 'Hour_cos', 'DoW_sin', 'DoW_cos', 'Month', 'total_energy']
+
+
+def design_matrix(hour_sin, hour_cos, dow_sin, dow_cos, month, temp=None):
+    """
+    Stacks the regression features, one row per reading.
+    """
+    month_angle = 2 * np.pi * (np.asarray(month, dtype=np.float64) - 1) / 12
+    columns = [
+        np.ones(len(hour_sin)),
+        hour_sin, hour_cos,
+        2 * hour_sin * hour_cos,            # sin(2h)
+        hour_cos ** 2 - hour_sin ** 2,      # cos(2h)
+        dow_sin, dow_cos,
+        np.sin(month_angle), np.cos(month_angle),
+    ]
+    if temp is not None:
+        columns += [temp, temp ** 2]
+    return np.column_stack(columns).astype(np.float64)
+
+
+def _temperatures(times, fill):
+    """
+    Outdoor temperature at each timestamp from the weather store; gaps take `fill`.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    frame = weather.get_store().frame(times[0], times[-1] + np.timedelta64(1, 's'))
+    temp = np.full(len(times), np.nan)
+    if len(frame):
+        ref = frame['local_15min'].to_numpy(dtype='datetime64[ns]')
+        pos = np.clip(np.searchsorted(ref, times), 0, len(ref) - 1)
+        match = ref[pos] == times
+        temp[match] = frame['temp'].to_numpy()[pos[match]]
+    temp[np.isnan(temp)] = fill
+    return temp
+
+
+class HouseModel:
+    """
+    Sufficient statistics and coefficients of one house's regression.
+    """
+
+    def __init__(self, n_features):
+        self.xtx = np.zeros((n_features, n_features))
+        self.xty = np.zeros(n_features)
+        self.rows = 0
+        self.temp_sum = 0.0
+        self.watermark = None       # last date_time folded into the statistics
+        self.checked_at = 0.0       # monotonic time of the last look for new rows
+        self.version = None         # data version of the house at that look
+        self.coef = None
+        self.lock = threading.Lock()
+
+    @property
+    def temp_mean(self):
+        return self.temp_sum / self.rows if self.rows else 0.0
+
+    def add(self, frame, use_weather):
+        watermark = frame['date_time'].iloc[-1].to_pydatetime()
+        # DECIMAL readings arrive as Decimal objects, NULLs as None
+        numeric = frame[TRAINING_COLUMNS[1:]].apply(pd.to_numeric, errors='coerce').astype(np.float64)
+        keep = numeric.notna().all(axis=1).to_numpy()
+        numeric = numeric[keep]
+        self.watermark = watermark
+        if not len(numeric):
+            return 0
+        temp = None
+        if use_weather:
+            temp = _temperatures(frame['date_time'].to_numpy()[keep], self.temp_mean)
+            self.temp_sum += float(temp.sum())
+        X = design_matrix(*(numeric[c].to_numpy()
+                            for c in ['Hour_sin', 'Hour_cos', 'DoW_sin', 'DoW_cos', 'Month']), temp)
+        y = numeric['total_energy'].to_numpy()
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        self.rows += len(y)
+        penalty = RIDGE_LAMBDA * np.eye(len(self.xty))
+        penalty[0, 0] = 0.0  # leave the intercept unpenalized
+        self.coef = np.linalg.solve(self.xtx + penalty, self.xty)
+        return len(y)
+
+
+class ForecastEngine:
+    """
+    Keeps one fitted model per house.
+
+    loader(house_id, since, until) must return the TRAINING_COLUMNS rows of
+    the house with since < date_time <= until, ordered by date_time.
+    version(house_id), when given, returns the house's data version (see
+    QueryCache.version); a model whose version changed looks for new rows on
+    the next forecast, so ingests by other processes are picked up too.
+    """
+
+    def __init__(self, loader, use_weather=USE_WEATHER, refresh_seconds=REFRESH_SECONDS, version=None):
+        self.loader = loader
+        self.version = version
+        self.use_weather = use_weather
+        self.refresh_seconds = refresh_seconds
+        self.n_features = 11 if use_weather else 9
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, house_id):
+        with self._lock:
+            model = self._models.get(house_id)
+            if model is None:
+                model = self._models[house_id] = HouseModel(self.n_features)
+            return model
+
+    def mark_stale(self, house_id):
+        """
+        Forces a look for new rows on the next forecast (called by the live readings writer).
+        """
+        model = self._models.get(house_id)
+        if model is not None:
+            model.checked_at = 0.0
+
+    def refresh(self, house_id, now):
+        """
+        Folds readings newer than the model's watermark into its statistics.
+        """
+        model = self._model(house_id)
+        version = self.version(house_id) if self.version else None
+        with model.lock:
+            if (model.coef is not None and version == model.version
+                    and time.monotonic() - model.checked_at < self.refresh_seconds):
+                return model
+            since = model.watermark
+            if since is None:
+                since = now - timedelta(days=HISTORY_DAYS)
+            rows = self.loader(house_id, since, now)
+            model.checked_at = time.monotonic()
+            model.version = version
+            if rows:
+                frame = pd.DataFrame(list(rows), columns=TRAINING_COLUMNS)
+                frame['date_time'] = pd.to_datetime(frame['date_time'])
+                added = model.add(frame, self.use_weather)
+                print(f"Forecast model for house {house_id}: +{added} rows ({model.rows} total)")
+        if model.coef is None:
+            raise ValueError(f"No consumption history to fit a forecast for house {house_id}")
+        return model
+
+    def _future(self, start, days, fill_temp):
+        times = pd.date_range(start, periods=days * READINGS_PER_DAY, freq='15min')
+        f = time_features(times)
+        temp = None
+        if self.use_weather:
+            temp = _temperatures(times.to_numpy(), fill_temp)
+        X = design_matrix(f['Hour_sin'].to_numpy(), f['Hour_cos'].to_numpy(),
+                          f['DoW_sin'].to_numpy(), f['DoW_cos'].to_numpy(),
+                          f['Month'].to_numpy(), temp)
+        return times, X
+
+    def forecast_many(self, house_ids, start, days, now=None):
+        """
+        Daily totals for `days` days from `start` (midnight) for every house:
+        {house_id: [{'date', 'total_energy'}]}. One matrix product covers all houses.
+        """
+        now = now or datetime.now()
+        models = [self.refresh(h, now) for h in house_ids]
+        fill_temp = float(np.mean([m.temp_mean for m in models])) if models else 0.0
+        times, X = self._future(start, days, fill_temp)
+        coefs = np.column_stack([m.coef for m in models])        # features x houses
+        predicted = np.clip(X @ coefs, 0, None)                  # readings x houses
+        daily = predicted.reshape(days, READINGS_PER_DAY, len(models)).sum(axis=1)
+        dates = [d.date() for d in times[::READINGS_PER_DAY]]
+        return {h: [{'date': d, 'total_energy': round(float(v), 4)} for d, v in zip(dates, daily[:, i])]
+                for i, h in enumerate(house_ids)}
+
+    def forecast(self, house_id, start, days, now=None):
+        return self.forecast_many([house_id], start, days, now)[house_id]
@@ -0,0 +1,76 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+import fleet
+
+load_dotenv()
+
+CSV_FILE_PATH = os.getenv('CSV_FILE_PATH')
+SEED_HOUSE_OWNER = int(os.getenv('SEED_HOUSE_OWNER', 1))
+FLEET_WORKERS = int(os.getenv('FLEET_WORKERS', os.cpu_count() or 1))
+
+
+def register_houses(house_ids, owner):
+    """
+    Inserts the houses that are not in the houses table yet, owned by `owner`.
+    """
+    import db
+    conn = db.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT id FROM houses")
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = sorted(set(house_ids) - existing)
+        if missing:
+            cursor.executemany("INSERT INTO houses (id, user_id) VALUES (%s, %s)", [(h, owner) for h in missing])
+            conn.commit()
+        cursor.close()
+        return missing
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic fleet of houses with 15-minute readings.")
+    parser.add_argument('--houses', type=int, default=1000, help="number of houses")
+    parser.add_argument('--first-house', type=int, default=100000, help="id of the first house, the others follow")
+    parser.add_argument('--days', type=int, default=730, help="days of readings per house")
+    parser.add_argument('--end', default='2025-06-01',
+                        help="last day of readings, YYYY-MM-DD (default: the API's DATE_TODAY)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed; the same seed gives the same fleet")
+    parser.add_argument('--out', default=CSV_FILE_PATH or 'fleet',
+                        help="directory of the house_<id>.csv files (default: CSV_FILE_PATH or ./fleet)")
+    parser.add_argument('--weather', help="weather CSV to write (default: <out>/weather_data.csv)")
+    parser.add_argument('--load', action='store_true',
+                        help="load the readings straight into houses_consumption instead of writing CSV files")
+    parser.add_argument('--owner', type=int, default=SEED_HOUSE_OWNER, help="with --load, user id of new houses")
+    parser.add_argument('--workers', type=int, default=FLEET_WORKERS, help="worker processes")
+    parser.add_argument('--batch-rows', type=int, default=fleet.FLEET_BATCH_ROWS, help="readings generated per batch")
+    args = parser.parse_args()
+
+    end = datetime.strptime(args.end, '%Y-%m-%d')
+    start = end - timedelta(days=args.days - 1)
+    periods = args.days * fleet.SLOTS_PER_DAY
+    house_ids = list(range(args.first_house, args.first_house + args.houses))
+    weather_path = args.weather or os.path.join(args.out, 'weather_data.csv')
+
+    if args.load:
+        added = register_houses(house_ids, args.owner)
+        print(f"Registered {len(added)} new houses under user {args.owner}.")
+
+    print(f"Generating {args.houses} houses x {periods} readings ({args.houses * periods:,} rows) "
+          f"from {start.date()} to {end.date()} with {args.workers} workers.")
+    started = time.perf_counter()
+    houses, rows = fleet.generate_fleet(
+        house_ids, start, periods, args.seed, out_dir=args.out, weather_path=weather_path,
+        load=args.load, workers=args.workers, batch_rows=args.batch_rows,
+        progress=lambda message: print(f"  {message} ({time.perf_counter() - started:.1f}s)"))
+    elapsed = time.perf_counter() - started
+    print(f"{'Loaded' if args.load else 'Wrote'} {rows:,} readings of {houses} houses in {elapsed:.1f}s "
+          f"({rows / max(elapsed, 1e-9):,.0f} rows/s). Weather: {weather_path}")
+    if not args.load:
+        print(f"Load them with: CSV_FILE_PATH={os.path.join(args.out, '')} python seed-db.py --all")
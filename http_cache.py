@@ -0,0 +1,125 @@
+"""
+HTTP-level caching and compression of the range endpoints.
+
+Every cacheable response carries a weak ETag derived from the house, the
+endpoint, the requested range, the query parameters and the house's data
+version (bumped by QueryCache.invalidate whenever its readings change). A
+request whose If-None-Match holds that ETag is answered 304 before any query
+runs. Ranges that ended before today may be reused for HTTP_CACHE_MAX_AGE
+seconds and are then revalidated, so a backfill is seen once that has passed;
+open ranges must be revalidated on every use.
+
+ETags are only sent when the data versions are shared by every process
+(QueryCache.shared): otherwise an ingest script cannot bump the version the
+API answers with, and every response is sent as UNCACHED.
+
+JSON and text bodies of at least COMPRESS_MIN_BYTES are compressed with
+brotli (when the module is installed and the client accepts it) or gzip.
+Streamed bodies (downloads, SSE) are left alone; CSV downloads have ?gzip=1.
+"""
+import gzip
+import hashlib
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 3600))  # seconds, closed ranges
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))  # gzip 1-9; brotli uses min(level, 11)
+
+COMPRESSIBLE = {'application/json', 'text/plain', 'text/csv'}
+
+UNCACHED = "private, no-cache"
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def etag(house_id, endpoint, start, end, version, variant=''):
+    """
+    Opaque tag of one response; `variant` covers the query parameters that shape the body.
+    """
+    key = f"{house_id}|{endpoint}|{start.isoformat()}|{end.isoformat()}|{version}|{variant}"
+    return hashlib.sha1(key.encode()).hexdigest()[:32]
+
+
+def variant(params):
+    """
+    Canonical form of the query parameters, (name, value) pairs in any order.
+    """
+    return '&'.join(f"{k}={v}" for k, v in sorted(params))
+
+
+def if_none_match(header, tag):
+    """
+    True if an If-None-Match header value lists `tag` (weak comparison) or is '*'.
+    """
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate.strip('"') == tag:
+            return True
+    return False
+
+
+def cache_control(end, today):
+    if _day(end) < _day(today):
+        return f"private, max-age={HTTP_CACHE_MAX_AGE}"
+    return UNCACHED
+
+
+def cache_headers(tag, end, today):
+    return {
+        'ETag': f'W/"{tag}"',
+        'Cache-Control': cache_control(end, today),
+        'Vary': 'Authorization, Accept-Encoding',
+    }
+
+
+def pick_encoding(accept_encoding):
+    """
+    'br', 'gzip' or None for an Accept-Encoding header value.
+    """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    wildcard = accepted.get('*', 0.0)
+    if brotli is not None and accepted.get('br', wildcard) > 0:
+        return 'br'
+    if accepted.get('gzip', wildcard) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(COMPRESS_LEVEL, 11))
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+
+
+def should_compress(mimetype, body, content_encoding=None):
+    return (content_encoding is None and mimetype in COMPRESSIBLE
+            and len(body) >= COMPRESS_MIN_BYTES)
@@ -0,0 +1,374 @@
+"""
+Bounded-memory streaming ingest of one house's meter CSV.
+
+The file is read in chunks of INGEST_CHUNK_ROWS rows. A pipeline thread
+parses and converts chunk N+1 (vectorized, per column) while the main thread
+writes chunk N to MySQL, with at most INGEST_PIPELINE_DEPTH converted chunks
+waiting in between, so peak memory is bounded by the chunk size whatever the
+file size.
+
+Every written chunk is committed together with the rollups of the hours it
+touched, and the number of data rows committed so far is saved to a
+checkpoint file (INGEST_CHECKPOINT_DIR). A load that fails midway resumes
+from that offset on the next run.
+
+Rows are written with INSERT ... ON DUPLICATE KEY UPDATE, so re-loading a
+range is idempotent, and each commit advances the house's high-watermark in
+ingest_watermarks. IncrementalIngest uses that watermark to apply only the
+rows newer than it (minus INGEST_LOOKBACK_HOURS, to pick up late
+corrections), so a daily refresh costs only the new rows.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import layout
+import rollups
+import query_cache
+from schema import CIRCUITS, CONSUMPTION_LAYOUT, READING_COLUMNS, PRESENCE_COLUMNS, STORED_COLUMNS, TABLE_NAME
+
+load_dotenv()
+
+INGEST_CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', 50000))
+INGEST_PIPELINE_DEPTH = int(os.getenv('INGEST_PIPELINE_DEPTH', 2))
+INGEST_CHECKPOINT_DIR = os.getenv('INGEST_CHECKPOINT_DIR', '.ingest')
+INGEST_LOOKBACK_HOURS = int(os.getenv('INGEST_LOOKBACK_HOURS', 24))
+
+WATERMARK_TABLE = 'ingest_watermarks'
+
+SOURCE_TIME_COLUMN = 'local_15min'
+VALUE_COLUMNS = [c for c in READING_COLUMNS if c not in ('date_time', 'house_id') and c not in PRESENCE_COLUMNS]
+
+_DONE = object()
+
+
+class Checkpoint:
+    """
+    Resume point of one (house, file) load: data rows committed, loaded time range
+    and whether the file was fully processed.
+    """
+
+    def __init__(self, path, house_id, checkpoint_dir=INGEST_CHECKPOINT_DIR):
+        name = f"{house_id}_{os.path.basename(path)}.json"
+        self.path = os.path.join(checkpoint_dir, name)
+        self.state = {'source': os.path.abspath(path), 'house_id': house_id,
+                      'offset': 0, 'first': None, 'last': None, 'done': False}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    @property
+    def offset(self):
+        return self.state['offset']
+
+    def save(self, **changes):
+        self.state.update(changes)
+        self.state['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.save(offset=0, first=None, last=None, done=False)
+
+
+def read_chunks(path, skip_rows=0, chunk_rows=INGEST_CHUNK_ROWS):
+    """
+    Raw DataFrame chunks of the source file, skipping the first `skip_rows` data rows.
+    """
+    return pd.read_csv(
+        path,
+        usecols=[SOURCE_TIME_COLUMN] + VALUE_COLUMNS + PRESENCE_COLUMNS,
+        skiprows=range(1, skip_rows + 1) if skip_rows else None,
+        chunksize=chunk_rows)
+
+
+def prepare_chunk(chunk, house_id, since=None):
+    """
+    Converts a raw chunk into DB-ready row tuples in READING_COLUMNS order,
+    keeping only readings after `since` when given.
+    Returns (rows, first, last) with first/last the time range of the kept rows,
+    or None when nothing is left.
+    """
+    times = pd.to_datetime(chunk[SOURCE_TIME_COLUMN])
+    if since is not None:
+        keep = times > since
+        if not keep.any():
+            return None
+        chunk, times = chunk[keep], times[keep]
+    df = pd.DataFrame({
+        'date_time': times.dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'house_id': house_id,
+    })
+    for column in VALUE_COLUMNS:
+        df[column] = pd.to_numeric(chunk[column], errors='coerce')
+    for column in PRESENCE_COLUMNS:
+        df[column] = chunk[column].fillna(0).astype('int8')
+    # object columns box numpy scalars into Python ones, NaN becomes NULL
+    values = df.astype(object).where(df.notna(), None).to_numpy()
+    return list(map(tuple, values)), times.min().to_pydatetime(), times.max().to_pydatetime()
+
+
+def upsert_query(table_name=TABLE_NAME):
+    """
+    Multi-row capable INSERT of the STORED_COLUMNS that overwrites the readings
+    of an existing (date_time, house_id).
+    """
+    placeholders = ', '.join(['%s'] * len(STORED_COLUMNS))
+    updates = ', '.join(f"{c} = VALUES({c})" for c in STORED_COLUMNS if c not in ('date_time', 'house_id'))
+    return (f"INSERT INTO {table_name} ({', '.join(STORED_COLUMNS)}) VALUES ({placeholders}) "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+def merge_query(table_name=TABLE_NAME):
+    """
+    upsert_query for partial readings: on an existing (date_time, house_id) a
+    circuit sent as NULL keeps its stored value, a presence flag is never
+    cleared and total_energy becomes the sum of the merged circuits (the
+    assignments run in order, so it sees the updated circuit columns).
+    """
+    placeholders = ', '.join(['%s'] * len(STORED_COLUMNS))
+    updates = []
+    for c in STORED_COLUMNS:
+        if c in CIRCUITS:
+            updates.append(f"{c} = COALESCE(VALUES({c}), {c})")
+        elif c == 'total_energy':
+            updates.append(f"{c} = {' + '.join(f'COALESCE({circuit}, 0)' for circuit in CIRCUITS)}")
+        elif c in PRESENCE_COLUMNS:
+            updates.append(f"{c} = GREATEST({c}, VALUES({c}))")
+        elif c not in ('date_time', 'house_id'):
+            updates.append(f"{c} = VALUES({c})")
+    return (f"INSERT INTO {table_name} ({', '.join(STORED_COLUMNS)}) VALUES ({placeholders}) "
+            f"ON DUPLICATE KEY UPDATE {', '.join(updates)}")
+
+
+def write_readings(cursor, rows, table_name=TABLE_NAME, merge=False):
+    """
+    Upserts rows given in READING_COLUMNS order, with `merge` as partial
+    readings (see merge_query) instead of overwriting the whole slot. With the
+    compact layout the presence flags go to the house circuits table and only
+    the stored prefix of each row is written.
+    """
+    if CONSUMPTION_LAYOUT == 'compact':
+        for house_id, present in layout.presence_from_rows(rows).items():
+            layout.update_house_circuits(cursor, house_id, present)
+        rows = [row[:len(STORED_COLUMNS)] for row in rows]
+    cursor.executemany(merge_query(table_name) if merge else upsert_query(table_name), rows)
+
+
+def create_watermark_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            house_id INT NOT NULL PRIMARY KEY,
+            high_watermark DATETIME NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (house_id) REFERENCES houses(id)
+        ) ENGINE=InnoDB;
+        """)
+
+
+def _scalar(row):
+    if row is None:
+        return None
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def get_watermark(cursor, house_id):
+    """
+    Latest reading time ingested for the house. Houses loaded before
+    watermarks were tracked fall back to their newest stored reading.
+    """
+    cursor.execute(f"SELECT high_watermark FROM {WATERMARK_TABLE} WHERE house_id = %s", (house_id,))
+    watermark = _scalar(cursor.fetchone())
+    if watermark is None:
+        cursor.execute(f"SELECT MAX(date_time) FROM {TABLE_NAME} WHERE house_id = %s", (house_id,))
+        watermark = _scalar(cursor.fetchone())
+    return watermark
+
+
+def set_watermark(cursor, house_id, value):
+    """
+    Moves the house's watermark forward to `value` (never backwards);
+    the caller commits it together with the readings.
+    """
+    cursor.execute(
+        f"INSERT INTO {WATERMARK_TABLE} (house_id, high_watermark) VALUES (%s, %s) "
+        f"ON DUPLICATE KEY UPDATE high_watermark = GREATEST(high_watermark, VALUES(high_watermark))",
+        (house_id, value))
+
+
+def print_progress(stats):
+    print(f"House {stats['house_id']}: {stats['rows']} rows written (offset {stats['offset']}), "
+          f"{stats['rows_per_sec']:,.0f} rows/s, last reading {stats['last']}.")
+
+
+class StreamingIngest:
+    """
+    Streams one house file into houses_consumption over `conn`.
+    `on_progress(stats)` is called after every committed chunk.
+    """
+
+    def __init__(self, conn, path, house_id, chunk_rows=INGEST_CHUNK_ROWS,
+                 depth=INGEST_PIPELINE_DEPTH, checkpoint_dir=INGEST_CHECKPOINT_DIR,
+                 table_name=TABLE_NAME, on_progress=print_progress):
+        self.conn = conn
+        self.path = path
+        self.house_id = house_id
+        self.chunk_rows = chunk_rows
+        self.depth = depth
+        self.table_name = table_name
+        self.on_progress = on_progress
+        self.checkpoint = Checkpoint(path, house_id, checkpoint_dir)
+        self.stats = {'house_id': house_id, 'rows': 0, 'batches': 0, 'offset': self.checkpoint.offset,
+                      'elapsed': 0.0, 'rows_per_sec': 0.0, 'parse_seconds': 0.0, 'write_seconds': 0.0,
+                      'first': self.checkpoint.state['first'], 'last': self.checkpoint.state['last']}
+
+    def source_chunks(self):
+        """
+        (source rows consumed, prepared chunk or None) for the part of the file still to load.
+        """
+        for chunk in read_chunks(self.path, self.checkpoint.offset, self.chunk_rows):
+            yield len(chunk), prepare_chunk(chunk, self.house_id)
+
+    def chunk_written(self, consumed, first, last):
+        loaded_first = self.checkpoint.state['first']
+        self.checkpoint.save(
+            offset=self.checkpoint.offset + consumed,
+            first=min(loaded_first, first.isoformat()) if loaded_first else first.isoformat(),
+            last=max(self.checkpoint.state['last'] or '', last.isoformat()))
+        self.stats.update(offset=self.checkpoint.offset, first=self.checkpoint.state['first'],
+                          last=self.checkpoint.state['last'])
+
+    def finished(self):
+        self.checkpoint.save(done=True)
+
+    def _produce(self, batches, stop):
+        """
+        Pipeline thread: parses and converts the chunks ahead of the writer.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            started = time.perf_counter()
+            for consumed, prepared in self.source_chunks():
+                self.stats['parse_seconds'] += time.perf_counter() - started
+                if prepared is not None and not put((consumed, prepared)):
+                    return
+                started = time.perf_counter()
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    def run(self, restart=False):
+        """
+        Loads the file from its checkpoint (or from the start with restart=True).
+        Returns the stats of this run.
+        """
+        if restart:
+            self.checkpoint.reset()
+            self.stats.update(offset=0, first=None, last=None)
+        elif self.checkpoint.state['done']:
+            print(f"{self.path} was already loaded for house {self.house_id}, use restart to load it again.")
+            return self.stats
+        return self._pump()
+
+    def _pump(self):
+        batches = queue.Queue(maxsize=max(1, self.depth))
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop), name='ingest-parse', daemon=True)
+        started = time.perf_counter()
+        producer.start()
+        cursor = self.conn.cursor()
+        create_watermark_table(cursor)
+        try:
+            while True:
+                item = batches.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                consumed, (rows, first, last) = item
+                write_started = time.perf_counter()
+                write_readings(cursor, rows, self.table_name)
+                rollups.refresh_rollups(cursor, self.house_id, first, last)
+                set_watermark(cursor, self.house_id, last)
+                self.conn.commit()
+                self.stats['write_seconds'] += time.perf_counter() - write_started
+
+                self.chunk_written(consumed, first, last)
+                elapsed = time.perf_counter() - started
+                self.stats.update(rows=self.stats['rows'] + len(rows), batches=self.stats['batches'] + 1, elapsed=elapsed)
+                self.stats['rows_per_sec'] = self.stats['rows'] / max(elapsed, 1e-9)
+                if self.on_progress:
+                    self.on_progress(dict(self.stats))
+        finally:
+            stop.set()
+            cursor.close()
+            producer.join()
+
+        self.finished()
+        if self.stats['first']:
+            query_cache.invalidate_ingested(
+                self.house_id, datetime.fromisoformat(self.stats['first']), datetime.fromisoformat(self.stats['last']))
+        return self.stats
+
+
+class IncrementalIngest(StreamingIngest):
+    """
+    Applies only the readings of a house file newer than the house's watermark
+    (minus `lookback_hours` so late corrections of recent readings are upserted
+    too). The watermark, committed with every chunk, is the resume point.
+    """
+
+    def __init__(self, conn, path, house_id, lookback_hours=INGEST_LOOKBACK_HOURS, **kwargs):
+        super().__init__(conn, path, house_id, **kwargs)
+        self.lookback = timedelta(hours=lookback_hours)
+        self.since = None
+        self.stats.update(offset=0, first=None, last=None, since=None)
+
+    def source_chunks(self):
+        for chunk in read_chunks(self.path, 0, self.chunk_rows):
+            # offset counts the source rows scanned, including the ones older than the watermark
+            self.stats['offset'] += len(chunk)
+            yield len(chunk), prepare_chunk(chunk, self.house_id, self.since)
+
+    def chunk_written(self, consumed, first, last):
+        self.stats.update(
+            first=min(self.stats['first'], first.isoformat()) if self.stats['first'] else first.isoformat(),
+            last=max(self.stats['last'] or '', last.isoformat()))
+
+    def finished(self):
+        pass
+
+    def run(self, restart=False):
+        """
+        Applies the new rows; restart=True ignores the watermark and upserts the whole file.
+        """
+        watermark = None
+        if not restart:
+            cursor = self.conn.cursor()
+            try:
+                create_watermark_table(cursor)
+                watermark = get_watermark(cursor, self.house_id)
+            finally:
+                cursor.close()
+        self.since = watermark - self.lookback if watermark is not None else None
+        self.stats['since'] = self.since.isoformat() if self.since else None
+        return self._pump()
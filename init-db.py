@@ -1,9 +1,15 @@
+import argparse
 import pandas as pd
 import mysql.connector
 from mysql.connector import Error
 from mysql.connector import errorcode
 import os
 from dotenv import load_dotenv
+import rollups
+import ingest
+import layout
+import partitions
+from schema import CONSUMPTION_LAYOUT
 
 load_dotenv()
 
@@ -231,10 +237,112 @@ def create_houses_consumption_table(cnx):
             print(f"MySQL Error: {err}")
     finally:
       cursor.close()
+
+def create_compact_consumption_table(conn):
+    """
+    Creates houses_consumption in the compact layout (presence flags in
+    house_circuits, time features as virtual generated columns).
+    """
+    try:
+        cursor = conn.cursor()
+        layout.create_compact_tables(cursor)
+        conn.commit()
+        print("Compact houses_consumption and house_circuits tables created successfully or already exist.")
+        cursor.close()
+    except Error as e:
+        print(f"Error creating compact houses_consumption table: {e}")
+
+def migrate_consumption_to_compact(conn):
+    """
+    Converts an existing wide houses_consumption table to the compact layout.
+    """
+    try:
+        layout.migrate_to_compact(conn)
+    except Error as e:
+        print(f"Error migrating houses_consumption to the compact layout: {e}")
+
+def partition_consumption_table(conn):
+    """
+    Clusters houses_consumption on (house_id, date_time) and partitions it by
+    month. Used for new installs and as the migration of existing ones.
+    """
+    try:
+        cursor = conn.cursor()
+        if partitions.partition_table(cursor):
+            print("houses_consumption re-keyed on (house_id, date_time) and partitioned by month.")
+        cursor.close()
+    except Error as e:
+        print(f"Error partitioning houses_consumption: {e}")
+
+def maintain_consumption_partitions(conn):
+    """
+    Adds the upcoming monthly partitions and drops the expired ones (run it monthly, e.g. from cron).
+    """
+    try:
+        cursor = conn.cursor()
+        created, dropped = partitions.maintain_partitions(cursor)
+        print(f"Partitions created: {', '.join(created) or 'none'}; dropped: {', '.join(dropped) or 'none'}.")
+        cursor.close()
+    except (Error, ValueError) as e:
+        print(f"Error maintaining houses_consumption partitions: {e}")
+
+def add_bucket_columns(conn):
+    """
+    Adds the generated reading_day/reading_month columns and their covering
+    indexes to houses_consumption (see rollups.BUCKET_COLUMNS).
+    """
+    try:
+        cursor = conn.cursor()
+        added = rollups.add_bucket_columns(cursor)
+        conn.commit()
+        print(f"Bucket columns added to houses_consumption: {', '.join(added)}." if added
+              else "Bucket columns of houses_consumption already exist.")
+        cursor.close()
+    except Error as e:
+        print(f"Error adding bucket columns to houses_consumption: {e}")
+
+def create_rollup_tables(conn):
+    """
+    Creates the hourly, daily and monthly rollup tables of houses_consumption.
+    """
+    try:
+        cursor = conn.cursor()
+        rollups.create_rollup_tables(cursor)
+        conn.commit()
+        print("Rollup tables created successfully or already exist.")
+        cursor.close()
+    except Error as e:
+        print(f"Error creating rollup tables: {e}")
+
+def create_ingest_tables(conn):
+    """
+    Creates the per-house ingest watermark table used by incremental loads.
+    """
+    try:
+        cursor = conn.cursor()
+        ingest.create_watermark_table(cursor)
+        conn.commit()
+        print("Ingest watermark table created successfully or already exists.")
+        cursor.close()
+    except Error as e:
+        print(f"Error creating ingest watermark table: {e}")
             
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the BEMS database tables.")
+    parser.add_argument('--layout', choices=['wide', 'compact'], default=CONSUMPTION_LAYOUT,
+                        help="row layout of houses_consumption (default: CONSUMPTION_LAYOUT or wide)")
+    parser.add_argument('--migrate-compact', action='store_true',
+                        help="convert an existing wide houses_consumption to the compact layout")
+    parser.add_argument('--partitioned', action='store_true',
+                        help="cluster houses_consumption on (house_id, date_time) and partition it by month")
+    parser.add_argument('--migrate-partitioned', action='store_true',
+                        help="re-key and partition an existing houses_consumption by month")
+    parser.add_argument('--maintain-partitions', action='store_true',
+                        help="create the upcoming monthly partitions and drop the expired ones")
+    args = parser.parse_args()
+
     cnn = None # Initialize cnn to None
     try:
         # Initial check on loaded environment variables
@@ -249,9 +357,24 @@ if __name__ == "__main__":
             exit(1) # Explicitly exit if connection could not be established
         else:
             print("INFO: Connection established. Proceeding with table creation.")
-            create_users_table(cnn)
-            create_houses_table(cnn)
-            create_houses_consumption_table(cnn)
+            if args.migrate_compact:
+                migrate_consumption_to_compact(cnn)
+            elif args.migrate_partitioned:
+                partition_consumption_table(cnn)
+            elif args.maintain_partitions:
+                maintain_consumption_partitions(cnn)
+            else:
+                create_users_table(cnn)
+                create_houses_table(cnn)
+                if args.layout == 'compact':
+                    create_compact_consumption_table(cnn)
+                else:
+                    create_houses_consumption_table(cnn)
+                add_bucket_columns(cnn)
+                if args.partitioned:
+                    partition_consumption_table(cnn)
+                create_rollup_tables(cnn)
+                create_ingest_tables(cnn)
             
 
 
@@ -0,0 +1,231 @@
+"""
+Compact row layout of houses_consumption.
+
+The wide layout created by init-db.py stores 19 *_present flags and 7
+derived time features on every 15-minute row. Both are redundant: presence
+is constant per house and the features are functions of date_time. The
+compact layout (CONSUMPTION_LAYOUT=compact) keeps:
+
+- one row per (house, circuit) in house_circuits for the presence flags
+- Weekday/Month/Hour and the sin/cos encodings as VIRTUAL generated columns,
+  computed on read and never stored, under the same names
+- the readings as DECIMAL(6, 4) (total_energy DECIMAL(8, 4)) instead of
+  DECIMAL(10, 4)/(12, 4), still exact to 0.1 Wh
+
+so the SELECTs of the API, the forecast and the exports work unchanged while
+a row shrinks from about 148 to about 70 bytes of column data.
+
+`migrate_to_compact` converts an existing wide table in place.
+"""
+from datetime import datetime, timedelta
+
+import partitions
+import rollups
+from schema import CIRCUITS, CIRCUITS_TABLE, ENERGY_COLUMNS, READING_COLUMNS, TABLE_NAME
+
+# Generated column definitions matching features.time_features (Weekday: Monday=0)
+GENERATED_FEATURES = {
+    'Weekday': "TINYINT UNSIGNED AS (WEEKDAY(date_time)) VIRTUAL",
+    'Month': "TINYINT UNSIGNED AS (MONTH(date_time)) VIRTUAL",
+    'Hour': "TINYINT UNSIGNED AS (HOUR(date_time)) VIRTUAL",
+    'Hour_sin': "FLOAT AS (SIN(2 * PI() * HOUR(date_time) / 24)) VIRTUAL",
+    'Hour_cos': "FLOAT AS (COS(2 * PI() * HOUR(date_time) / 24)) VIRTUAL",
+    'DoW_sin': "FLOAT AS (SIN(2 * PI() * WEEKDAY(date_time) / 7)) VIRTUAL",
+    'DoW_cos': "FLOAT AS (COS(2 * PI() * WEEKDAY(date_time) / 7)) VIRTUAL",
+}
+
+PRESENCE_INDEX = {c: READING_COLUMNS.index(f"{c}_present") for c in CIRCUITS}
+
+
+def compact_table_ddl(table_name=TABLE_NAME, partitioned=None):
+    """
+    CREATE TABLE of the compact layout. `partitioned`, a list of PARTITION
+    definitions, builds it like partitions.partition_table does: clustered on
+    (house_id, date_time), without the houses foreign key, partitioned by month.
+    """
+    readings = [f"{c} DECIMAL(6, 4)" for c in CIRCUITS] + ["total_energy DECIMAL(8, 4)"]
+    features = [f"{name} {definition}" for name, definition in GENERATED_FEATURES.items()]
+    columns = ',\n            '.join(readings + features + rollups.bucket_columns_ddl())
+    if partitioned:
+        keys = "PRIMARY KEY (house_id, date_time)"
+        definitions = ',\n            '.join(partitioned)
+        options = f"""
+        PARTITION BY RANGE COLUMNS(date_time) (
+            {definitions}
+        )"""
+    else:
+        keys = "PRIMARY KEY (date_time, house_id),\n            FOREIGN KEY (house_id) REFERENCES houses(id)"
+        options = ""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            date_time DATETIME NOT NULL,
+            house_id INT NOT NULL,
+            {columns},
+            {keys}
+        ) ENGINE=InnoDB{options};
+        """
+
+
+def source_partitions(cursor, table_name):
+    """
+    PARTITION definitions reproducing the monthly partitions of the table,
+    None if it is not partitioned.
+    """
+    names = partitions.existing_partitions(cursor, table_name)
+    if not names:
+        return None
+    months = sorted(datetime(int(m.group(1)), int(m.group(2)), 1)
+                    for m in (partitions.PARTITION_NAME.match(n) for n in names) if m)
+    if not months:
+        return ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"]
+    return partitions.monthly_partitions(months[0], months[-1])
+
+
+def create_circuits_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CIRCUITS_TABLE} (
+            house_id INT NOT NULL,
+            circuit VARCHAR(32) NOT NULL,
+            present BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (house_id, circuit),
+            FOREIGN KEY (house_id) REFERENCES houses(id)
+        ) ENGINE=InnoDB;
+        """)
+
+
+def create_compact_tables(cursor, table_name=TABLE_NAME):
+    create_circuits_table(cursor)
+    cursor.execute(compact_table_ddl(table_name))
+
+
+def update_house_circuits(cursor, house_id, present):
+    """
+    Marks the circuits in `present` as present for the house. A circuit never
+    goes back to absent because one batch lacks it.
+    """
+    cursor.executemany(
+        f"INSERT INTO {CIRCUITS_TABLE} (house_id, circuit, present) VALUES (%s, %s, %s) "
+        f"ON DUPLICATE KEY UPDATE present = GREATEST(present, VALUES(present))",
+        [(house_id, c, int(c in present)) for c in CIRCUITS])
+
+
+def presence_from_rows(rows):
+    """
+    house_id -> set of circuits flagged present in any of the rows (READING_COLUMNS order).
+    """
+    present = {}
+    for row in rows:
+        circuits = present.setdefault(row[1], set())
+        circuits.update(c for c, i in PRESENCE_INDEX.items() if row[i])
+    return present
+
+
+def presence_query(house_id):
+    """
+    SQL (and arguments) returning one row with a <circuit>_present column per circuit.
+    """
+    columns = ', '.join(f"MAX(CASE WHEN circuit = '{c}' THEN present ELSE 0 END) AS {c}_present" for c in CIRCUITS)
+    return f"SELECT {columns} FROM {CIRCUITS_TABLE} WHERE house_id = %s", (house_id,)
+
+
+def table_size(cursor, table_name):
+    """
+    (rows estimate, data + index bytes) of a table from information_schema.
+    """
+    cursor.execute(
+        "SELECT TABLE_ROWS, DATA_LENGTH + INDEX_LENGTH FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table_name,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def copy_presence(cursor, table_name, since=None):
+    """
+    Stores in house_circuits the presence flags of the wide table's rows
+    (only those with date_time >= `since` when given).
+    """
+    presence = ', '.join(f"COALESCE(MAX({c}_present), 0)" for c in CIRCUITS)
+    where, args = ("WHERE date_time >= %s", (since,)) if since else ("", ())
+    cursor.execute(f"SELECT house_id, {presence} FROM {table_name} {where} GROUP BY house_id", args)
+    for row in cursor.fetchall():
+        update_house_circuits(cursor, row[0], {c for c, flag in zip(CIRCUITS, row[1:]) if flag})
+
+
+def catch_up(cursor, table_name, staging, since):
+    """
+    Upserts the readings with date_time >= `since` of the wide table into the
+    staging table, so rows written or merged after their slice was copied are not lost.
+    """
+    columns = ', '.join(['date_time', 'house_id'] + ENERGY_COLUMNS)
+    updates = ', '.join(f"{c} = VALUES({c})" for c in ENERGY_COLUMNS)
+    cursor.execute(
+        f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {table_name} "
+        f"WHERE date_time >= %s ON DUPLICATE KEY UPDATE {updates}", (since,))
+    return cursor.rowcount
+
+
+def migrate_to_compact(conn, table_name=TABLE_NAME, chunk_days=31, catch_up_days=1):
+    """
+    Converts a wide houses_consumption into the compact layout:
+    fills house_circuits from the presence flags, copies the readings into a
+    compact table house by house in `chunk_days` slices (one commit each),
+    then swaps the tables. The wide table is kept as <table>_wide until dropped.
+    A partitioned table stays clustered on (house_id, date_time) with the same
+    monthly partitions.
+
+    Writers keep running during the copy. The readings from `catch_up_days`
+    days before the copy started onwards are copied again, once while writes
+    go on and once more with the tables locked right before the swap, so
+    live and incremental writes made meanwhile are carried over. Older slots
+    written during the copy (backfills) are not.
+    """
+    staging = f"{table_name}_compact"
+    backup = f"{table_name}_wide"
+    since = rollups.floor_to('day', datetime.now()) - timedelta(days=catch_up_days)
+    cursor = conn.cursor()
+    try:
+        rows_before, bytes_before = table_size(cursor, table_name)
+        create_circuits_table(cursor)
+        copy_presence(cursor, table_name)
+        conn.commit()
+        print(f"Circuit presence stored in {CIRCUITS_TABLE}.")
+
+        partitioned = source_partitions(cursor, table_name)
+        cursor.execute(compact_table_ddl(staging, partitioned))
+        if partitioned:
+            print(f"{table_name} is partitioned: {staging} keeps (house_id, date_time) and its monthly partitions.")
+        cursor.execute(f"SELECT house_id, MIN(date_time), MAX(date_time) FROM {table_name} GROUP BY house_id")
+        columns = ', '.join(['date_time', 'house_id'] + ENERGY_COLUMNS)
+        for house_id, first, last in cursor.fetchall():
+            start = rollups.floor_to('day', first)
+            while start <= last:
+                stop = start + timedelta(days=chunk_days)
+                cursor.execute(
+                    f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {table_name} "
+                    f"WHERE house_id = %s AND date_time >= %s AND date_time < %s",
+                    (house_id, start, stop))
+                conn.commit()
+                start = stop
+            print(f"House {house_id} copied.")
+
+        catch_up(cursor, table_name, staging, since)
+        conn.commit()
+        # Writers block from here until the swap; the last pass only covers what they wrote meanwhile
+        cursor.execute(f"LOCK TABLES {table_name} WRITE, {staging} WRITE, {CIRCUITS_TABLE} WRITE, houses READ")
+        try:
+            copied = catch_up(cursor, table_name, staging, since)
+            copy_presence(cursor, table_name, since)
+            conn.commit()
+            cursor.execute(f"RENAME TABLE {table_name} TO {backup}, {staging} TO {table_name}")
+        finally:
+            cursor.execute("UNLOCK TABLES")
+        print(f"Readings since {since:%Y-%m-%d} caught up ({copied} affected rows) with writes locked.")
+        conn.commit()
+        cursor.execute(f"ANALYZE TABLE {table_name}")
+        cursor.fetchall()
+        rows_after, bytes_after = table_size(cursor, table_name)
+        print(f"{table_name}: ~{rows_before} rows, {bytes_before / 2**20:.1f} MiB -> "
+              f"~{rows_after} rows, {bytes_after / 2**20:.1f} MiB. Wide table kept as {backup}.")
+        print(f"Set CONSUMPTION_LAYOUT=compact for the API and ingest scripts, then DROP TABLE {backup}.")
+    finally:
+        cursor.close()
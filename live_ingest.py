@@ -0,0 +1,220 @@
+"""
+Live 15-minute readings pushed by the meters.
+
+`parse_readings` validates a batch against the circuit columns of
+houses_consumption and derives the time features and presence flags
+server-side. ReadingWriter queues the validated rows and a single writer
+thread flushes them in multi-row upserts (every LIVE_FLUSH_INTERVAL seconds
+or LIVE_FLUSH_ROWS rows, whichever comes first), so thousands of meters
+share one connection instead of opening one per reading. A reading for a slot
+that is already stored only replaces the circuits it carries. At most
+LIVE_QUEUE_ROWS rows may wait; beyond that `submit` raises QueueFull and the
+API answers 429. A flush that fails is retried house by house, so only the
+readings of the house that broke it are dropped.
+"""
+import math
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from features import time_features
+from schema import CIRCUITS, MAX_CIRCUIT_READING, MAX_TOTAL_ENERGY, TIME_FEATURE_COLUMNS
+
+load_dotenv()
+
+LIVE_QUEUE_ROWS = int(os.getenv('LIVE_QUEUE_ROWS', 50000))
+LIVE_FLUSH_ROWS = int(os.getenv('LIVE_FLUSH_ROWS', 2000))
+LIVE_FLUSH_INTERVAL = float(os.getenv('LIVE_FLUSH_INTERVAL', 1.0))
+LIVE_MAX_BATCH = int(os.getenv('LIVE_MAX_BATCH', 5000))  # readings per request
+
+READING_INTERVAL_MINUTES = 15
+ACCEPTED_FIELDS = set(CIRCUITS) | {'date_time', 'total_energy'}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class InvalidReadings(ValueError):
+    pass
+
+
+def _parse_time(value):
+    try:
+        moment = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise InvalidReadings(f"invalid date_time '{value}', expected 'YYYY-MM-DD HH:MM:SS'")
+    if moment.tzinfo is not None:
+        raise InvalidReadings(f"date_time '{value}' must be local time without an offset")
+    if moment.minute % READING_INTERVAL_MINUTES or moment.second or moment.microsecond:
+        raise InvalidReadings(f"date_time '{value}' is not aligned to {READING_INTERVAL_MINUTES} minutes")
+    return moment
+
+
+def _check_range(field, value, limit):
+    # the column rounds to 4 decimals, a value that rounds past its precision is refused by MySQL
+    if value < 0 or round(value, 4) > limit:
+        raise InvalidReadings(f"'{field}' must be between 0 and {limit}")
+    return value
+
+
+def _parse_value(field, value, limit=MAX_CIRCUIT_READING):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise InvalidReadings(f"'{field}' must be a finite number")
+    return _check_range(field, float(value), limit)
+
+
+def parse_readings(house_id, readings, max_batch=LIVE_MAX_BATCH):
+    """
+    Validates a list of reading dicts ({'date_time': ..., '<circuit>': kWh, ...})
+    and returns DB-ready rows in schema.READING_COLUMNS order. total_energy defaults to
+    the sum of the circuits sent (the writer recomputes it when it merges the
+    reading into a stored slot), a circuit counts as present when it has a value.
+    Raises InvalidReadings with the offending reading's index.
+    """
+    if not isinstance(readings, list) or not readings:
+        raise InvalidReadings("'readings' must be a non-empty list")
+    if len(readings) > max_batch:
+        raise InvalidReadings(f"at most {max_batch} readings per request")
+
+    parsed = {}
+    for index, reading in enumerate(readings):
+        try:
+            if not isinstance(reading, dict):
+                raise InvalidReadings("each reading must be an object")
+            unknown = set(reading) - ACCEPTED_FIELDS
+            if unknown:
+                raise InvalidReadings(f"unknown circuit(s) {', '.join(sorted(unknown))}")
+            if 'date_time' not in reading:
+                raise InvalidReadings("missing date_time")
+            moment = _parse_time(reading['date_time'])
+            values = {c: _parse_value(c, reading.get(c)) for c in CIRCUITS}
+            if all(v is None for v in values.values()):
+                raise InvalidReadings("no circuit values")
+            total = _parse_value('total_energy', reading.get('total_energy'), MAX_TOTAL_ENERGY)
+            if total is None:
+                total = _check_range('total_energy', sum(v for v in values.values() if v is not None),
+                                     MAX_TOTAL_ENERGY)
+        except InvalidReadings as e:
+            raise InvalidReadings(f"reading {index}: {e}")
+        # a later reading for the same slot in the batch wins
+        parsed[moment] = (values, total)
+
+    moments = sorted(parsed)
+    derived = time_features(moments)[TIME_FEATURE_COLUMNS].to_numpy().tolist()
+    rows = []
+    for moment, features in zip(moments, derived):
+        values, total = parsed[moment]
+        row = [moment, house_id] + [values[c] for c in CIRCUITS] + [total]
+        row += [int(f) if column in ('Weekday', 'Month', 'Hour') else f
+                for column, f in zip(TIME_FEATURE_COLUMNS, features)]
+        row += [int(values[c] is not None) for c in CIRCUITS]
+        rows.append(tuple(row))
+    return rows
+
+
+class ReadingWriter:
+    """
+    write(rows) receives a list of rows (possibly of several houses) and must
+    store them; it runs on the writer thread.
+    """
+
+    def __init__(self, write, max_rows=LIVE_QUEUE_ROWS, flush_rows=LIVE_FLUSH_ROWS,
+                 flush_interval=LIVE_FLUSH_INTERVAL):
+        self.write = write
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_error = None
+        self._pending = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='readings-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """
+        Queues rows for the next flush. Raises QueueFull when they do not fit.
+        """
+        with self._lock:
+            if self._pending + len(rows) > self.max_rows:
+                self.rejected += len(rows)
+                raise QueueFull(f"{self._pending} readings already waiting")
+            self._pending += len(rows)
+            self.accepted += len(rows)
+            pending = self._pending
+        self._queue.put(rows)
+        return pending
+
+    def depth(self):
+        with self._lock:
+            return self._pending
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch = batch + self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, rows):
+        try:
+            self._write(rows)
+        finally:
+            self.flushes += 1
+            with self._lock:
+                self._pending -= len(rows)
+
+    def _write(self, rows):
+        """
+        Writes a batch; when it fails, writes it again house by house so one
+        faulty meter only loses its own readings.
+        """
+        try:
+            self.write(rows)
+            self.written += len(rows)
+            return
+        except Exception as e:
+            error = e
+        by_house = {}
+        for row in rows:
+            by_house.setdefault(row[1], []).append(row)
+        if len(by_house) == 1:
+            house_id = rows[0][1]
+            print(f"Writing {len(rows)} live readings of house {house_id} failed, dropped: {error}")
+            self.failed += len(rows)
+            self.last_error = f"house {house_id}: {error}"
+            return
+        print(f"Writing {len(rows)} live readings of {len(by_house)} houses failed ({error}), retrying per house.")
+        for house_rows in by_house.values():
+            self._write(house_rows)
+
+    def stats(self):
+        return {
+            'queued': self.depth(),
+            'capacity': self.max_rows,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'written': self.written,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,94 @@
+"""
+Minimal stand-in for the Ollama HTTP API, for testing report generation
+without a model host. Serves POST /api/generate in both modes:
+
+- stream=false: one JSON object with the whole response
+- stream=true:  newline-delimited JSON chunks, one token each
+
+Point the API at it with OLLAMA_HOST=http://127.0.0.1:11434.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTIONS = ["Analysis", "Recommendations", "Alerts", "Tips"]
+
+
+def stub_report():
+    lines = []
+    for i, name in enumerate(SECTIONS, start=1):
+        lines.append(f"{i}) {name} -> [")
+        lines += [f"- Stub {name.lower()} bullet {n}." for n in range(1, 6)]
+        lines[-1] += "]"
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+def tokens(text):
+    """
+    Splits the text into word-sized tokens, keeping the whitespace.
+    """
+    out, current = [], ""
+    for ch in text:
+        current += ch
+        if ch in " \n":
+            out.append(current)
+            current = ""
+    if current:
+        out.append(current)
+    return out
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    token_delay = 0.01
+    first_token_delay = 0.2
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = body.get("model", "stub")
+        text = stub_report()
+        created = datetime.now(timezone.utc).isoformat()
+        time.sleep(self.first_token_delay)
+
+        if not body.get("stream", True):
+            time.sleep(self.token_delay * len(tokens(text)))
+            payload = json.dumps({"model": model, "created_at": created, "response": text, "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in tokens(text):
+            chunk = {"model": model, "created_at": created, "response": token, "done": False}
+            self.wfile.write(json.dumps(chunk).encode() + b"\n")
+            self.wfile.flush()
+            time.sleep(self.token_delay)
+        done = {"model": model, "created_at": created, "response": "", "done": True, "done_reason": "stop"}
+        self.wfile.write(json.dumps(done).encode() + b"\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-delay", type=float, default=StubHandler.token_delay, help="seconds between tokens")
+    parser.add_argument("--first-token-delay", type=float, default=StubHandler.first_token_delay, help="seconds before the first token")
+    args = parser.parse_args()
+    StubHandler.token_delay = args.token_delay
+    StubHandler.first_token_delay = args.first_token_delay
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
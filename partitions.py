@@ -0,0 +1,147 @@
+"""
+House-first clustering and monthly RANGE partitioning of houses_consumption.
+
+Every dashboard query reads one house over a date range. With the original
+PRIMARY KEY (date_time, house_id) the rows of all houses are interleaved in
+the clustered index, so a range scan for one house touches pages full of
+other houses' readings. `partition_table` re-keys the table on
+(house_id, date_time), so each house's range is contiguous, and splits it
+into one partition per month:
+
+    p202501 VALUES LESS THAN ('2025-02-01'), ..., pmax VALUES LESS THAN (MAXVALUE)
+
+Queries filtering on date_time are pruned to the months they cover, and
+`maintain_partitions` keeps CONSUMPTION_PARTITIONS_AHEAD empty future months
+split off pmax and drops the months older than CONSUMPTION_RETENTION_MONTHS
+(0 keeps everything). Dropping a partition is a metadata operation instead of
+a DELETE of millions of rows. The rollup tables are not partitioned, so
+hourly/daily/monthly totals outlive the raw readings.
+
+MySQL does not support foreign keys on partitioned tables, so the
+house_id -> houses(id) constraint of houses_consumption is dropped.
+"""
+import os
+import re
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from schema import TABLE_NAME
+
+load_dotenv()
+
+CONSUMPTION_PARTITIONS_AHEAD = int(os.getenv('CONSUMPTION_PARTITIONS_AHEAD', 3))
+CONSUMPTION_RETENTION_MONTHS = int(os.getenv('CONSUMPTION_RETENTION_MONTHS', 0))
+
+PARTITION_NAME = re.compile(r'^p(\d{4})(\d{2})$')
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def partition_definition(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+
+
+def monthly_partitions(first, last):
+    """
+    PARTITION definitions for every month from first to last (inclusive), then pmax.
+    """
+    definitions = []
+    month = month_start(first)
+    while month <= month_start(last):
+        definitions.append(partition_definition(month))
+        month = add_months(month, 1)
+    definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return definitions
+
+
+def existing_partitions(cursor, table_name=TABLE_NAME):
+    """
+    Names of the table's partitions in order, empty if it is not partitioned.
+    """
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION", (table_name,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def foreign_keys(cursor, table_name=TABLE_NAME):
+    cursor.execute(
+        "SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_TYPE = 'FOREIGN KEY'",
+        (table_name,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def partition_table(cursor, table_name=TABLE_NAME, months_ahead=CONSUMPTION_PARTITIONS_AHEAD, today=None):
+    """
+    Re-keys the table on (house_id, date_time) and partitions it by month,
+    from its oldest reading (or the current month when empty) to `months_ahead`
+    months after today. Works on a fresh table and as the migration of an
+    existing one (the ALTER rebuilds the table once). No-op if already partitioned.
+    """
+    if existing_partitions(cursor, table_name):
+        print(f"{table_name} is already partitioned.")
+        return False
+    today = today or datetime.now()
+    cursor.execute(f"SELECT MIN(date_time) FROM {table_name}")
+    oldest = cursor.fetchone()[0] or today
+
+    for constraint in foreign_keys(cursor, table_name):
+        cursor.execute(f"ALTER TABLE {table_name} DROP FOREIGN KEY {constraint}")
+    definitions = ',\n            '.join(monthly_partitions(oldest, add_months(month_start(today), months_ahead)))
+    cursor.execute(f"""
+        ALTER TABLE {table_name}
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (house_id, date_time)
+        PARTITION BY RANGE COLUMNS(date_time) (
+            {definitions}
+        )""")
+    return True
+
+
+def maintain_partitions(cursor, table_name=TABLE_NAME, months_ahead=CONSUMPTION_PARTITIONS_AHEAD,
+                        retention_months=CONSUMPTION_RETENTION_MONTHS, today=None):
+    """
+    Splits the missing future months off pmax and drops the months that ended
+    more than `retention_months` ago (0 keeps all of them).
+    Returns (created, dropped) partition names.
+    """
+    today = today or datetime.now()
+    names = existing_partitions(cursor, table_name)
+    if not names:
+        raise ValueError(f"{table_name} is not partitioned, run init-db.py --migrate-partitioned first")
+    months = sorted(datetime(int(m.group(1)), int(m.group(2)), 1)
+                    for m in (PARTITION_NAME.match(n) for n in names) if m)
+
+    created = []
+    target = add_months(month_start(today), months_ahead)
+    month = add_months(months[-1], 1) if months else month_start(today)
+    new = []
+    while month <= target:
+        new.append(month)
+        month = add_months(month, 1)
+    if new:
+        definitions = ', '.join([partition_definition(m) for m in new] + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+        cursor.execute(f"ALTER TABLE {table_name} REORGANIZE PARTITION pmax INTO ({definitions})")
+        created = [partition_name(m) for m in new]
+
+    dropped = []
+    if retention_months > 0:
+        cutoff = add_months(month_start(today), -retention_months)
+        dropped = [partition_name(m) for m in months if m < cutoff]
+        if dropped:
+            cursor.execute(f"ALTER TABLE {table_name} DROP PARTITION {', '.join(dropped)}")
+    return created, dropped
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import mysql.connector
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+import db
+import report
+from report_jobs import ReportStore
+
+load_dotenv()
+
+DB_HOST = os.getenv('DB_HOST')
+DB_USER = os.getenv('DB_USER')  # Replace with your MySQL username
+DB_PASSWORD = os.getenv('DB_PASSWORD')  # Replace with your MySQL password
+DB_NAME = os.getenv('DB_NAME','bems_db')  # Name of the database to create/use
+DB_PORT = int(os.getenv('DB_PORT', 3306))  # Default MySQL port is 3306
+# Number of reports generated at the same time, i.e. concurrent requests to the Ollama host
+PRECOMPUTE_CONCURRENCY = int(os.getenv('REPORT_PRECOMPUTE_CONCURRENCY', 2))
+
+def connect():
+    return mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        port=DB_PORT
+    )
+
+
+# Report queries share one pool, sized to the number of reports generated at the same time
+db_pool = db.ConnectionPool(connect, min_size=0, max_size=PRECOMPUTE_CONCURRENCY)
+
+
+def fetch(query, args):
+    """
+    Query helper for report.generate_report, run as prepared statements on pooled connections.
+    """
+    with db_pool.connection() as conn:
+        return db_pool.execute_prepared(conn, query, args)
+
+
+def list_houses(store):
+    """
+    Every house id, the ones whose reports were requested most recently first.
+    """
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT id FROM houses")
+        houses = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    finally:
+        conn.close()
+    return sorted(houses, key=lambda h: store.last_access(h), reverse=True)
+
+
+class RunLog:
+    """
+    Per-day progress file (status, timing and error per house). A run that is
+    interrupted picks up from it and only retries houses not marked done.
+    """
+
+    def __init__(self, store, day):
+        self.path = os.path.join(store.root, '.precompute', f"{day.isoformat()}.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.houses = json.load(f)['houses']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.houses = {}
+
+    def is_done(self, house_id):
+        return self.houses.get(str(house_id), {}).get('status') == 'done'
+
+    def record(self, house_id, status, seconds, error=None):
+        with self._lock:
+            self.houses[str(house_id)] = {
+                'status': status,
+                'seconds': round(seconds, 3),
+                'error': error,
+                'finished_at': datetime.now().isoformat(timespec='seconds'),
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'houses': self.houses}, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+def precompute_house(store, run_log, house_id, day):
+    started = time.perf_counter()
+    try:
+        if not store.exists(house_id, day):
+            store.put(house_id, day, report.generate_report(house_id, day, fetch))
+        run_log.record(house_id, 'done', time.perf_counter() - started)
+        return True
+    except Exception as e:
+        run_log.record(house_id, 'failed', time.perf_counter() - started, str(e))
+        print(f"Report for house {house_id} on {day} failed: {e}")
+        return False
+
+
+def precompute_day(day, concurrency=PRECOMPUTE_CONCURRENCY):
+    """
+    Generates the report of `day` for every house that does not have one yet.
+    """
+    store = ReportStore()
+    run_log = RunLog(store, day)
+    houses = [h for h in list_houses(store) if not run_log.is_done(h)]
+    print(f"Precomputing {len(houses)} reports for {day} with concurrency {concurrency}.")
+
+    started = time.perf_counter()
+    ok = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='precompute') as pool:
+        futures = [pool.submit(precompute_house, store, run_log, h, day) for h in houses]
+        for future in as_completed(futures):
+            if future.result():
+                ok += 1
+            else:
+                failed += 1
+    print(f"Finished {day}: {ok} reports generated, {failed} failed in {time.perf_counter() - started:.1f}s "
+          f"(details in {run_log.path}).")
+    return failed == 0
+
+
+def run_forever(delay_minutes, concurrency):
+    """
+    Waits for each day to close, then precomputes that day's reports.
+    """
+    while True:
+        now = datetime.now()
+        next_run = datetime(now.year, now.month, now.day) + timedelta(days=1, minutes=delay_minutes)
+        print(f"Next precomputation at {next_run}.")
+        time.sleep(max(0, (next_run - now).total_seconds()))
+        precompute_day((next_run - timedelta(days=1)).date(), concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute daily reports for every house.")
+    parser.add_argument('--day', help="report day YYYY-MM-DD (default: yesterday)")
+    parser.add_argument('--concurrency', type=int, default=PRECOMPUTE_CONCURRENCY,
+                        help="reports generated in parallel (bounds the load on the Ollama host)")
+    parser.add_argument('--daemon', action='store_true', help="keep running and precompute after each day closes")
+    parser.add_argument('--delay-minutes', type=int, default=15,
+                        help="in daemon mode, minutes after midnight to wait for the last readings")
+    args = parser.parse_args()
+
+    try:
+        if args.daemon:
+            run_forever(args.delay_minutes, args.concurrency)
+        else:
+            day = datetime.strptime(args.day, "%Y-%m-%d").date() if args.day else (datetime.now() - timedelta(days=1)).date()
+            if day >= datetime.now().date():
+                print(f"{day} is not over yet, its reports would be built from partial readings.")
+                exit(1)
+            if not precompute_day(day, args.concurrency):
+                exit(1)
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        exit(1)
+    except KeyboardInterrupt:
+        print("Interrupted, progress is saved and the next run resumes from it.")
@@ -0,0 +1,358 @@
+"""
+Query-result cache for the dashboard aggregates.
+
+Results are keyed by house, endpoint and the normalized date range they cover.
+Two backends are available:
+
+- MemoryBackend: in-process LRU with per-entry TTLs (default)
+- SharedBackend: any Redis-compatible client, so several API workers and the
+  ingestion scripts see the same entries. LocalSharedStore is an in-process
+  stand-in used when no REDIS_URL is configured (or redis is not installed).
+
+Whenever readings for a house are ingested, `invalidate` drops every cached
+range of that house overlapping the ingested days and bumps the house's data
+version, which the HTTP ETags are derived from.
+
+Only a SharedBackend on a real Redis server is seen by every process
+(`QueryCache.shared`). Otherwise an ingest script cannot reach the API's
+entries, so closed ranges are only kept QUERY_CACHE_TTL_LOCAL seconds and
+`invalidate_ingested` warns that the API will serve the old results until then.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+MISS = object()
+
+_warned_not_shared = False
+
+
+def _normalize(value):
+    """
+    Date/datetime -> ISO string so equivalent ranges map to the same key.
+    """
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0).isoformat()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).isoformat()
+    return str(value)
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+class MemoryBackend:
+    """
+    In-process LRU store. Entries expire after their TTL and the least
+    recently used entry is evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._index = {}               # house_id -> set of keys
+        self._versions = {}            # house_id -> data version
+        self._epoch = int(time.time() * 1000)  # versions of an earlier process never repeat
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, house_id):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            self._index.setdefault(house_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def keys_for_house(self, house_id):
+        with self._lock:
+            # drop index entries whose value was already evicted
+            keys = {k for k in self._index.get(house_id, set()) if k in self._entries}
+            self._index[house_id] = keys
+            return set(keys)
+
+    def delete(self, house_id, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            if house_id in self._index:
+                self._index[house_id] -= set(keys)
+
+    def version(self, house_id):
+        with self._lock:
+            return f"{self._epoch}.{self._versions.get(house_id, 0)}"
+
+    def bump_version(self, house_id):
+        with self._lock:
+            self._versions[house_id] = self._versions.get(house_id, 0) + 1
+
+    def size(self):
+        return len(self._entries)
+
+
+class LocalSharedStore:
+    """
+    In-process stand-in for the subset of the redis-py client used by
+    SharedBackend (get, set with ex/nx, incr, delete, sadd, smembers, srem, dbsize).
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and key in self._values:
+                return None
+            self._values[key] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    def incr(self, key):
+        with self._lock:
+            expires_at, value = self._values.get(key, (None, 0))
+            value = int(value) + 1
+            self._values[key] = (expires_at, value)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._values.pop(key, None) is not None)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._sets.setdefault(key, set()).update(members)
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._sets.get(key, set()))
+
+    def srem(self, key, *members):
+        with self._lock:
+            self._sets.get(key, set()).difference_update(members)
+
+    def dbsize(self):
+        with self._lock:
+            return len(self._values)
+
+
+class SharedBackend:
+    """
+    Stores pickled results in a Redis-compatible server. Expiry and memory
+    eviction are left to the server (configure maxmemory-policy allkeys-lru).
+    """
+
+    def __init__(self, client, prefix='bems:'):
+        self.client = client
+        self.prefix = prefix
+        self.evictions = 0
+        self.expirations = 0
+
+    def _index_key(self, house_id):
+        return f"{self.prefix}index:{house_id}"
+
+    def _version_key(self, house_id):
+        return f"{self.prefix}version:{house_id}"
+
+    def version(self, house_id):
+        key = self._version_key(house_id)
+        raw = self.client.get(key)
+        if raw is None:
+            # Start from the clock so a flushed server never hands out an old version again
+            self.client.set(key, int(time.time() * 1000), nx=True)
+            raw = self.client.get(key)
+        return raw.decode() if isinstance(raw, bytes) else str(raw)
+
+    def bump_version(self, house_id):
+        self.client.incr(self._version_key(house_id))
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return MISS if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl, house_id):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=int(ttl))
+        self.client.sadd(self._index_key(house_id), key)
+
+    def keys_for_house(self, house_id):
+        return {k.decode() if isinstance(k, bytes) else k
+                for k in self.client.smembers(self._index_key(house_id))}
+
+    def delete(self, house_id, keys):
+        if keys:
+            self.client.delete(*[self.prefix + k for k in keys])
+            self.client.srem(self._index_key(house_id), *keys)
+
+    def size(self):
+        return self.client.dbsize()
+
+
+class QueryCache:
+    """
+    Front-end used by the API: builds keys, picks TTLs, keeps the counters.
+    """
+
+    def __init__(self, backend, ttl_open=60, ttl_closed=86400, shared=False):
+        self.backend = backend
+        self.ttl_open = ttl_open
+        self.ttl_closed = ttl_closed
+        self.shared = shared  # entries and versions are seen by every process
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        QUERY_CACHE_BACKEND=memory|shared, QUERY_CACHE_SIZE, QUERY_CACHE_TTL_OPEN,
+        QUERY_CACHE_TTL_CLOSED and REDIS_URL (shared backend only).
+        Without a Redis server, closed ranges are kept at most QUERY_CACHE_TTL_LOCAL
+        seconds, since ingest scripts cannot invalidate them.
+        """
+        kind = os.getenv('QUERY_CACHE_BACKEND', 'memory')
+        shared = False
+        if kind == 'shared':
+            client = cls._shared_client(os.getenv('REDIS_URL'))
+            shared = not isinstance(client, LocalSharedStore)
+            backend = SharedBackend(client)
+        else:
+            backend = MemoryBackend(int(os.getenv('QUERY_CACHE_SIZE', 1024)))
+        ttl_closed = int(os.getenv('QUERY_CACHE_TTL_CLOSED', 86400))
+        if not shared:
+            ttl_closed = min(ttl_closed, int(os.getenv('QUERY_CACHE_TTL_LOCAL', 300)))
+        return cls(backend,
+                   ttl_open=int(os.getenv('QUERY_CACHE_TTL_OPEN', 60)),
+                   ttl_closed=ttl_closed, shared=shared)
+
+    @staticmethod
+    def _shared_client(url):
+        if url:
+            try:
+                import redis
+                return redis.Redis.from_url(url)
+            except ImportError:
+                print("redis is not installed, falling back to the local shared store")
+        return LocalSharedStore()
+
+    @staticmethod
+    def key(house_id, endpoint, start, end):
+        return f"{house_id}|{endpoint}|{_normalize(start)}|{_normalize(end)}"
+
+    def ttl_for(self, end, today):
+        """
+        Ranges ending before `today` are closed and never change.
+        """
+        return self.ttl_closed if _day(end) < _day(today) else self.ttl_open
+
+    def get_or_compute(self, house_id, endpoint, start, end, today, compute):
+        key = self.key(house_id, endpoint, start, end)
+        value = self.backend.get(key)
+        if value is not MISS:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.backend.set(key, value, self.ttl_for(end, today), house_id)
+        return value
+
+    async def get_or_compute_async(self, house_id, endpoint, start, end, today, compute):
+        """
+        get_or_compute for the async server, `compute` is a coroutine function.
+        """
+        key = self.key(house_id, endpoint, start, end)
+        value = self.backend.get(key)
+        if value is not MISS:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await compute()
+        self.backend.set(key, value, self.ttl_for(end, today), house_id)
+        return value
+
+    def invalidate(self, house_id, start, end=None):
+        """
+        Drops the cached ranges of a house overlapping the days [start, end].
+        Returns the number of entries removed.
+        """
+        first = _day(start)
+        last = _day(end if end is not None else start)
+        stale = []
+        for key in self.backend.keys_for_house(house_id):
+            _, _, range_start, range_end = key.split('|')
+            if (datetime.fromisoformat(range_start).date() <= last
+                    and datetime.fromisoformat(range_end).date() >= first):
+                stale.append(key)
+        self.backend.delete(house_id, stale)
+        self.backend.bump_version(house_id)
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def version(self, house_id):
+        """
+        Data version of a house; changes whenever its readings are invalidated.
+        """
+        return self.backend.version(house_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'shared': self.shared,
+            'ttl_closed': self.ttl_closed,
+            'entries': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.backend.evictions,
+            'expirations': self.backend.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+def invalidate_ingested(house_id, start, end=None):
+    """
+    Invalidation from an ingest process (seed-db.py, streaming and incremental
+    ingest). It reaches the API only through a shared backend; otherwise it
+    warns once that the API keeps its cached results until they expire.
+    Returns the number of entries removed.
+    """
+    global _warned_not_shared
+    cache = QueryCache.from_env()
+    if cache.shared:
+        return cache.invalidate(house_id, start, end)
+    if not _warned_not_shared:
+        _warned_not_shared = True
+        print(f"WARNING: the query cache is not shared between processes (set QUERY_CACHE_BACKEND=shared "
+              f"and REDIS_URL), so the API does not see this ingest. It keeps serving its cached results "
+              f"of the loaded houses for up to {max(cache.ttl_open, cache.ttl_closed)}s, and sends no HTTP ETags.")
+    return 0
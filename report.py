@@ -5,44 +5,141 @@ import os
 import json
 import ollama
 from datetime import datetime, timedelta
+import weather
+import layout
+from schema import CIRCUITS, CONSUMPTION_LAYOUT, ENERGY_COLUMNS
+
+
+load_dotenv()
+
+REPORT_MODEL = os.getenv('REPORT_MODEL', 'energy_reporter2')
+
+# 🎯 Feature groups
+ROOMS      = ["bathroom1","bedroom1","bedroom2","livingroom1","garage1","kitchen1","office1"]
+APPLIANCES = ["clotheswasher1","dishwasher1","kitchenapp1","kitchenapp2","microwave1","range1","refrigerator1","venthood1","oven1"]
+LIGHTING   = ["lights_plugs1","lights_plugs2","lights_plugs3"]
+WEATHER    = ["temp","dwpt","rhum","prcp","wdir","wspd","pres","coco"]
+ENERGY     = ["total_energy"]
+
+# Define time buckets based on usage patterns
+BUCKETS = {
+    "morning":       list(range(6, 10)),      # 6–9
+    "depart_work":   list(range(10, 14)),     # 10–13
+    "return_work":   list(range(14, 17)),     # 14–16
+    "evening":       list(range(17, 21)),     # 17–20
+    "night":         list(range(21, 24)) + list(range(0, 6)),
+}
+
+# Weather condition code lookup
+WEATHER_MAP = {
+    1: "Clear", 2: "Fair", 3: "Cloudy", 4: "Overcast", 5: "Fog", 6: "Freezing Fog",
+    7: "Light Rain", 8: "Rain", 9: "Heavy Rain", 10: "Freezing Rain", 11: "Heavy Freezing Rain",
+    12: "Sleet", 13: "Heavy Sleet", 14: "Light Snowfall", 15: "Snowfall", 16: "Heavy Snowfall",
+    17: "Rain Shower", 18: "Heavy Rain Shower", 19: "Sleet Shower", 20: "Heavy Sleet Shower",
+    21: "Snow Shower", 22: "Heavy Snow Shower", 23: "Lightning", 24: "Hail", 25: "Thunderstorm",
+    26: "Heavy Thunderstorm", 27: "Storm"
+}
+
+
+def get_season(date):
+    """Return the season name (Northern Hemisphere logic)."""
+    month = date.month
+    day = date.day
+    if (month == 12 and day >= 21) or (1 <= month <= 2) or (month == 3 and day < 20):
+        return "Winter"
+    elif (month == 3 and day >= 20) or (4 <= month <= 5) or (month == 6 and day < 21):
+        return "Spring"
+    elif (month == 6 and day >= 21) or (7 <= month <= 8) or (month == 9 and day < 22):
+        return "Summer"
+    else:
+        return "Autumn"
+
+
+def clean(d):
+    if isinstance(d, dict):
+        return {k: clean(v) for k,v in d.items()}
+    if isinstance(d, list):
+        return [clean(v) for v in d]
+    if isinstance(d, (np.integer,np.int64)): return int(d)
+    if isinstance(d, (np.floating,np.float64)): return float(d)
+    return d
+
+
+def hourly_window_query(house_id, first_day, last_day):
+    """
+    One bounded query over houses_consumption: per (day, hour) sums and
+    non-null counts of every energy column plus the circuit presence flags
+    (wide layout only), for first_day..last_day inclusive (~9 days x 24 hours of rows).
+    """
+    aggregates = []
+    for c in ENERGY_COLUMNS:
+        aggregates += [f"SUM({c}) AS {c}_sum", f"COUNT({c}) AS {c}_n"]
+    if CONSUMPTION_LAYOUT != 'compact':
+        aggregates += [f"MAX({c}_present) AS {c}_present" for c in CIRCUITS]
+    return f"""
+        SELECT DATE(date_time) AS day, HOUR(date_time) AS hour, {', '.join(aggregates)}
+        FROM houses_consumption
+        WHERE house_id = %s AND date_time >= %s AND date_time < %s
+        GROUP BY day, hour
+        ORDER BY day, hour""", (
+        house_id, datetime(first_day.year, first_day.month, first_day.day),
+        datetime(last_day.year, last_day.month, last_day.day) + timedelta(days=1))
+
+
+def hourly_frame(rows):
+    hourly = pd.DataFrame(list(rows))
+    if hourly.empty:
+        return hourly
+    numeric = [c for c in hourly.columns if c != "day"]
+    hourly[numeric] = hourly[numeric].apply(pd.to_numeric, errors="coerce")
+    return hourly
+
+
+def fetch_hourly_window(fetch, house_id, first_day, last_day):
+    return hourly_frame(fetch(*hourly_window_query(house_id, first_day, last_day)))
+
+
+def context_queries(house_id, day):
+    """
+    The independent queries build_context reads, name -> (SQL, arguments).
+    """
+    yesterday = day - timedelta(days=1)
+    queries = {'hourly': hourly_window_query(house_id, yesterday - timedelta(days=7), day)}
+    if CONSUMPTION_LAYOUT == 'compact':
+        queries['presence'] = layout.presence_query(house_id)
+    return queries
 
 
-def generate_report(house_id,day):
-    print('generating report for')
-    print(house_id)
-    print("at: ")
-    print(day)
-    # 🧠 Parameters (set dynamically later)
-    HOUSE_ID    = house_id
+def build_context(house_id, day, fetch):
+    """
+    Builds the LLM context for `day` (yesterday/today summaries, time-bucket
+    averages and 7-day hourly means) from the database window and the weather store.
+    fetch(query, args) must return the rows as dicts.
+    """
+    results = {name: list(fetch(*query)) for name, query in context_queries(house_id, day).items()}
+    return context_from_rows(house_id, day, results)
+
+
+def context_from_rows(house_id, day, results):
+    """
+    build_context from the rows of context_queries, name -> list of dicts.
+    """
     REPORT_DAY = day.isoformat()                  # string YYYY-MM-DD
-    #report_date = pd.to_datetime(REPORT_DAY).date()
     report_date = day
     yesterday   = report_date - timedelta(days=1)
+    h7_start    = yesterday - timedelta(days=7)
 
-    # 📥 Load cleaned dataset
-    CSV_PATH = "../data/house_3538.csv"
-    WEATHER_PATH = "../data/weather_data.csv"
-    df = pd.read_csv(CSV_PATH, parse_dates=["local_15min"])
-    wdf = pd.read_csv(WEATHER_PATH, parse_dates=["local_15min"])
-    merged_df = pd.merge(df, wdf, on='local_15min', how='left')
-
-    merged_df["date"] = merged_df["local_15min"].dt.date
-    merged_df["hour"] = merged_df["local_15min"].dt.hour
-
-
-    if yesterday not in merged_df.date.values or report_date not in merged_df.date.values:
+    # 📥 Per-hour aggregates for the 7-day history, yesterday and today
+    hourly = hourly_frame(results['hourly'])
+    if hourly.empty or yesterday not in hourly.day.values or report_date not in hourly.day.values:
         raise ValueError("Missing data for yesterday or today")
 
     # 🛰️ Identify which *_present flags = 1
-    present = [c for c in merged_df if c.endswith("_present") and merged_df[c].sum()>0]
-    avail = {p[:-8]: p for p in present}
-
-    # 🎯 Feature groups
-    ROOMS      = ["bathroom1","bedroom1","bedroom2","livingroom1","garage1","kitchen1","office1"]
-    APPLIANCES = ["clotheswasher1","dishwasher1","kitchenapp1","kitchenapp2","microwave1","range1","refrigerator1","venthood1","oven1"]
-    LIGHTING   = ["lights_plugs1","lights_plugs2","lights_plugs3"]
-    WEATHER    = ["temp","dwpt","rhum","prcp","wdir","wspd","pres","coco"]
-    ENERGY     = ["total_energy"]
+    if CONSUMPTION_LAYOUT == 'compact':
+        presence = (results.get('presence') or [{}])[0]
+        avail = {c for c in CIRCUITS if presence.get(f"{c}_present")}
+    else:
+        avail = {c for c in CIRCUITS if hourly[f"{c}_present"].fillna(0).max() > 0}
 
     feature_groups = {
         "rooms":      [f for f in ROOMS if f in avail],
@@ -52,120 +149,71 @@ def generate_report(house_id,day):
         "energy":     ENERGY,
     }
 
-    print("🏠 House rows:", len(merged_df))
-    print("📅 Date range:", merged_df.date.min(), "→", merged_df.date.max())
+    print("🏠 Hourly rows:", len(hourly))
+    print("📅 Date range:", hourly.day.min(), "→", hourly.day.max())
     print("🛏️ Rooms:", feature_groups["rooms"])
     print("🔌 Appliances:", feature_groups["appliances"])
     print("💡 Lighting:", feature_groups["lighting"])
 
-    # ✅ Cell 2 – Aggregate Yesterday, Today & 7-Day Averages, plus Time-Buckets
-
-    # Define time buckets based on usage patterns
-    BUCKETS = {
-        "morning":       list(range(6, 10)),      # 6–9
-        "depart_work":   list(range(10, 14)),     # 10–13
-        "return_work":   list(range(14, 17)),     # 14–16
-        "evening":       list(range(17, 21)),     # 17–20
-        "night":         list(range(21, 24)) + list(range(0, 6)),
-    }
+    store = weather.get_store()
+    h7_weather = store.frame(datetime(h7_start.year, h7_start.month, h7_start.day),
+                             datetime(yesterday.year, yesterday.month, yesterday.day))
 
+    # 7-day hourly mean values (mean of the per-hour means, as resample("H").mean().mean())
+    h7 = hourly[(hourly.day >= h7_start) & (hourly.day < yesterday)]
+    h7_avg = {}
+    for f in ENERGY + feature_groups["rooms"] + feature_groups["appliances"] + feature_groups["lighting"]:
+        per_hour = h7[f"{f}_sum"] / h7[f"{f}_n"].where(h7[f"{f}_n"] > 0)
+        h7_avg[f] = round(float(per_hour.mean()), 3)
+    if not h7_weather.empty:
+        weather_hourly = h7_weather.set_index("local_15min").resample("H").mean()
+        h7_avg.update({f: round(float(v), 3) for f, v in weather_hourly.mean().items() if f in WEATHER})
 
     def bucket_averages(data, features):
         out = {}
         for name, hours in BUCKETS.items():
             sub = data[data.hour.isin(hours)]
-            out[name] = {f: round(float(sub[f].mean()), 5)
-                        for f in features if f in sub.columns}
+            out[name] = {f: round(float(sub[f"{f}_sum"].sum() / sub[f"{f}_n"].sum()), 5) if sub[f"{f}_n"].sum() else float("nan")
+                        for f in features}
         return out
 
-
-    # Data slices
-    y_df = merged_df[merged_df.date == yesterday]
-    t_df = merged_df[merged_df.date == report_date]
-    h7 = merged_df[(merged_df.date >= yesterday - timedelta(days=7))
-                & (merged_df.date < yesterday)]
-
-    # 7-day hourly mean values
-    h7_hourly = (
-        h7.set_index("local_15min")
-        [ENERGY + feature_groups["rooms"] + feature_groups["appliances"] +
-            feature_groups["lighting"] + WEATHER]
-        .resample("H").mean()
-    )
-
-
-    def get_season(date):
-        """Return the season name (Northern Hemisphere logic)."""
-        month = date.month
-        day = date.day
-        if (month == 12 and day >= 21) or (1 <= month <= 2) or (month == 3 and day < 20):
-            return "Winter"
-        elif (month == 3 and day >= 20) or (4 <= month <= 5) or (month == 6 and day < 21):
-            return "Spring"
-        elif (month == 6 and day >= 21) or (7 <= month <= 8) or (month == 9 and day < 22):
-            return "Summer"
-        else:
-            return "Autumn"
-
-
-    def summarize_day(data, label):
+    def summarize_day(date, label):
+        data = hourly[hourly.day == date]
+        w = store.day_summary(date) or {}
+        coco = w.get("coco_mode")
         summary = {
             "label": label,
-            "total_energy": round(float(data.total_energy.sum()), 3),
-            "peak_hours": list(data.groupby("hour").total_energy.sum().nlargest(3).index),
+            "total_energy": round(float(data.total_energy_sum.sum()), 3),
+            "peak_hours": list(data.set_index("hour").total_energy_sum.nlargest(3).index),
             "breakdown": {
-                "rooms": round(data[feature_groups["rooms"]].sum().sum(), 3),
-                "appliances": round(data[feature_groups["appliances"]].sum().sum(), 3),
-                "lighting": round(data[feature_groups["lighting"]].sum().sum(), 3),
+                "rooms": round(float(data[[f"{f}_sum" for f in feature_groups["rooms"]]].sum().sum()), 3),
+                "appliances": round(float(data[[f"{f}_sum" for f in feature_groups["appliances"]]].sum().sum()), 3),
+                "lighting": round(float(data[[f"{f}_sum" for f in feature_groups["lighting"]]].sum().sum()), 3),
             },
             "weather": {
-                "min": round(data.temp.min(), 2),
-                "mean": round(data.temp.mean(), 2),
-                "max": round(data.temp.max(), 2),
-                "desc": WEATHER_MAP.get(int(data.coco.mode().iloc[0]), "Unknown"),
+                "min": round(w.get("temp_min", float("nan")), 2),
+                "mean": round(w.get("temp_mean", float("nan")), 2),
+                "max": round(w.get("temp_max", float("nan")), 2),
+                "desc": WEATHER_MAP.get(int(coco), "Unknown") if coco is not None and not np.isnan(coco) else "Unknown",
             },
-            "season": get_season(data.date.iloc[0]),
+            "season": get_season(date),
             "buckets": bucket_averages(data, ["total_energy"] + feature_groups["rooms"] + feature_groups["appliances"]),
-            "7d_avg": {k: round(float(v), 3) for k, v in h7_hourly.mean().items() if k in data.columns},
+            "7d_avg": h7_avg,
         }
         return summary
 
-
-    # Weather condition code lookup
-    WEATHER_MAP = {
-        1: "Clear", 2: "Fair", 3: "Cloudy", 4: "Overcast", 5: "Fog", 6: "Freezing Fog",
-        7: "Light Rain", 8: "Rain", 9: "Heavy Rain", 10: "Freezing Rain", 11: "Heavy Freezing Rain",
-        12: "Sleet", 13: "Heavy Sleet", 14: "Light Snowfall", 15: "Snowfall", 16: "Heavy Snowfall",
-        17: "Rain Shower", 18: "Heavy Rain Shower", 19: "Sleet Shower", 20: "Heavy Sleet Shower",
-        21: "Snow Shower", 22: "Heavy Snow Shower", 23: "Lightning", 24: "Hail", 25: "Thunderstorm",
-        26: "Heavy Thunderstorm", 27: "Storm"
-    }
-
-    # 🧠 Run the summaries
-    y_stats = summarize_day(y_df, label="yesterday")
-    t_stats = summarize_day(t_df, label="today")
-
-    # Cell 3 – Build JSON Context for LLM
-
-    def clean(d):
-        if isinstance(d, dict):
-            return {k: clean(v) for k,v in d.items()}
-        if isinstance(d, list):
-            return [clean(v) for v in d]
-        if isinstance(d, (np.integer,np.int64)): return int(d)
-        if isinstance(d, (np.floating,np.float64)): return float(d)
-        return d
-
-
-    context = {
-        "house_id": HOUSE_ID,
+    return clean({
+        "house_id": house_id,
         "report_date": REPORT_DAY,
-        "yesterday": summarize_day(y_df, "Yesterday"),
-        "today": summarize_day(t_df, "Today")
-    }
-    with open("llm_ctx.json", "w") as f:
-        json.dump(context, f, indent=2)
+        "yesterday": summarize_day(yesterday, "Yesterday"),
+        "today": summarize_day(report_date, "Today")
+    })
 
+
+def build_prompt(context):
+    """
+    Instruction, seasonal few-shot example and JSON context for the LLM.
+    """
     # Cell 4 – Build Instruction + Seasonal Few-Shot Prompt for LLM
 
     # 🧠 Instruction always included
@@ -307,30 +355,14 @@ def generate_report(house_id,day):
     """
     }
 
-    # 📥 Load season from context
-    with open("llm_ctx.json", "r", encoding="utf-8") as f:
-        context = json.load(f)
+    # 📥 Season from context
     season = context["today"]["season"]
 
     # 🧾 Compose final prompt
-    instruction_fewshot_prompt = instruction + \
+    instruction_prompt = instruction + \
         "\n" + few_shot_examples.get(season, "")
 
-    # 💾 Save to file
-    with open("llm_instruction_fewshot_prompt.txt", "w", encoding="utf-8") as f:
-        f.write(instruction_fewshot_prompt.strip())
-
-    print(
-        f"✅ Instruction + {season} example saved to llm_instruction_fewshot_prompt.txt")
-
-    # ✅ Cell 5 – Generate Final Daily Energy Report Using gemma3:4b
-
-    # 📥 Load context and prompt from saved files
-    with open("llm_ctx.json") as f:
-        context = json.load(f)
-
-    with open("llm_instruction_fewshot_prompt.txt") as f:
-        instruction_prompt = f.read()
+    print(f"✅ Instruction + {season} example prepared")
 
     # 🧠 Final prompt: instruction + context
     final_prompt = (
@@ -340,29 +372,66 @@ def generate_report(house_id,day):
         "\n\nNow generate the 4-part energy report:"
     )
 
+    return final_prompt
+
+
+def ollama_host():
+    """
+    OLLAMA_HOST (full URL) takes precedence over MY_IP, so a local stub
+    server can stand in for Ollama.
+    """
     load_dotenv()
-    OLLAMA_HOST_IP = os.getenv('MY_IP')
+    ollama_host = os.getenv('OLLAMA_HOST')
+    if not ollama_host:
+        OLLAMA_HOST_IP = os.getenv('MY_IP')
+        # Construct the full host URL
+        ollama_host = f"http://{OLLAMA_HOST_IP}:11434"
+    return ollama_host
 
-    # Construct the full host URL
-    ollama_host = f"http://{OLLAMA_HOST_IP}:11434"
-    # 💬 Initialize Ollama client and call IREMS_reporter local model
-    client = ollama.Client(host=ollama_host)
 
-    response = client.generate(
-        model="energy_reporter2",
+def ollama_client():
+    """
+    Client for the report model.
+    """
+    # 💬 Initialize Ollama client for the IREMS_reporter local model
+    return ollama.Client(host=ollama_host())
+
+
+def generate_report(house_id, day, fetch):
+    print('generating report for')
+    print(house_id)
+    print("at: ")
+    print(day)
+
+    # Cell 2/3 – Aggregate Yesterday, Today & 7-Day Averages into the JSON context for the LLM
+    context = build_context(house_id, day, fetch)
+    final_prompt = build_prompt(context)
+
+    # ✅ Cell 5 – Generate Final Daily Energy Report
+    response = ollama_client().generate(
+        model=REPORT_MODEL,
         prompt=final_prompt,
         stream=False,
     )
 
-    # 📝 Decode and save result
+    # 📝 Decode result, the caller stores it per (house, day)
     generated_report = response['response'].strip()
 
-    with open("llm_daily_report.txt", "w", encoding="utf-8") as f:
-        f.write(generated_report)
-
-    # 📊 Display preview or full report
+    # 📊 Display preview
     print("\n✅ Final Daily Energy Report:\n" + "-"*60)
     print(generated_report[:2000])  # Print first 2000 chars
-    if len(generated_report) > 2000:
-        print("📁 Full report saved to 'llm_daily_report.txt'")
-    print("-"*60)
\ No newline at end of file
+    print("-"*60)
+    return generated_report
+
+
+def stream_report(house_id, day, fetch):
+    """
+    Same as generate_report but yields the model's tokens as they are generated.
+    The caller assembles (and stores) the full text.
+    """
+    context = build_context(house_id, day, fetch)
+    final_prompt = build_prompt(context)
+    for chunk in ollama_client().generate(model=REPORT_MODEL, prompt=final_prompt, stream=True):
+        token = chunk['response']
+        if token:
+            yield token
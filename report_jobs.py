@@ -0,0 +1,236 @@
+"""
+Background generation of daily reports.
+
+ReportStore persists finished reports as reports/<house_id>/<YYYY-MM-DD>.txt.
+ReportJobQueue runs report generation on a bounded worker pool: a request for
+a (house, day) that is already queued or running joins the existing job
+instead of starting a second LLM call. When generation yields the model's
+tokens, every client streaming the report follows the same job with
+ReportJob.follow.
+
+A report of a day that is still running is built from partial readings, so it
+is never stored: the queue keeps it in memory for OPEN_REPORT_SECONDS and
+generates it again after that.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REPORTS_DIR = os.getenv('REPORTS_DIR', 'reports')
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 2))
+REPORT_QUEUE_SIZE = int(os.getenv('REPORT_QUEUE_SIZE', 100))
+JOB_RETENTION_SECONDS = 3600
+OPEN_REPORT_SECONDS = int(os.getenv('OPEN_REPORT_SECONDS', 900))  # reuse of a report of the running day
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ReportStore:
+    def __init__(self, root=REPORTS_DIR):
+        self.root = root
+
+    def path(self, house_id, day):
+        return os.path.join(self.root, str(house_id), f"{day.isoformat()}.txt")
+
+    def get(self, house_id, day):
+        """
+        Stored report text, or None if it was not generated yet.
+        """
+        try:
+            with open(self.path(house_id, day), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, house_id, day):
+        return os.path.exists(self.path(house_id, day))
+
+    def touch(self, house_id):
+        """
+        Records that the house's reports were requested (used to prioritise precomputation).
+        """
+        path = os.path.join(self.root, str(house_id), '.last_access')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a'):
+            os.utime(path, None)
+
+    def last_access(self, house_id):
+        """
+        Timestamp of the last report request for the house, 0 if never.
+        """
+        try:
+            return os.path.getmtime(os.path.join(self.root, str(house_id), '.last_access'))
+        except OSError:
+            return 0.0
+
+    def put(self, house_id, day, text):
+        """
+        Writes through a temp file so readers never see a partial report.
+        """
+        path = self.path(house_id, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+class ReportJob:
+    def __init__(self, house_id, day):
+        self.id = uuid.uuid4().hex
+        self.house_id = house_id
+        self.day = day
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+        self.tokens = []  # model tokens generated so far
+        self.text = None  # the finished report
+        self._changed = threading.Condition()
+
+    def add_token(self, token):
+        with self._changed:
+            self.tokens.append(token)
+            self._changed.notify_all()
+
+    def finish(self):
+        with self._changed:
+            self.done.set()
+            self._changed.notify_all()
+
+    def follow(self, timeout=15):
+        """
+        Yields the job's tokens, from the first one, as they are generated and
+        None after `timeout` seconds without one; ends once the job is done.
+        """
+        seen = 0
+        while True:
+            with self._changed:
+                if len(self.tokens) == seen and not self.done.is_set():
+                    self._changed.wait(timeout)
+                tokens = self.tokens[seen:]
+                finished = self.done.is_set()
+            seen += len(tokens)
+            yield from tokens
+            if finished:
+                return
+            if not tokens:
+                yield None
+
+    def as_dict(self):
+        return {
+            'job_id': self.id,
+            'house_id': self.house_id,
+            'day': self.day.isoformat(),
+            'status': self.status,
+            'error': self.error,
+        }
+
+
+class ReportJobQueue:
+    """
+    generate(house_id, day) runs on a worker thread and returns the report
+    text, or yields it token by token so clients can follow the job.
+    is_open(day) tells whether the day is still running (its reports are not stored).
+    """
+
+    def __init__(self, store, generate, workers=REPORT_WORKERS, max_pending=REPORT_QUEUE_SIZE, is_open=None):
+        self.store = store
+        self.generate = generate
+        self.max_pending = max_pending
+        self.is_open = is_open or (lambda day: False)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report')
+        self._jobs = {}       # job id -> job
+        self._active = {}     # (house_id, day) -> job still queued or running
+        self._open = {}       # (house_id, day) -> (generated at, text) of days still running
+        self._lock = threading.Lock()
+
+    def submit(self, house_id, day):
+        """
+        Returns the job generating (house_id, day), creating it if needed.
+        Raises QueueFull when max_pending jobs are already waiting.
+        """
+        key = (house_id, day)
+        with self._lock:
+            self._prune()
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            if len(self._active) >= self.max_pending:
+                raise QueueFull(f"{len(self._active)} reports already pending")
+            job = ReportJob(house_id, day)
+            self._jobs[job.id] = job
+            self._active[key] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, house_id, day):
+        """
+        The queued or running job for (house_id, day), if any.
+        """
+        with self._lock:
+            return self._active.get((house_id, day))
+
+    def report(self, house_id, day):
+        """
+        Finished report of (house_id, day): the stored one, or for a day still
+        running the one generated less than OPEN_REPORT_SECONDS ago. None otherwise.
+        """
+        if not self.is_open(day):
+            return self.store.get(house_id, day)
+        with self._lock:
+            generated_at, text = self._open.get((house_id, day), (0.0, None))
+        return text if time.time() - generated_at < OPEN_REPORT_SECONDS else None
+
+    def _run(self, job):
+        job.status = 'running'
+        try:
+            is_open = self.is_open(job.day)
+            if is_open or not self.store.exists(job.house_id, job.day):
+                text = self.generate(job.house_id, job.day)
+                if not isinstance(text, str):
+                    for token in text:
+                        job.add_token(token)
+                    text = "".join(job.tokens).strip()
+                if is_open:
+                    with self._lock:
+                        self._open[(job.house_id, job.day)] = (time.time(), text)
+                else:
+                    self.store.put(job.house_id, job.day, text)
+                job.text = text
+            else:
+                job.text = self.store.get(job.house_id, job.day)
+            job.status = 'done'
+        except Exception as e:
+            print(f"Report job {job.id} for house {job.house_id} on {job.day} failed: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop((job.house_id, job.day), None)
+            job.finish()
+
+    def _prune(self):
+        """
+        Forgets finished jobs after JOB_RETENTION_SECONDS and expired reports
+        of running days (caller holds the lock).
+        """
+        now = time.time()
+        cutoff = now - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+        for key in [k for k, (generated_at, _) in self._open.items() if now - generated_at >= OPEN_REPORT_SECONDS]:
+            del self._open[key]
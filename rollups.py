@@ -0,0 +1,339 @@
+"""
+Hourly, daily and monthly rollups of houses_consumption.
+
+The rollup tables hold per-house sums of every energy column plus the number
+of raw 15-minute readings that went into each bucket. They are created by
+init-db.py, backfilled by seed-db.py and refreshed incrementally whenever new
+readings are written, cascading raw -> hourly -> daily -> monthly so a refresh
+only touches the buckets that actually changed.
+
+The dashboard endpoints build their aggregate queries with `totals_query`,
+which answers a date range from the coarsest rollup that fully covers each
+part of it and only falls back to finer tables (and finally the raw rows) at
+the edges of the range. Those raw edges are grouped by the stored generated
+bucket columns of houses_consumption (BUCKET_COLUMNS), read in order from
+covering indexes, so MySQL neither evaluates DATE() per row nor builds a
+temporary table for them; `plan_problems` checks that with EXPLAIN.
+"""
+from datetime import date, datetime, timedelta
+
+from schema import DASHBOARD_CIRCUITS, ENERGY_COLUMNS, TABLE_NAME
+
+# grain -> (table, bucket column, bucket column type)
+ROLLUP_TABLES = {
+    'hour': ('houses_consumption_hourly', 'hour', 'DATETIME'),
+    'day': ('houses_consumption_daily', 'day', 'DATE'),
+    'month': ('houses_consumption_monthly', 'month', 'DATE'),
+}
+
+# grain -> (column, definition) of the stored generated bucket columns of houses_consumption.
+# Not named day/month: column names are case-insensitive and both layouts have a Month feature.
+BUCKET_COLUMNS = {
+    'day': ('reading_day', "DATE AS (DATE(date_time)) STORED"),
+    'month': ('reading_month', "DATE AS (DATE_SUB(DATE(date_time), INTERVAL DAYOFMONTH(date_time) - 1 DAY)) STORED"),
+}
+
+# grain -> (index, summed columns) of the covering indexes on (house_id, bucket, sums...)
+BUCKET_INDEXES = {
+    'day': ('idx_day_totals', DASHBOARD_CIRCUITS + ['total_energy']),
+    'month': ('idx_month_totals', ['total_energy']),
+}
+
+# Tables usable to answer a query at a given output grain, coarsest first
+LEVELS = {
+    'hour': ['hour', 'raw'],
+    'day': ['day', 'hour', 'raw'],
+    'month': ['month', 'day', 'hour', 'raw'],
+}
+
+
+def bucket_expr(grain, column):
+    """
+    SQL expression truncating a DATE/DATETIME column to the start of its bucket.
+    Avoids DATE_FORMAT so the statements stay free of '%' escaping.
+    """
+    if grain == 'hour':
+        return f"DATE_SUB({column}, INTERVAL MINUTE({column}) * 60 + SECOND({column}) SECOND)"
+    if grain == 'day':
+        return f"DATE({column})"
+    if grain == 'month':
+        return f"DATE_SUB(DATE({column}), INTERVAL DAYOFMONTH({column}) - 1 DAY)"
+    raise ValueError(f"Unknown rollup grain '{grain}'")
+
+
+def floor_to(grain, value):
+    """
+    Truncates a datetime to the start of its hour/day/month bucket.
+    """
+    if grain == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    if grain == 'day':
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if grain == 'month':
+        return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown rollup grain '{grain}'")
+
+
+def next_bucket(grain, value):
+    """
+    Returns the start of the bucket following the one `value` starts.
+    """
+    if grain == 'hour':
+        return value + timedelta(hours=1)
+    if grain == 'day':
+        return value + timedelta(days=1)
+    if grain == 'month':
+        if value.month == 12:
+            return value.replace(year=value.year + 1, month=1)
+        return value.replace(month=value.month + 1)
+    raise ValueError(f"Unknown rollup grain '{grain}'")
+
+
+def ceil_to(grain, value):
+    floored = floor_to(grain, value)
+    return floored if floored == value else next_bucket(grain, floored)
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def split_range(start, stop, levels):
+    """
+    Splits the half-open range [start, stop) into (level, start, stop) segments.
+    Each level covers the whole buckets it can, the remaining edges are handed
+    to the next, finer level; 'raw' takes whatever is left.
+    """
+    if start >= stop:
+        return []
+    level = levels[0]
+    if level == 'raw':
+        return [('raw', start, stop)]
+    first = ceil_to(level, start)
+    last = floor_to(level, stop)
+    if first >= last:
+        return split_range(start, stop, levels[1:])
+    return (split_range(start, first, levels[1:])
+            + [(level, first, last)]
+            + split_range(last, stop, levels[1:]))
+
+
+def totals_query(house_id, start, end, grain='day', columns=ENERGY_COLUMNS,
+                 aliases=None, bucket_alias='day', bucket_format=None, count_alias=None):
+    """
+    Builds the SQL (and its arguments) returning per-bucket sums of `columns`
+    for one house between `start` and `end` (inclusive, as with BETWEEN).
+
+    aliases        maps a column to the name it is returned under
+    bucket_format  optional DATE_FORMAT pattern applied to the bucket (with %% escaping)
+    count_alias    when set, the number of raw readings per bucket is returned under this name
+    """
+    aliases = aliases or {}
+    start = as_datetime(start)
+    stop = as_datetime(end) + timedelta(seconds=1)
+    segments = split_range(start, stop, LEVELS[grain]) or [('raw', start, stop)]
+
+    parts = []
+    args = []
+    for level, seg_start, seg_stop in segments:
+        if level == 'raw' and grain in BUCKET_COLUMNS:
+            # Grouped by the generated bucket column, in (house_id, bucket) index order
+            column = BUCKET_COLUMNS[grain][0]
+            sums = ', '.join(f"SUM({c}) AS {c}" for c in columns)
+            parts.append(
+                f"SELECT {column} AS bucket, {sums}, COUNT(*) AS readings "
+                f"FROM {TABLE_NAME} WHERE house_id = %s AND {column} >= %s AND {column} <= %s "
+                f"AND date_time >= %s AND date_time < %s GROUP BY {column}")
+            last = seg_stop - timedelta(microseconds=1)
+            args.extend([house_id, floor_to(grain, seg_start).date(), floor_to(grain, last).date(), seg_start, seg_stop])
+            continue
+        if level == 'raw':
+            table, column = TABLE_NAME, 'date_time'
+            readings = '1 AS readings'
+        else:
+            table, column, _ = ROLLUP_TABLES[level]
+            readings = 'readings'
+        bucket = column if level == grain else bucket_expr(grain, column)
+        parts.append(
+            f"SELECT {bucket} AS bucket, {', '.join(columns)}, {readings} "
+            f"FROM {table} WHERE house_id = %s AND {column} >= %s AND {column} < %s")
+        args.extend([house_id, seg_start, seg_stop])
+
+    outer_bucket = f"DATE_FORMAT(bucket, '{bucket_format}')" if bucket_format else 'bucket'
+    select = [f"{outer_bucket} AS {bucket_alias}"]
+    select += [f"SUM({c}) AS {aliases.get(c, c)}" for c in columns]
+    if count_alias:
+        select.append(f"CAST(SUM(readings) AS SIGNED) AS {count_alias}")
+    query = (
+        f"SELECT {', '.join(select)}\n"
+        f"FROM (\n    " + "\n    UNION ALL\n    ".join(parts) + "\n) AS segments\n"
+        f"GROUP BY bucket\n"
+        f"ORDER BY bucket ASC")
+    return query, tuple(args)
+
+
+def daily_totals_query(house_id, start, end):
+    """
+    Per-day sums of the dashboard circuits between start and end (inclusive),
+    answered from the rollup tables wherever whole hours/days are covered.
+    """
+    return totals_query(
+        house_id, start, end, grain='day',
+        columns=DASHBOARD_CIRCUITS + ['total_energy'],
+        aliases={'total_energy': 'total_consumption'})
+
+
+def monthly_bills_query(house_id, start, end):
+    """
+    Per-month consumption ('YYYY-MM') and number of readings between start and end (inclusive).
+    """
+    return totals_query(
+        house_id, start, end, grain='month',
+        columns=['total_energy'], aliases={'total_energy': 'monthly_consumption'},
+        bucket_alias='month', bucket_format='%%Y-%%m', count_alias='total_records')
+
+
+def bucket_columns_ddl():
+    """
+    Column and index definitions of the generated bucket columns, for a CREATE TABLE.
+    """
+    definitions = [f"{column} {definition}" for column, definition in BUCKET_COLUMNS.values()]
+    for grain, (index, sums) in BUCKET_INDEXES.items():
+        definitions.append(f"INDEX {index} (house_id, {BUCKET_COLUMNS[grain][0]}, {', '.join(sums)})")
+    return definitions
+
+
+def add_bucket_columns(cursor, table_name=TABLE_NAME):
+    """
+    Adds the generated bucket columns and their covering indexes to an existing
+    houses_consumption (one table rebuild). Returns the names of what was added.
+    """
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table_name,))
+    columns = {row[0].lower() for row in cursor.fetchall()}
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table_name,))
+    indexes = {row[0].lower() for row in cursor.fetchall()}
+
+    added = []
+    changes = []
+    for column, definition in BUCKET_COLUMNS.values():
+        if column not in columns:
+            changes.append(f"ADD COLUMN {column} {definition}")
+            added.append(column)
+    for grain, (index, sums) in BUCKET_INDEXES.items():
+        if index.lower() not in indexes:
+            changes.append(f"ADD INDEX {index} (house_id, {BUCKET_COLUMNS[grain][0]}, {', '.join(sums)})")
+            added.append(index)
+    if changes:
+        cursor.execute(f"ALTER TABLE {table_name} {', '.join(changes)}")
+    return added
+
+
+def plan_problems(cursor, query, args=None):
+    """
+    EXPLAINs a query and returns (plan rows, problems). A problem is a full
+    scan, a filesort or a temporary table on a base table; the temporary table
+    merging the few pre-aggregated rows of the UNION (<derived>/<union>) is expected.
+    """
+    cursor.execute(f"EXPLAIN {query}", args)
+    names = [d[0] for d in cursor.description]
+    plan = [row if isinstance(row, dict) else dict(zip(names, row)) for row in cursor.fetchall()]
+    problems = []
+    for row in plan:
+        table = row.get('table') or ''
+        if not table or table.startswith('<'):
+            continue
+        extra = row.get('Extra') or ''
+        if row.get('type') == 'ALL':
+            problems.append(f"{table}: full table scan")
+        for flag in ('Using filesort', 'Using temporary'):
+            if flag in extra:
+                problems.append(f"{table}: {flag.lower()}")
+    return plan, problems
+
+
+def create_rollup_tables(cursor):
+    """
+    Creates the hourly/daily/monthly rollup tables if they do not exist.
+    """
+    sums = ',\n            '.join(f"{c} DECIMAL(16, 4)" for c in ENERGY_COLUMNS)
+    for table, column, column_type in ROLLUP_TABLES.values():
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            house_id INT NOT NULL,
+            {column} {column_type} NOT NULL,
+            {sums},
+            readings INT UNSIGNED NOT NULL,
+            PRIMARY KEY (house_id, {column}),
+            FOREIGN KEY (house_id) REFERENCES houses(id)
+        ) ENGINE=InnoDB;
+        """)
+
+
+def _upsert_rollup(cursor, grain, source, source_column, house_id, start, stop):
+    """
+    Recomputes the `grain` buckets in [start, stop) from the next finer table.
+    The aggregate is wrapped in a derived table so ON DUPLICATE KEY UPDATE
+    can use VALUES() without ambiguous column references.
+    """
+    table, column, _ = ROLLUP_TABLES[grain]
+    readings = 'COUNT(*)' if source == TABLE_NAME else 'SUM(readings)'
+    columns = ', '.join(ENERGY_COLUMNS)
+    sums = ', '.join(f"SUM({c})" for c in ENERGY_COLUMNS)
+    updates = ', '.join(f"{c} = VALUES({c})" for c in ENERGY_COLUMNS + ['readings'])
+    cursor.execute(f"""
+        INSERT INTO {table} (house_id, {column}, {columns}, readings)
+        SELECT * FROM (
+            SELECT house_id, {bucket_expr(grain, source_column)} AS bucket, {sums}, {readings}
+            FROM {source}
+            WHERE house_id = %s AND {source_column} >= %s AND {source_column} < %s
+            GROUP BY house_id, bucket
+        ) AS agg
+        ON DUPLICATE KEY UPDATE {updates}""",
+        (house_id, start, stop))
+
+
+def refresh_rollups(cursor, house_id, start, end):
+    """
+    Brings the rollups of one house up to date for readings between
+    `start` and `end` (inclusive). Call it after writing new readings;
+    the caller is responsible for committing.
+    """
+    start = as_datetime(start)
+    end = as_datetime(end)
+    hour_start = floor_to('hour', start)
+    hour_stop = next_bucket('hour', floor_to('hour', end))
+    _upsert_rollup(cursor, 'hour', TABLE_NAME, 'date_time', house_id, hour_start, hour_stop)
+
+    day_start = floor_to('day', start)
+    day_stop = next_bucket('day', floor_to('day', end))
+    _upsert_rollup(cursor, 'day', ROLLUP_TABLES['hour'][0], 'hour', house_id, day_start, day_stop)
+
+    month_start = floor_to('month', start)
+    month_stop = next_bucket('month', floor_to('month', end))
+    _upsert_rollup(cursor, 'month', ROLLUP_TABLES['day'][0], 'day', house_id, month_start, month_stop)
+
+
+def backfill_rollups(cursor, house_id=None):
+    """
+    Rebuilds the rollups from the raw readings, for one house or for all of them.
+    Returns the number of houses refreshed.
+    """
+    if house_id is None:
+        cursor.execute(f"SELECT house_id, MIN(date_time), MAX(date_time) FROM {TABLE_NAME} GROUP BY house_id")
+    else:
+        cursor.execute(f"SELECT house_id, MIN(date_time), MAX(date_time) FROM {TABLE_NAME} WHERE house_id = %s GROUP BY house_id", (house_id,))
+    ranges = cursor.fetchall()
+    for row in ranges:
+        if isinstance(row, dict):
+            row = tuple(row.values())
+        house, first, last = row
+        refresh_rollups(cursor, house, first, last)
+    return len(ranges)
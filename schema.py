@@ -0,0 +1,49 @@
+"""
+Column definitions shared by the API server, the report pipeline and the
+database scripts (init-db.py / seed-db.py).
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TABLE_NAME = 'houses_consumption'
+
+# Circuit columns as defined in init-db.py (one DECIMAL reading per 15 minutes)
+CIRCUITS = [
+    'bathroom1', 'bedroom1', 'bedroom2', 'clotheswasher1', 'livingroom1',
+    'dishwasher1', 'garage1', 'kitchen1', 'kitchenapp1', 'kitchenapp2',
+    'lights_plugs1', 'lights_plugs2', 'lights_plugs3', 'microwave1',
+    'office1', 'range1', 'refrigerator1', 'venthood1', 'oven1',
+]
+
+# Every summable energy column of a reading
+ENERGY_COLUMNS = CIRCUITS + ['total_energy']
+
+# Columns summed by the dashboard endpoints (total_energy is exposed as total_consumption)
+DASHBOARD_CIRCUITS = [
+    'bathroom1', 'bedroom1', 'bedroom2', 'livingroom1', 'garage1',
+    'kitchen1', 'office1', 'range1', 'venthood1',
+]
+
+# Derived time features (see features.py) and per-circuit presence flags
+TIME_FEATURE_COLUMNS = ['Weekday', 'Month', 'Hour', 'Hour_sin', 'Hour_cos', 'DoW_sin', 'DoW_cos']
+PRESENCE_COLUMNS = [f"{c}_present" for c in CIRCUITS]
+
+# Column order of a houses_consumption row
+READING_COLUMNS = ['date_time', 'house_id'] + ENERGY_COLUMNS + TIME_FEATURE_COLUMNS + PRESENCE_COLUMNS
+
+# Row layout of houses_consumption (see layout.py):
+# - wide: presence flags and time features are stored on every row (original layout)
+# - compact: presence lives in CIRCUITS_TABLE, the time features are virtual generated columns
+CONSUMPTION_LAYOUT = os.getenv('CONSUMPTION_LAYOUT', 'wide')
+CIRCUITS_TABLE = 'house_circuits'
+
+# Columns written by the ingest paths; a prefix of READING_COLUMNS in both layouts
+STORED_COLUMNS = READING_COLUMNS if CONSUMPTION_LAYOUT != 'compact' else ['date_time', 'house_id'] + ENERGY_COLUMNS
+
+# Largest values the reading columns hold: DECIMAL(10, 4) circuits and DECIMAL(12, 4) total_energy,
+# DECIMAL(6, 4) and (8, 4) in the compact layout
+MAX_CIRCUIT_READING = 99.9999 if CONSUMPTION_LAYOUT == 'compact' else 999999.9999
+MAX_TOTAL_ENERGY = 9999.9999 if CONSUMPTION_LAYOUT == 'compact' else 99999999.9999
@@ -1,9 +1,22 @@
+import argparse
+import glob
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import mysql.connector
 from mysql.connector import Error
 from mysql.connector import errorcode
-import os
 from dotenv import load_dotenv
+import db
+import rollups
+import ingest
+import layout
+import query_cache
+from schema import CIRCUITS, CONSUMPTION_LAYOUT, READING_COLUMNS, STORED_COLUMNS
 
 load_dotenv()
 
@@ -14,6 +27,10 @@ DB_NAME = os.getenv('DB_NAME','bems_db')  # Name of the database to create/use
 DB_PORT = int(os.getenv('DB_PORT', 3306))  # Default MySQL port is 3306
 #TABLE_NAME = os.environ.get('TABLE_NAME', 'items')  # Default table name for CSV data
 CSV_FILE_PATH = os.getenv('CSV_FILE_PATH')  # Path to your CSV file
+# Parallel ingestion (--all): worker processes and the user new houses are registered under
+SEED_WORKERS = int(os.getenv('SEED_WORKERS', os.cpu_count() or 1))
+SEED_HOUSE_OWNER = int(os.getenv('SEED_HOUSE_OWNER', 1))
+SEED_BATCH_SIZE = int(os.getenv('SEED_BATCH_SIZE', 5000))  # rows per executemany when LOAD DATA is unavailable
 
 print(f"\n--- Environment Variables as seen by script ---")
 print(f"DB_HOST: '{DB_HOST}'")
@@ -24,39 +41,62 @@ print(f"DB_PORT: {DB_PORT}")
 print(f"CSV_FILE_PATH: '{CSV_FILE_PATH}'")
 print(f"---------------------------------------------\n")
 
-file_path = CSV_FILE_PATH+ 'house_3538.csv'
+file_path = (CSV_FILE_PATH or '') + 'house_3538.csv'
 house_id = 3538
 
-def load_data():
+HOUSE_FILE_PATTERN = re.compile(r'house_(\d+)\.csv$')
+
+# Column order of the houses_consumption table (and of the prepared bulk-load files)
+table_columns = READING_COLUMNS
+
+# Errors meaning the server or client refuses LOAD DATA LOCAL INFILE
+LOCAL_INFILE_DISABLED = {errorcode.ER_NOT_ALLOWED_COMMAND, 3948, 2068}
+
+
+def connect(allow_local_infile=False):
+    return mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        port=DB_PORT,
+        allow_local_infile=allow_local_infile
+    )
+
+# Connections of this worker process, reused across the files it loads (one pool per LOCAL INFILE setting)
+_pools = {}
+
+def pooled(allow_local_infile=False):
+    """
+    The connection pool of the current process. Created lazily so forked
+    workers never share the parent's sockets.
+    """
+    pool = _pools.get(allow_local_infile)
+    if pool is None:
+        pool = _pools[allow_local_infile] = db.ConnectionPool(
+            lambda: connect(allow_local_infile), min_size=0, max_size=1)
+    return pool
+
+def load_data(path=None, house=None):
+    path = path or file_path
+    house = house_id if house is None else house
     # Load the dataset
-    df = pd.read_csv(file_path)  
+    df = pd.read_csv(path)
+
 
-    
     #df = df.drop(['dataid', 'house_construction_year','total_square_footage', 'first_floor_square_footage' ], axis=1, errors='ignore')  # Drop columns that are not needed
-    df = df['local_15min', 'bathroom1', 'bedroom1', 'bedroom2',
-       'clotheswasher1', 'livingroom1', 'dishwasher1', 'garage1', 'kitchen1',
-       'kitchenapp1', 'kitchenapp2', 'lights_plugs1', 'lights_plugs2',
-       'lights_plugs3', 'microwave1', 'office1', 'range1', 'refrigerator1',
-       'venthood1', 'oven1', 'total_energy', 'Weekday',
-       'Month', 'Hour', 'Hour_sin', 'Hour_cos', 'DoW_sin', 'DoW_cos',
-       'bathroom1_present', 'bedroom1_present', 'bedroom2_present',
-       'clotheswasher1_present', 'livingroom1_present', 'dishwasher1_present',
-       'garage1_present', 'kitchen1_present', 'kitchenapp1_present',
-       'kitchenapp2_present', 'lights_plugs1_present', 'lights_plugs2_present',
-       'lights_plugs3_present', 'microwave1_present', 'office1_present',
-       'range1_present', 'refrigerator1_present', 'venthood1_present',
-       'oven1_present']
+    df = df[['local_15min'] + [c for c in table_columns if c not in ('date_time', 'house_id')]]
     df.rename(columns={'local_15min': 'date_time'}, inplace=True)
 
     # Add the house_id column
-    df['house_id'] = house_id
+    df['house_id'] = house
 
     # Convert 'date_time' to datetime objects to ensure correct formatting for MySQL
     df['date_time'] = pd.to_datetime(df['date_time'])
-    
+
     # Convert all columns to string type
     #df = df.astype(str)
-    
+
     # Set 'date' as the index
     #df.set_index('date', inplace=True)
 
@@ -65,6 +105,194 @@ def load_data():
 
     return df
 
+def discover_house_files(root):
+    """
+    (house_id, path) of every house_<id>.csv under root, largest files first
+    so the pool does not end on one long straggler.
+    """
+    found = []
+    for path in glob.glob(os.path.join(root, '**', 'house_*.csv'), recursive=True):
+        match = HOUSE_FILE_PATTERN.search(os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found, key=lambda item: os.path.getsize(item[1]), reverse=True)
+
+def register_houses(conn, house_ids, owner=SEED_HOUSE_OWNER):
+    """
+    Inserts the houses that are not in the houses table yet, owned by `owner`.
+    Returns the ids that were added.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT id FROM houses")
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = sorted(set(house_ids) - existing)
+    if missing:
+        cursor.executemany("INSERT INTO houses (id, user_id) VALUES (%s, %s)", [(h, owner) for h in missing])
+        conn.commit()
+    cursor.close()
+    return missing
+
+def bulk_load(conn, df, table_name):
+    """
+    Writes df to a temporary CSV and loads it with LOAD DATA LOCAL INFILE,
+    replacing readings that are already stored. Returns the number of rows loaded.
+    """
+    if CONSUMPTION_LAYOUT == 'compact':
+        cursor = conn.cursor()
+        for house, group in df.groupby('house_id'):
+            layout.update_house_circuits(cursor, house, {c for c in CIRCUITS if group[f"{c}_present"].fillna(0).any()})
+        cursor.close()
+    df = df[STORED_COLUMNS].copy()
+    for column in df.columns[df.dtypes == bool]:
+        df[column] = df[column].astype('int8')
+    fd, tmp_path = tempfile.mkstemp(prefix='seed_', suffix='.csv')
+    os.close(fd)
+    try:
+        df.to_csv(tmp_path, index=False, header=False, na_rep='\\N', date_format='%Y-%m-%d %H:%M:%S')
+        cursor = conn.cursor()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {table_name} "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+            f"({', '.join(df.columns)})",
+            (tmp_path,))
+        loaded = cursor.rowcount
+        cursor.close()
+        return loaded
+    finally:
+        os.remove(tmp_path)
+
+def insert_rows(conn, df, table_name, batch_size=SEED_BATCH_SIZE):
+    """
+    Batched upserts, for servers without LOAD DATA LOCAL INFILE. Readings
+    that are already stored are overwritten, so re-running a load is safe.
+    """
+    df = df[table_columns].astype(object).where(df.notna(), None)
+    cursor = conn.cursor()
+    inserted = 0
+    for offset in range(0, len(df), batch_size):
+        chunk = df.iloc[offset:offset + batch_size]
+        ingest.write_readings(cursor, list(chunk.itertuples(index=False, name=None)), table_name)
+        inserted += len(chunk)
+    cursor.close()
+    return inserted
+
+def after_load(conn, house, first, last):
+    """
+    Refreshes the rollups of the loaded range, advances the house's watermark
+    and drops the cached API results covering it.
+    """
+    cursor = conn.cursor()
+    rollups.refresh_rollups(cursor, house, first, last)
+    ingest.create_watermark_table(cursor)
+    ingest.set_watermark(cursor, house, last)
+    conn.commit()
+    cursor.close()
+    return query_cache.invalidate_ingested(house, first, last)
+
+def stream_house_file(conn, house, path, chunk_rows=ingest.INGEST_CHUNK_ROWS, restart=False, incremental=False):
+    """
+    Loads one house file chunk by chunk, resuming from its checkpoint, or with
+    incremental=True only the readings past the house's watermark.
+    """
+    loader = ingest.IncrementalIngest if incremental else ingest.StreamingIngest
+    return loader(conn, path, house, chunk_rows=chunk_rows).run(restart=restart)
+
+def ingest_house_file(house, path, table_name='houses_consumption', use_bulk_load=True, stream=False, incremental=False,
+                      chunk_rows=ingest.INGEST_CHUNK_ROWS, restart=False):
+    """
+    Loads one house file on the worker's pooled connection (run inside a pool worker);
+    chunk_rows and restart apply to stream/incremental loads (see stream_house_file).
+    Returns the load statistics of the file.
+    """
+    started = time.perf_counter()
+    stream = stream or incremental
+    with pooled(allow_local_infile=use_bulk_load and not stream).connection() as conn:
+        if stream:
+            stats = stream_house_file(conn, house, path, chunk_rows, restart, incremental)
+            return {
+                'house_id': house,
+                'path': path,
+                'rows': stats['rows'],
+                'method': 'incremental' if incremental else 'stream',
+                'seconds': time.perf_counter() - started,
+                'worker': os.getpid(),
+            }
+        df = load_data(path, house)[table_columns]
+        method = 'insert'
+        if df.empty:
+            rows = 0
+        else:
+            rows = None
+            if use_bulk_load:
+                try:
+                    rows = bulk_load(conn, df, table_name)
+                    method = 'load_data'
+                except Error as e:
+                    if e.errno not in LOCAL_INFILE_DISABLED:
+                        raise
+                    print(f"LOAD DATA LOCAL INFILE refused for house {house} ({e}), falling back to batched inserts.")
+            if rows is None:
+                rows = insert_rows(conn, df, table_name)
+            conn.commit()
+            after_load(conn, house, df['date_time'].min().to_pydatetime(), df['date_time'].max().to_pydatetime())
+        return {
+            'house_id': house,
+            'path': path,
+            'rows': rows,
+            'method': method,
+            'seconds': time.perf_counter() - started,
+            'worker': os.getpid(),
+        }
+
+def ingest_all(root, workers=SEED_WORKERS, use_bulk_load=True, stream=False, incremental=False,
+               chunk_rows=ingest.INGEST_CHUNK_ROWS, restart=False):
+    """
+    Loads every house_*.csv under root with a process pool, registering
+    unknown houses first. Prints rows/sec per file, per worker and overall.
+    Returns False if any file failed.
+    """
+    files = discover_house_files(root)
+    if not files:
+        print(f"No house_*.csv files found under '{root}'.")
+        return True
+
+    conn = connect()
+    try:
+        added = register_houses(conn, [h for h, _ in files])
+    finally:
+        conn.close()
+    print(f"Found {len(files)} house files, registered {len(added)} new houses. Loading with {workers} workers.")
+
+    started = time.perf_counter()
+    per_worker = {}
+    total_rows = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ingest_house_file, h, path, use_bulk_load=use_bulk_load, stream=stream, incremental=incremental,
+                               chunk_rows=chunk_rows, restart=restart): (h, path) for h, path in files}
+        for future in as_completed(futures):
+            house, path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"House {house} ({path}) failed: {e}")
+                continue
+            total_rows += result['rows']
+            stats = per_worker.setdefault(result['worker'], {'files': 0, 'rows': 0, 'seconds': 0.0})
+            stats['files'] += 1
+            stats['rows'] += result['rows']
+            stats['seconds'] += result['seconds']
+            print(f"House {house}: {result['rows']} rows via {result['method']} in {result['seconds']:.1f}s "
+                  f"({result['rows'] / max(result['seconds'], 1e-9):,.0f} rows/s).")
+
+    elapsed = time.perf_counter() - started
+    for worker, stats in sorted(per_worker.items()):
+        print(f"Worker {worker}: {stats['files']} files, {stats['rows']} rows, "
+              f"{stats['rows'] / max(stats['seconds'], 1e-9):,.0f} rows/s.")
+    print(f"Loaded {total_rows} rows from {len(files) - failed} files in {elapsed:.1f}s "
+          f"({total_rows / max(elapsed, 1e-9):,.0f} rows/s overall), {failed} failed.")
+    return failed == 0
+
 def load_csv_data_to_mysql(conn, table_name):
     """
     Loads data from the CSV file into the specified MySQL table.
@@ -77,61 +305,78 @@ def load_csv_data_to_mysql(conn, table_name):
             print(f"CSV file '{file_path}' is empty. No data to load.")
             return 0
 
-        cursor = conn.cursor()
-
-                # Prepare the SQL INSERT statement
-        # Ensure the order of columns in the INSERT statement matches your DataFrame columns
-        # The list of columns from your table definition
-        table_columns = [
-            'date_time', 'house_id', 'bathroom1', 'bedroom1', 'bedroom2',
-            'clotheswasher1', 'livingroom1', 'dishwasher1', 'garage1', 'kitchen1',
-            'kitchenapp1', 'kitchenapp2', 'lights_plugs1', 'lights_plugs2',
-            'lights_plugs3', 'microwave1', 'office1', 'range1', 'refrigerator1',
-            'venthood1', 'oven1', 'total_energy', 'Weekday', 'Month', 'Hour',
-            'Hour_sin', 'Hour_cos', 'DoW_sin', 'DoW_cos',
-            'bathroom1_present', 'bedroom1_present', 'bedroom2_present',
-            'clotheswasher1_present', 'livingroom1_present', 'dishwasher1_present',
-            'garage1_present', 'kitchen1_present', 'kitchenapp1_present',
-            'kitchenapp2_present', 'lights_plugs1_present', 'lights_plugs2_present',
-            'lights_plugs3_present', 'microwave1_present', 'office1_present',
-            'range1_present', 'refrigerator1_present', 'venthood1_present',
-            'oven1_present'
-        ]
-
         # Make sure the DataFrame columns are in the same order as your table columns
         df = df[table_columns]
 
-        # Create a placeholder string for the SQL query
-        placeholders = ', '.join(['%s'] * len(table_columns))
-        insert_query = f"INSERT INTO {table_name} ({', '.join(table_columns)}) VALUES ({placeholders})"
-
-        # Convert DataFrame to a list of tuples for batch insertion
-        data_to_insert = [tuple(row) for row in df.itertuples(index=False)]
-
         # Execute the bulk insert
-        cursor.executemany(insert_query, data_to_insert)
+        inserted = insert_rows(conn, df, table_name)
         conn.commit()
-        print(f"Successfully inserted {cursor.rowcount} rows into the table.")
+        print(f"Successfully inserted {inserted} rows into the table.")
+
+        # Backfill the hourly/daily/monthly rollups for the loaded range and drop cached API results covering it
+        dropped = after_load(conn, house_id, df['date_time'].min().to_pydatetime(), df['date_time'].max().to_pydatetime())
+        print(f"Rollup tables refreshed for house {house_id}.")
+        print(f"Invalidated {dropped} cached query results for house {house_id}.")
 
     except Error as e:
         print(f"Error while connecting to MySQL or inserting data: {e}")
     finally:
         if 'conn' in locals() and conn.is_connected():
-            cursor.close()
             conn.close()
             print("MySQL connection closed.")
-    
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load house meter CSV files into houses_consumption.")
+    parser.add_argument('--all', action='store_true',
+                        help="load every house_*.csv under CSV_FILE_PATH in parallel, registering missing houses")
+    parser.add_argument('--workers', type=int, default=SEED_WORKERS, help="worker processes for --all")
+    parser.add_argument('--no-bulk-load', action='store_true',
+                        help="use batched INSERTs instead of LOAD DATA LOCAL INFILE")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the files in chunks with bounded memory, resuming from the last checkpoint")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only upsert the readings newer than each house's watermark (minus INGEST_LOOKBACK_HOURS)")
+    parser.add_argument('--file', help="with --stream/--incremental, the house file to load (default: house_3538.csv)")
+    parser.add_argument('--house', type=int, help="with --stream/--incremental, the house id of --file (default: from its name)")
+    parser.add_argument('--chunk-rows', type=int, default=ingest.INGEST_CHUNK_ROWS, help="rows per chunk with --stream/--incremental")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the checkpoint (--stream) or the watermark (--incremental) and load the whole file")
+    args = parser.parse_args()
+
+    if args.all:
+        try:
+            if not ingest_all(CSV_FILE_PATH or '.', args.workers, use_bulk_load=not args.no_bulk_load, stream=args.stream,
+                              incremental=args.incremental, chunk_rows=args.chunk_rows, restart=args.restart):
+                exit(1)
+        except Error as e:
+            print(f"Error connecting to MySQL: {e}")
+            exit(1)
+        exit(0)
+
+    if args.stream or args.incremental:
+        path = args.file or file_path
+        match = HOUSE_FILE_PATTERN.search(os.path.basename(path))
+        house = args.house if args.house is not None else (int(match.group(1)) if match else house_id)
+        conn = None
+        try:
+            conn = connect()
+            stats = stream_house_file(conn, house, path, args.chunk_rows, args.restart, args.incremental)
+            print(f"Loaded {stats['rows']} rows for house {house} in {stats['elapsed']:.1f}s "
+                  f"({stats['rows_per_sec']:,.0f} rows/s, parse {stats['parse_seconds']:.1f}s, "
+                  f"write {stats['write_seconds']:.1f}s).")
+        except Error as e:
+            print(f"Error while loading {path}: {e}. Run again to resume from the last checkpoint/watermark.")
+            exit(1)
+        finally:
+            if conn and conn.is_connected():
+                conn.close()
+        exit(0)
+
+    conn = None
     try:
         # Connect to MySQL database
-        conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            port=DB_PORT
-        )
+        conn = connect()
 
         if conn.is_connected():
             print(f"Connected to MySQL database '{DB_NAME}' at {DB_HOST}:{DB_PORT} as user '{DB_USER}'.")
@@ -144,4 +389,4 @@ if __name__ == "__main__":
     finally:
         if conn and conn.is_connected():
             conn.close()
-            print("MySQL connection closed.")
\ No newline at end of file
+            print("MySQL connection closed.")
@@ -1,16 +1,25 @@
-from flask import Flask, jsonify, request, Response, send_file
-from flask_mysqldb import MySQL
+from flask import Flask, jsonify, request, Response, stream_with_context, g, make_response
 from flask_cors import CORS
-import pandas as pd
 import jwt
 import os
-import io
-import csv
+import json
 from dotenv import load_dotenv
 from datetime import datetime,timedelta
-from decimal import Decimal
-from datetime import date
+from functools import wraps
 import report
+from report_jobs import ReportStore, ReportJobQueue, QueueFull
+import db
+import downsample
+import rollups
+import columnar
+import exports
+import http_cache
+import ingest
+import live_ingest
+import forecast
+import weather
+from query_cache import QueryCache
+from auth import TokenVerifier
 
 
 load_dotenv()
@@ -25,6 +34,32 @@ SECRET_KEY = os.getenv('SECRET_KEY', 'your_secret_key')  # Replace with your sec
 # yyyymmdd hh:mm:ss format
 # Default date for testing purposes
 DATE_TODAY = datetime(2025,6,1,12,0,0) #'2025-06-01 12:00:00'  # Example date, adjust as needed
+BILLS_START = datetime(1970,1,1,0,0,0) # month-aligned lower bound so /api/bills covers the whole history
+
+# 15-minute readings of one house between two datetimes (/api/consumption/today)
+TODAY_READINGS_QUERY = """SELECT 
+            date_time,
+            house_id,
+            bathroom1,
+            bedroom1 ,
+            bedroom2 ,
+            clotheswasher1 ,
+            livingroom1 ,
+            dishwasher1 ,
+            garage1 ,
+            kitchen1 ,
+            kitchenapp1 ,
+            kitchenapp2 ,
+            lights_plugs1 ,
+            lights_plugs2 ,
+            lights_plugs3 ,
+            microwave1 ,
+            office1 ,
+            range1 ,
+            refrigerator1 ,
+            venthood1 ,
+            oven1,
+            total_energy FROM houses_consumption WHERE house_id = %s AND date_time BETWEEN %s AND %s"""
 
 #SELECT date_time, house_id, total_energy
 #FROM houses_consumption
@@ -36,30 +71,392 @@ app.config['SECRET_KEY'] = SECRET_KEY
 CORS(app,expose_headers=["Content-Disposition"],supports_credentials=True) # This will enable CORS for all routes
 
 # --- MySQL Configuration ---
-# Replace with your actual MySQL connection details
-app.config['MYSQL_HOST'] = DB_HOST
-app.config['MYSQL_USER'] = DB_USER
-app.config['MYSQL_PASSWORD'] = DB_PASSWORD
-app.config['MYSQL_DB'] = DB_NAME
-app.config['MYSQL_CURSORCLASS'] = 'DictCursor' # Returns results as dictionaries
-
-mysql = MySQL(app)
+# Connections come from a pool shared by all routes and the background writers (see db.py)
+db_pool = db.ConnectionPool(lambda: db.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD,
+                                               database=DB_NAME, port=DB_PORT))
+db_pool.fill()
+query_cache = QueryCache.from_env()
+token_verifier = TokenVerifier(app.config['SECRET_KEY'])
+
+# Load the weather file once at startup, the store reloads itself when the file changes
+weather_store = weather.get_store()
+try:
+    weather_store.ensure_loaded()
+except Exception as e:
+    print(f"Weather data not loaded at startup: {e}")
 
 # --- Helper Function to Execute Queries ---
-def execute_query(query, args=None, fetchone=False, commit=False):
+def get_connection():
+    """
+    The pooled connection of the current app context, borrowed on first use
+    and handed back by release_connection when the context ends.
     """
-    Executes a SQL query and returns the result.
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_connection(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+def execute_query(query, args=None, fetchone=False, commit=False, prepared=False):
     """
-    cur = mysql.connection.cursor()
+    Executes a SQL query and returns the result as dicts.
+    `prepared` runs it as a cached server-side prepared statement (hot read queries).
+    """
+    conn = get_connection()
+    if prepared:
+        return db_pool.execute_prepared(conn, query, args, fetchone)
+    cur = conn.cursor(dictionary=True, buffered=True)
     cur.execute(query, args)
     if commit:
-        mysql.connection.commit()
+        conn.commit()
         cur.close()
         return None # Or return lastrowid, rowcount etc. if needed
     result = cur.fetchone() if fetchone else cur.fetchall()
     cur.close()
     return result
 
+def house_ids_for_user(user_id):
+    """
+    Ids of the houses owned by user_id, lowest first.
+    """
+    rows = execute_query("SELECT id FROM houses WHERE user_id = %s ORDER BY id", (user_id,), fetchone=False, prepared=True)
+    return [row['id'] for row in rows]
+
+def require_auth(house=True):
+    """
+    Verifies the Bearer token once and exposes its context on flask.g:
+    g.user_id, g.claims and, when `house` is set, g.house_id (the user's first house).
+    Tokens issued before house ids were part of the claims are looked up once
+    and their enriched claims cached for the rest of their lifetime.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            auth_header = request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith("Bearer "):
+                return jsonify({'error': 'Missing token'}), 401
+
+            token = auth_header.split(" ")[1]
+            try:
+                claims = token_verifier.verify(token)
+                user_id = claims['id']
+            except jwt.ExpiredSignatureError:
+                return jsonify({'error': 'Token expired'}), 401
+            except (jwt.InvalidTokenError, KeyError):
+                return jsonify({'error': 'Invalid token'}), 401
+
+            g.user_id = user_id
+            g.claims = claims
+            if house:
+                house_ids = claims.get('house_ids')
+                if house_ids is None:
+                    try:
+                        house_ids = house_ids_for_user(user_id)
+                    except Exception as e:
+                        return jsonify({'error': str(e)}), 500
+                    claims = dict(claims, house_ids=house_ids)
+                    token_verifier.remember(token, claims)
+                    g.claims = claims
+                if not house_ids:
+                    return jsonify({'error': 'No house registered for this user'}), 404
+                g.house_id = house_ids[0]
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class InvalidRange(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def range_bounds(start, end, preset='N/A'):
+    """
+    (start, end) of /api/consumption/<start>/<end>: `preset` days back from
+    DATE_TODAY when it is a number, otherwise the YYYY-MM-DD dates, with the
+    end clamped to the end of its day or to DATE_TODAY.
+    Raises InvalidRange with the HTTP status to answer.
+    """
+    format_string = "%Y-%m-%d"
+    if preset != 'N/A' and preset.isdigit():
+        parsed_startdate = DATE_TODAY - timedelta(days=int(preset))
+        parsed_startdate = datetime(parsed_startdate.year, parsed_startdate.month, parsed_startdate.day, 0, 0, 0)
+        return parsed_startdate, DATE_TODAY
+
+    try:
+        # strptime by default creates a datetime object with time components set to 00:00:00
+        parsed_startdate = datetime.strptime(start, format_string)
+        parsed_enddate = datetime.strptime(end, format_string)
+    except ValueError as e:
+        print(f"Error parsing date string '{start}': {e}")
+        print(f"Ensure the string exactly matches the format '{format_string}'.")
+        raise InvalidRange(f"Ensure the string exactly matches the format '{format_string}'.", 500)
+
+    print(f"Parsed datetime object: {parsed_startdate}")
+    print(f"Parsed datetime object: {parsed_enddate}")
+
+    startDate = parsed_startdate.date()
+    endDate = parsed_enddate.date()
+
+    if startDate > endDate:
+        raise InvalidRange('Start date cannot be after end date.')
+    if startDate > DATE_TODAY.date():
+        raise InvalidRange('Start date cannot be in the future.')
+    if endDate > DATE_TODAY.date():
+        raise InvalidRange('End date cannot be in the future.')
+    if startDate == endDate:
+        parsed_enddate = datetime(endDate.year, endDate.month, endDate.day, 23, 59, 59)
+    if endDate == DATE_TODAY.date():
+        parsed_enddate = DATE_TODAY
+    return parsed_startdate, parsed_enddate
+
+def quarter_bounds(quarter, year):
+    """
+    (start, end) of a calendar quarter, the end clamped to DATE_TODAY.
+    Raises InvalidRange for an unknown quarter or one that has not started.
+    """
+    if quarter == 1:
+        start = datetime(year,1,1,0,0,0)
+        end = datetime(year,3,31,23,59,59)
+    elif quarter == 2:
+        start = datetime(year,4,1,0,0,0)
+        end = datetime(year,6,30,23,59,59)
+    elif quarter == 3:
+        start = datetime(year,7,1,0,0,0)
+        end = datetime(year,9,30,23,59,59)
+    elif quarter == 4:
+        start = datetime(year,10,1,0,0,0)
+        end = datetime(year,12,31,23,59,59)
+    else:
+        raise InvalidRange('Invalid quarter.')
+
+    if start > DATE_TODAY:
+        raise InvalidRange('no available data yet')
+    if end > DATE_TODAY:
+        end = DATE_TODAY
+    return start, end
+
+def cached_query(endpoint, house_id, start, end, query, args=None):
+    """
+    execute_query behind the query cache, keyed by house, endpoint and date range.
+    Closed ranges (ending before DATE_TODAY) are kept much longer than open ones.
+    """
+    return query_cache.get_or_compute(
+        house_id, endpoint, start, end, DATE_TODAY,
+        lambda: execute_query(query, args, fetchone=False, prepared=True))
+
+def series_rows(endpoint, house_id, start, end, resolution, max_points, method):
+    """
+    Chart rows at a resolution (see downsample.py), cached per resolution and
+    downsampled to max_points after the cache.
+    """
+    rows = cached_query(f"{endpoint}:{resolution}", house_id, start, end,
+                        *downsample.series_query(house_id, start, end, resolution))
+    return downsample.finish(rows, resolution, max_points, method)
+
+def accepts_layout(view):
+    """
+    Validates ?layout=rows|columnar (default rows) before the view runs.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            columnar.check_layout(request.args.get('layout', 'rows'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return view(*args, **kwargs)
+    return wrapper
+
+def rows_response(rows, time_column, **extra):
+    """
+    jsonify(rows), or with ?layout=columnar one array per column (see columnar.py).
+    """
+    if request.args.get('layout', 'rows') == 'columnar':
+        return Response(columnar.dumps(columnar.to_columnar(rows, time_column, **extra)), mimetype='application/json'), 200
+    return jsonify(rows), 200
+
+def conditional_response(endpoint, house_id, start, end, build):
+    """
+    Adds an ETag (house, endpoint, range, query parameters and the house's data
+    version) and Cache-Control to the response of build(). A request already
+    holding that ETag gets a 304 and build() - hence MySQL - never runs.
+    Without a shared query cache the version misses other processes' ingests,
+    so the response is only marked uncached.
+    """
+    if not query_cache.shared:
+        response = make_response(build())
+        if response.status_code == 200:
+            response.headers['Cache-Control'] = http_cache.UNCACHED
+        return response
+    tag = http_cache.etag(house_id, endpoint, start, end, query_cache.version(house_id),
+                          http_cache.variant(request.args.items(multi=True)))
+    headers = http_cache.cache_headers(tag, end, DATE_TODAY)
+    if http_cache.if_none_match(request.headers.get('If-None-Match'), tag):
+        return Response(status=304, headers=headers)
+    response = make_response(build())
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """
+    gzip/brotli for JSON and text bodies above COMPRESS_MIN_BYTES; streamed bodies pass through.
+    """
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+        return response
+    body = response.get_data()
+    if not http_cache.should_compress(response.mimetype, body, response.headers.get('Content-Encoding')):
+        return response
+    encoding = http_cache.pick_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    response.set_data(http_cache.compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def export_response(query, args, filename):
+    """
+    Streams the rows of `query` as a download, read from an unbuffered cursor
+    so memory stays flat however long the range is.
+    ?format=csv|parquet|arrow (default csv) picks the file type and ?gzip=1
+    compresses a CSV stream.
+    """
+    fmt = request.args.get('format', 'csv')
+    compress = fmt == 'csv' and request.args.get('gzip') in ('1', 'true')
+    exports.check_format(fmt)
+
+    cur = get_connection().cursor()
+    cur.execute(query, args)
+    size = exports.fetch_size(fmt)
+    first_batch = cur.fetchmany(size)
+    if not first_batch:
+        cur.close()
+        return jsonify({"message": "No data found for the specified date range."}), 404
+    header = [desc[0] for desc in cur.description]
+
+    def generate():
+        try:
+            yield from exports.stream_export(fmt, header, exports.iter_batches(cur, first_batch, size), compress=compress)
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass # rows left unread by an aborted download; the pool drops the connection on release
+
+    mimetype, extension = exports.FORMATS[fmt]
+    if compress:
+        mimetype, extension = "application/gzip", "csv.gz"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment;filename={filename}.{extension}",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+def consumption_export_response(house_id, start, end, filename):
+    """
+    Consumption download between start and end; ?resolution=15min|hourly|daily
+    (default daily) picks the row granularity.
+    """
+    resolution = request.args.get('resolution', 'daily')
+    return export_response(*exports.export_query(house_id, start, end, resolution), filename)
+
+def load_forecast_rows(house_id, since, until):
+    """
+    Training rows for the forecast engine, only those newer than the model's watermark.
+    """
+    return execute_query(f"""
+        SELECT {', '.join(forecast.TRAINING_COLUMNS)}
+        FROM houses_consumption
+        WHERE house_id = %s AND date_time > %s AND date_time <= %s
+        ORDER BY date_time ASC""",
+        (house_id, since, until), fetchone=False, prepared=True)
+
+forecast_engine = forecast.ForecastEngine(load_forecast_rows, version=query_cache.version)
+
+def fetch_report_rows(query, args):
+    """
+    Report context query on its own short-lived pooled connection, so no
+    connection stays borrowed while the model generates.
+    """
+    with db_pool.connection() as conn:
+        return db_pool.execute_prepared(conn, query, args)
+
+def generate_report_in_app(house_id, day):
+    """
+    Report generation entry point for the background workers, yields the model
+    tokens so streaming clients can follow the job.
+    """
+    yield from report.stream_report(house_id, day, fetch_report_rows)
+
+def write_live_readings(rows):
+    """
+    Flush callback of the live readings writer: one multi-row upsert merging
+    partial readings into the stored slots, then the rollups and watermark of
+    every house in the batch, in one transaction.
+    """
+    ranges = {}
+    for row in rows:
+        first, last = ranges.get(row[1], (row[0], row[0]))
+        ranges[row[1]] = (min(first, row[0]), max(last, row[0]))
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            ingest.write_readings(cur, rows, merge=True)
+            for house_id, (first, last) in ranges.items():
+                rollups.refresh_rollups(cur, house_id, first, last)
+                ingest.set_watermark(cur, house_id, last)
+            conn.commit()
+        finally:
+            cur.close()
+    for house_id, (first, last) in ranges.items():
+        query_cache.invalidate(house_id, first, last)
+        forecast_engine.mark_stale(house_id)
+
+readings_writer = live_ingest.ReadingWriter(write_live_readings)
+
+report_store = ReportStore()
+# Today's readings are still arriving, so its reports are regenerated instead of stored
+report_jobs = ReportJobQueue(report_store, generate_report_in_app, is_open=lambda day: day >= DATE_TODAY.date())
+REPORT_MAX_WAIT = 30 # seconds a status request may long-poll
+
+def sse_event(data, event=None):
+    """
+    Formats one Server-Sent Event; data is JSON-encoded so tokens can carry newlines.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+def report_event_stream(house_id, day, job):
+    """
+    Streams the report of (house_id, day) as SSE while `job` generates it: a
+    'queued' event if it waits for a worker, one unnamed event per model token
+    (from the first, whoever started the job), then a 'done' event. A job that
+    found the report already stored sends it as one 'report' event.
+    """
+    if job.status == 'queued':
+        yield sse_event(job.as_dict(), 'queued')
+    streamed = False
+    for token in job.follow():
+        if token is None:
+            yield ": keep-alive\n\n"
+            continue
+        streamed = True
+        yield sse_event(token)
+    if job.status != 'done':
+        yield sse_event({'error': job.error or 'Report generation failed'}, 'error')
+        return
+    if not streamed:
+        yield sse_event(job.text, 'report')
+    yield sse_event({'status': 'done'}, 'done')
+
 # --- Routes 
 
 @app.route('/login', methods=['POST'])
@@ -82,10 +479,13 @@ def login():
             print(f"Invalid password for user: {username}")
             return jsonify({'error': 'Invalid credentials.'}), 401
         
+        # House ids travel in the claims so protected routes need no houses lookup
+        house_ids = house_ids_for_user(id)
         token = jwt.encode({
             'username': username,
             'id': id,
             'address': address,
+            'house_ids': house_ids,
             'exp': datetime.now() + timedelta(hours=1)
         }, app.config['SECRET_KEY'], algorithm='HS256')
         print(f"user logged in {username}: {token}")
@@ -95,165 +495,59 @@ def login():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/consumption/today', methods=['GET'])
+@require_auth()
+@accepts_layout
 def get_today_data():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
     startDate = datetime(DATE_TODAY.year, DATE_TODAY.month, DATE_TODAY.day, 0, 0, 0)
     try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        items = execute_query(f"""SELECT 
-            date_time,
-            house_id,
-            bathroom1,
-            bedroom1 ,
-            bedroom2 ,
-            clotheswasher1 ,
-            livingroom1 ,
-            dishwasher1 ,
-            garage1 ,
-            kitchen1 ,
-            kitchenapp1 ,
-            kitchenapp2 ,
-            lights_plugs1 ,
-            lights_plugs2 ,
-            lights_plugs3 ,
-            microwave1 ,
-            office1 ,
-            range1 ,
-            refrigerator1 ,
-            venthood1 ,
-            oven1,
-            total_energy FROM houses_consumption WHERE house_id = %s AND date_time BETWEEN %s AND %s""",
-            (house['id'],startDate, DATE_TODAY), fetchone=False)
-        return jsonify(items), 200
+        max_points, method = downsample.downsample_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        items = execute_query(TODAY_READINGS_QUERY,
+            (g.house_id,startDate, DATE_TODAY), fetchone=False, prepared=True)
+        items = downsample.downsample(items, max_points, method, 'date_time', 'total_energy')
+        return rows_response(items, 'date_time', exclude=('house_id',), house_id=g.house_id)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/consumption/lastweek', methods=['GET'])
+@require_auth()
+@accepts_layout
 def get_weekly_totals():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
     startDate = DATE_TODAY - timedelta(days=7)
     startDate = datetime(startDate.year, startDate.month, startDate.day, 0, 0, 0)
     try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        items = execute_query("""
-            SELECT 
-                DATE(date_time) as day,
-                SUM(bathroom1) as bathroom1,
-                SUM(bedroom1) as bedroom1,
-                SUM(bedroom2) as bedroom2,
-                SUM(livingroom1) as livingroom1,
-                SUM(garage1) as garage1,
-                SUM(kitchen1) as kitchen1,
-                SUM(office1) as office1,
-                SUM(range1) as range1,
-                SUM(venthood1) as venthood1,
-                SUM(total_energy) as total_consumption
-            FROM houses_consumption
-            WHERE house_id = %s AND date_time BETWEEN %s AND %s
-            GROUP BY day
-            ORDER BY day ASC
-        """, (house['id'],startDate, DATE_TODAY), fetchone=False)
-        return jsonify(items), 200
+        resolution, max_points, method = downsample.series_params(request.args, 'daily', startDate, DATE_TODAY)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        items = execute_query(*downsample.series_query(g.house_id, startDate, DATE_TODAY, resolution), fetchone=False, prepared=True)
+        items = downsample.finish(items, resolution, max_points, method)
+        return rows_response(items, downsample.time_column(resolution))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/consumption/<string:start>/<string:end>', methods=['GET'])
+@require_auth()
+@accepts_layout
 def get_range_total(start, end):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
     #startDate = datetime(DATE_TODAY.year, DATE_TODAY.month, DATE_TODAY.day, 0, 0, 0)
     query = request.args.get('preset', 'N/A')
     print(f"Query preset: {query}")
-    format_string = "%Y-%m-%d"
 
     try:
-        if query != 'N/A' and query.isdigit():
-            parsed_startdate = DATE_TODAY - timedelta(days=int(query))
-            parsed_startdate = datetime(parsed_startdate.year, parsed_startdate.month, parsed_startdate.day, 0, 0, 0)
-            parsed_enddate = DATE_TODAY
-        else:
-            # strptime by default creates a datetime object with time components set to 00:00:00
-            parsed_startdate = datetime.strptime(start, format_string)
-            parsed_enddate = datetime.strptime(end, format_string)
-            
-            print(f"Parsed datetime object: {parsed_startdate}")
-            print(f"Parsed datetime object: {parsed_enddate}")
-
-            startDate = parsed_startdate.date()
-            endDate = parsed_enddate.date()
-
-            if startDate > endDate:
-                return jsonify({'error': 'Start date cannot be after end date.'}), 400
-            if startDate > DATE_TODAY.date():
-                return jsonify({'error': 'Start date cannot be in the future.'}), 400
-            if endDate > DATE_TODAY.date():
-                return jsonify({'error': 'End date cannot be in the future.'}), 400
-            if startDate == endDate:
-                parsed_enddate = datetime(endDate.year, endDate.month, endDate.day, 23, 59, 59)
-            if endDate == DATE_TODAY.date():
-                parsed_enddate = DATE_TODAY
-
+        parsed_startdate, parsed_enddate = range_bounds(start, end, query)
+        resolution, max_points, method = downsample.series_params(request.args, 'daily', parsed_startdate, parsed_enddate)
+    except InvalidRange as e:
+        return jsonify({'error': str(e)}), e.status
     except ValueError as e:
-        print(f"Error parsing date string '{start}': {e}")
-        print(f"Ensure the string exactly matches the format '{format_string}'.")
-        return jsonify({'error': f"Ensure the string exactly matches the format '{format_string}'."}), 500
+        return jsonify({'error': str(e)}), 400
     try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        items = execute_query(f"""
-            SELECT 
-                DATE(date_time) as day,
-                SUM(bathroom1) as bathroom1,
-                SUM(bedroom1) as bedroom1,
-                SUM(bedroom2) as bedroom2,
-                SUM(livingroom1) as livingroom1,
-                SUM(garage1) as garage1,
-                SUM(kitchen1) as kitchen1,
-                SUM(office1) as office1,
-                SUM(range1) as range1,
-                SUM(venthood1) as venthood1,
-                SUM(total_energy) as total_consumption
-            FROM houses_consumption
-            WHERE house_id = %s AND date_time BETWEEN %s AND %s
-            GROUP BY day
-            ORDER BY day ASC""",
-            (house['id'],parsed_startdate, parsed_enddate), fetchone=False)
-        return jsonify(items), 200
+        return conditional_response('range', g.house_id, parsed_startdate, parsed_enddate, lambda: rows_response(
+            series_rows('range', g.house_id, parsed_startdate, parsed_enddate, resolution, max_points, method),
+            downsample.time_column(resolution)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -268,358 +562,110 @@ def get_temp_data(preset):
         return jsonify({'error': 'invalid preset'}), 400
     
     try:
-        weather_df = pd.read_csv('../data/weather_data.csv')
-        # Parse datetime column
-        weather_df['local_15min'] = pd.to_datetime(weather_df['local_15min'])
-        filtered_df = weather_df[
-            (weather_df['local_15min'] >= parsed_startdate) & 
-            (weather_df['local_15min'] <= parsed_enddate)
-        ]
-        # Group by day and calculate average temperature
-        daily_avg_df = filtered_df.copy()
-        daily_avg_df['date'] = daily_avg_df['local_15min'].dt.date
-
-        # Group by date and calculate mean temperature
-        grouped = daily_avg_df.groupby('date')['temp'].mean().reset_index()
-
-        # Optional: Rename columns
-        grouped.columns = ['date', 'avg_temp']
-
-        # Convert to list of dicts
-        result = grouped.to_dict(orient='records')
-
+        # Daily averages are precomputed by the weather store, this is a range lookup
+        result = weather_store.daily_avg_temp(parsed_startdate, parsed_enddate)
         return jsonify(result), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/consumption/download/<string:start>/<string:end>', methods=['GET'])
+@require_auth()
 def download_consumption_data(start, end):
 
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
 
-    token = auth_header.split(" ")[1]
     try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
+        parsed_startdate, parsed_enddate = range_bounds(start, end)
+    except InvalidRange as e:
+        return jsonify({'error': str(e)}), e.status
+    try:
+        return conditional_response('download', g.house_id, parsed_startdate, parsed_enddate,
+            lambda: consumption_export_response(g.house_id, parsed_startdate, parsed_enddate, "consumption_data"))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/consumption/download/raw/<string:start>/<string:end>', methods=['GET'])
+@require_auth()
+def download_raw_readings(start, end):
+    """
+    Every stored circuit reading between start and end (whole days, inclusive),
+    in the format given by ?format=csv|parquet|arrow.
+    """
     format_string = "%Y-%m-%d"
     try:
-        
-        # strptime by default creates a datetime object with time components set to 00:00:00
         parsed_startdate = datetime.strptime(start, format_string)
-        parsed_enddate = datetime.strptime(end, format_string)
-        
-        print(f"Parsed datetime object: {parsed_startdate}")
-        print(f"Parsed datetime object: {parsed_enddate}")
-
-        startDate = parsed_startdate.date()
-        endDate = parsed_enddate.date()
-
-        if startDate > endDate:
-            return jsonify({'error': 'Start date cannot be after end date.'}), 400
-        if startDate > DATE_TODAY.date():
-            return jsonify({'error': 'Start date cannot be in the future.'}), 400
-        if endDate > DATE_TODAY.date():
-            return jsonify({'error': 'End date cannot be in the future.'}), 400
-        if startDate == endDate:
-            parsed_enddate = datetime(endDate.year, endDate.month, endDate.day, 23, 59, 59)
-        if endDate == DATE_TODAY.date():
-            parsed_enddate = DATE_TODAY
+        parsed_enddate = datetime.strptime(end, format_string).replace(hour=23, minute=59, second=59)
+    except ValueError:
+        return jsonify({'error': f"Ensure the string exactly matches the format '{format_string}'."}), 400
+    if parsed_startdate > parsed_enddate:
+        return jsonify({'error': 'Start date cannot be after end date.'}), 400
+    if parsed_startdate > DATE_TODAY:
+        return jsonify({'error': 'Start date cannot be in the future.'}), 400
+    parsed_enddate = min(parsed_enddate, DATE_TODAY)
 
-    except ValueError as e:
-        print(f"Error parsing date string '{start}': {e}")
-        print(f"Ensure the string exactly matches the format '{format_string}'.")
-        return jsonify({'error': f"Ensure the string exactly matches the format '{format_string}'."}), 500
     try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        query = f"""
-            SELECT 
-                DATE(date_time) as day,
-                SUM(bathroom1) as bathroom1,
-                SUM(bedroom1) as bedroom1,
-                SUM(bedroom2) as bedroom2,
-                SUM(livingroom1) as livingroom1,
-                SUM(garage1) as garage1,
-                SUM(kitchen1) as kitchen1,
-                SUM(office1) as office1,
-                SUM(range1) as range1,
-                SUM(venthood1) as venthood1,
-                SUM(total_energy) as total_consumption
-            FROM houses_consumption
-            WHERE house_id = %s AND date_time BETWEEN %s AND %s
-            GROUP BY day
-            ORDER BY day ASC"""
-        cur = mysql.connection.cursor()
-        cur.execute(query, (house['id'],parsed_startdate, parsed_enddate))
-        result = cur.fetchall()
-        # Get column names for dictionary formatting
-        columns = [desc[0] for desc in cur.description]
-        cur.close()
-        print("Raw DB result:", result)
-        print("Columns:", columns)
-        # Format as a list of dictionaries if not fetchone
-        
-        items = []
-
-        for row in result:
-            item = {key: str(value) if isinstance(value, Decimal) else value for key, value in row.items()}
-            
-            #if isinstance(item['day'], date):  # You can also import datetime.date to check this
-               # item['day'] = item['day'].strftime('%Y-%m-%d')
-            
-            items.append(item)
-        if not items:
-            return jsonify({"message": "No data found for the specified date range."}), 404
-
-        # Create a CSV in memory
-        print(items)
-        output = io.StringIO()
-        fieldnames = [
-            "day", "bathroom1", "bedroom1", "bedroom2", "livingroom1",
-            "garage1", "kitchen1", "office1", "range1", "venthood1", "total_consumption"
-        ]
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for item in items:
-            # Format the 'day' field to a more standard date format if needed
-            #if isinstance(item['day'], datetime):
-             #   item['day'] = item['day'].strftime('%Y-%m-%d')
-            writer.writerow(item)
-
-        output.seek(0) # Go to the beginning of the stream
-
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={
-                "Content-Disposition": "attachment;filename=consumption_data.csv"
-            }
-        )
-
+        return conditional_response('download_raw', g.house_id, parsed_startdate, parsed_enddate,
+            lambda: export_response(*exports.raw_readings_query(g.house_id, parsed_startdate, parsed_enddate), "raw_readings"))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/consumption/quarter/<int:quarter>/<int:year>', methods=['GET'])
+@require_auth()
+@accepts_layout
 def get_quarter_data(quarter, year):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
 
-    token = auth_header.split(" ")[1]
     try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
-
-    if quarter == 1:
-        start = datetime(year,1,1,0,0,0)
-        end = datetime(year,3,31,23,59,59)
-    elif quarter == 2:
-        start = datetime(year,4,1,0,0,0)
-        end = datetime(year,6,30,23,59,59)
-    elif quarter == 3:
-        start = datetime(year,7,1,0,0,0)
-        end = datetime(year,9,30,23,59,59)
-    elif quarter == 4:
-        start = datetime(year,10,1,0,0,0)
-        end = datetime(year,12,31,23,59,59)
-    else:
-        return jsonify({'error': 'Invalid quarter.'}), 400
-    
-    if start > DATE_TODAY:
-        return jsonify({'error': 'no available data yet'}), 400
-    if end > DATE_TODAY:
-        end = DATE_TODAY
+        start, end = quarter_bounds(quarter, year)
+        resolution, max_points, method = downsample.series_params(request.args, 'daily', start, end)
+    except InvalidRange as e:
+        return jsonify({'error': str(e)}), e.status
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        items = execute_query(f"""
-            SELECT 
-                DATE(date_time) as day,
-                SUM(bathroom1) as bathroom1,
-                SUM(bedroom1) as bedroom1,
-                SUM(bedroom2) as bedroom2,
-                SUM(livingroom1) as livingroom1,
-                SUM(garage1) as garage1,
-                SUM(kitchen1) as kitchen1,
-                SUM(office1) as office1,
-                SUM(range1) as range1,
-                SUM(venthood1) as venthood1,
-                SUM(total_energy) as total_consumption
-            FROM houses_consumption
-            WHERE house_id = %s AND date_time BETWEEN %s AND %s
-            GROUP BY day
-            ORDER BY day ASC""",
-            (house['id'],start, end), fetchone=False)
-        return jsonify(items), 200
+        return conditional_response('quarter', g.house_id, start, end, lambda: rows_response(
+            series_rows('quarter', g.house_id, start, end, resolution, max_points, method),
+            downsample.time_column(resolution)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/bills/download/<int:quarter>/<int:year>', methods=['GET'])
+@require_auth()
 def download_bill_data(quarter, year):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
 
-    token = auth_header.split(" ")[1]
     try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
-
-    if quarter == 1:
-        start = datetime(year,1,1,0,0,0)
-        end = datetime(year,3,31,23,59,59)
-    elif quarter == 2:
-        start = datetime(year,4,1,0,0,0)
-        end = datetime(year,6,30,23,59,59)
-    elif quarter == 3:
-        start = datetime(year,7,1,0,0,0)
-        end = datetime(year,9,30,23,59,59)
-    elif quarter == 4:
-        start = datetime(year,10,1,0,0,0)
-        end = datetime(year,12,31,23,59,59)
-    else:
-        return jsonify({'error': 'Invalid quarter.'}), 400
-    
-    if start > DATE_TODAY:
-        return jsonify({'error': 'no available data yet'}), 400
-    if end > DATE_TODAY:
-        end = DATE_TODAY
+        start, end = quarter_bounds(quarter, year)
+    except InvalidRange as e:
+        return jsonify({'error': str(e)}), e.status
     
     try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        query = f"""
-            SELECT 
-                DATE(date_time) as day,
-                SUM(bathroom1) as bathroom1,
-                SUM(bedroom1) as bedroom1,
-                SUM(bedroom2) as bedroom2,
-                SUM(livingroom1) as livingroom1,
-                SUM(garage1) as garage1,
-                SUM(kitchen1) as kitchen1,
-                SUM(office1) as office1,
-                SUM(range1) as range1,
-                SUM(venthood1) as venthood1,
-                SUM(total_energy) as total_consumption
-            FROM houses_consumption
-            WHERE house_id = %s AND date_time BETWEEN %s AND %s
-            GROUP BY day
-            ORDER BY day ASC"""
-        cur = mysql.connection.cursor()
-        cur.execute(query, (house['id'],start, end))
-        result = cur.fetchall()
-        # Get column names for dictionary formatting
-        columns = [desc[0] for desc in cur.description]
-        cur.close()
-        print("Raw DB result:", result)
-        print("Columns:", columns)
-        # Format as a list of dictionaries if not fetchone
-        
-        items = []
-
-        for row in result:
-            item = {key: str(value) if isinstance(value, Decimal) else value for key, value in row.items()}
-            
-            #if isinstance(item['day'], date):  # You can also import datetime.date to check this
-               # item['day'] = item['day'].strftime('%Y-%m-%d')
-            
-            items.append(item)
-        if not items:
-            return jsonify({"message": "No data found for the specified date range."}), 404
-
-        # Create a CSV in memory
-        print(items)
-        output = io.StringIO()
-        fieldnames = [
-            "day", "bathroom1", "bedroom1", "bedroom2", "livingroom1",
-            "garage1", "kitchen1", "office1", "range1", "venthood1", "total_consumption"
-        ]
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for item in items:
-            # Format the 'day' field to a more standard date format if needed
-            #if isinstance(item['day'], datetime):
-             #   item['day'] = item['day'].strftime('%Y-%m-%d')
-            writer.writerow(item)
-
-        output.seek(0) # Go to the beginning of the stream
-
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={
-                "Content-Disposition": "attachment;filename=consumption_data.csv"
-            }
-        )
+        return conditional_response('bill_download', g.house_id, start, end,
+            lambda: consumption_export_response(g.house_id, start, end, "consumption_data"))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/bills', methods=['GET'])
+@require_auth()
 def get_bills_data():
     
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
     try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
-    try:
-        house = execute_query("SELECT * FROM houses WHERE user_id = %s", (user_id,),fetchone=True)
-        items = execute_query(f"""
-            SELECT
-                DATE_FORMAT(date_time, '%%Y-%%m') AS month,
-                SUM(total_energy) AS monthly_consumption,
-                COUNT(*) AS total_records
-            FROM houses_consumption
-            WHERE house_id = %s AND date_time <= %s
-            GROUP BY DATE_FORMAT(date_time, '%%Y-%%m')
-            ORDER BY month ASC""",
-            (house['id'],DATE_TODAY), fetchone=False)
-        return jsonify(items), 200
+        # Closed months come straight from the monthly rollup, the current one from daily/hourly rows
+        return conditional_response('bills', g.house_id, BILLS_START, DATE_TODAY, lambda: (jsonify(
+            cached_query('bills', g.house_id, BILLS_START, DATE_TODAY,
+                         *rollups.monthly_bills_query(g.house_id, BILLS_START, DATE_TODAY))), 200))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user', methods=['GET'])
+@require_auth(house=False)
 def get_user_data():
     
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
+    user_id = g.user_id
     try:
         user_data = execute_query(f"""
             SELECT 
@@ -642,21 +688,10 @@ def get_user_data():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user/update', methods=['POST'])
+@require_auth(house=False)
 def update_user():
     
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
+    user_id = g.user_id
     
     data = request.get_json()
     if not data:
@@ -680,106 +715,123 @@ def update_user():
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/forecast/<int:preset>', methods=['GET'])
+@require_auth()
 def forecast_data(preset):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
     
     if preset != 'N/A':
         parsed_startdate = datetime(DATE_TODAY.year, DATE_TODAY.month, DATE_TODAY.day, 0, 0, 0)
-        parsed_enddate = DATE_TODAY + timedelta(days=int(preset))
-        parsed_enddate = datetime(parsed_enddate.year,parsed_enddate.month,parsed_enddate.day,23,59,59)
     else:
         return jsonify({'error': 'invalid preset'}), 400
     
     try:
-        #DISCLAMER-------------------------------------------------------------------
-        #this is just for testing 
-        #when finished use the prediction script to do real energy forecasting
-        df = pd.read_csv('../data/house_3538.csv')
-        # Parse datetime column
-        df['local_15min'] = pd.to_datetime(df['local_15min'])
-        filtered_df = df[
-            (df['local_15min'] >= parsed_startdate) & 
-            (df['local_15min'] <= parsed_enddate)
-        ]
-        # Group by day and calculate average temperature
-        daily_avg_df = filtered_df.copy()
-        daily_avg_df['date'] = daily_avg_df['local_15min'].dt.date
-
-        # Group by date and calculate mean temperature
-        grouped = daily_avg_df.groupby('date')['total_energy'].sum().reset_index()
-
-        # Optional: Rename columns
-        grouped.columns = ['date', 'total_energy']
-
-        # Convert to list of dicts
-        result = grouped.to_dict(orient='records')
-
+        # today plus `preset` days ahead, from the house's cached model (refit with rows newer than its watermark)
+        result = forecast_engine.forecast(g.house_id, parsed_startdate, int(preset) + 1, now=DATE_TODAY)
         return jsonify(result), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/report/<string:day>', methods=['GET'])
+@require_auth()
 def get_report(day):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({'error': 'Missing token'}), 401
-
-    token = auth_header.split(" ")[1]
-    try:
-        decoded = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        print(decoded)
-        user_id = decoded['id']
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'Token expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'error': 'Invalid token'}), 401
     
-    file_path = 'llm_daily_report.txt'
-
     format_string = "%Y-%m-%d"
-    selected_date = datetime.strptime(day, format_string)
-    selected_date = selected_date.date()
+    try:
+        selected_date = datetime.strptime(day, format_string).date()
+    except ValueError:
+        return jsonify({'error': f"Ensure the string exactly matches the format '{format_string}'."}), 400
     if selected_date > DATE_TODAY.date():
         return jsonify({'error': 'Date cant be after todays date'}), 404
     
     try:
-        
-        # 1. Check if the file exists
-        if not os.path.exists(file_path):
-            print('file does not exist generating report')
-            #get the user's house id from th db
-            #using the 3538 house id just for now 
-            
-            report.generate_report(3538,selected_date)
-
-            
-        
-        # 4. Read the content of the file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        report_store.touch(g.house_id)
+
+        stream = request.args.get('stream') in ('1', 'true')
+
+        # Finished reports are served straight from the store
+        content = report_jobs.report(g.house_id, selected_date)
+        if content is not None:
+            if stream:
+                return Response(sse_event(content, 'report') + sse_event({'status': 'done'}, 'done'),
+                                mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+            return Response(content, mimetype='text/plain')
+
+        # ?stream=1 follows the (new or joined) job's model tokens as Server-Sent Events
+        if stream:
+            job = report_jobs.submit(g.house_id, selected_date)
+            return Response(
+                stream_with_context(report_event_stream(g.house_id, selected_date, job)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        # Otherwise queue (or join) the generation job and let the client poll
+        job = report_jobs.submit(g.house_id, selected_date)
+        body = job.as_dict()
+        body['status_url'] = f"/api/report/jobs/{job.id}"
+        return jsonify(body), 202, {'Location': body['status_url']}
+
+    except QueueFull as e:
+        return jsonify({'error': f"Report queue is full, retry later ({e})"}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        print(e)
+        return jsonify({"error": f"An error occurred while preparing the report: {str(e)}"}), 500
 
-        # 5. Return the content with appropriate MIME type
-        # For plain text, 'text/plain' is correct.
-        return Response(content, mimetype='text/plain')
+@app.route('/api/report/jobs/<string:job_id>', methods=['GET'])
+@require_auth()
+def get_report_job(job_id):
 
+    try:
+        job = report_jobs.get(job_id)
+        if job is None or job.house_id != g.house_id:
+            return jsonify({'error': 'Unknown report job'}), 404
+
+        # ?wait=N long-polls up to N seconds for the job to finish
+        wait = min(request.args.get('wait', 0, type=float), REPORT_MAX_WAIT)
+        if wait > 0:
+            job.done.wait(wait)
+
+        body = job.as_dict()
+        if job.status == 'done':
+            body['report_url'] = f"/api/report/{job.day.isoformat()}"
+        return jsonify(body), 200
     except Exception as e:
-        print(e)
-        # Handle potential errors during file reading (e.g., permission issues)
-        return jsonify({"error": f"An error occurred while reading the file: {str(e)}"}), 500
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/readings', methods=['POST'])
+@require_auth()
+def post_readings():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Missing request body'}), 400
+
+    try:
+        house_id = int(data.get('house_id', g.house_id))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'house_id must be an integer'}), 400
+    if house_id not in g.claims.get('house_ids', [g.house_id]):
+        return jsonify({'error': 'Unknown house'}), 403
+    try:
+        rows = live_ingest.parse_readings(house_id, data.get('readings'))
+    except live_ingest.InvalidReadings as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        queued = readings_writer.submit(rows)
+    except live_ingest.QueueFull as e:
+        return jsonify({'error': f"Ingest queue is full, retry later ({e})"}), 429, {'Retry-After': '5'}
+    return jsonify({'accepted': len(rows), 'queued': queued}), 202
+
+@app.route('/api/stats/ingest', methods=['GET'])
+def get_ingest_stats():
+    return jsonify(readings_writer.stats()), 200
+
+@app.route('/api/stats/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify(query_cache.stats()), 200
+
+@app.route('/api/stats/db', methods=['GET'])
+def get_db_stats():
+    return jsonify(db_pool.stats()), 200
 
 # basic route for testing
 @app.route('/')
@@ -0,0 +1,394 @@
+"""
+Async (ASGI) serving mode of the API.
+
+Serves the same route set as server-api.py on one port. The routes that spend
+their time waiting on MySQL or on a report (the consumption and aggregate
+endpoints, /api/user and /api/report) are coroutines running on aiomysql, so
+an idle-waiting request costs a coroutine instead of a thread; independent
+queries of a request run concurrently. Reports are generated by the report job
+queue of server-api.py, streamed clients poll its tokens. Every other route is
+forwarded to the Flask app of server-api.py (run in a thread pool by asgiref),
+so both modes share the auth cache, the query cache, the report jobs and the
+live readings writer.
+
+Run with:  uvicorn server-asgi:app --port 5001
+"""
+import asyncio
+import importlib
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import wraps
+
+import aiomysql
+import jwt
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date
+
+import columnar
+import db
+import downsample
+import http_cache
+import rollups
+from report_jobs import QueueFull
+
+# Routes, helpers and shared state of the synchronous app
+api = importlib.import_module('server-api')
+
+pool = None
+
+
+async def fetch(query, args=None, fetchone=False):
+    """
+    execute_query for coroutines: dict rows from the aiomysql pool.
+    """
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(query, args)
+            return await cur.fetchone() if fetchone else await cur.fetchall()
+
+
+def _default(o):
+    # Dates and decimals encoded as Flask's jsonify does, so both modes answer the same JSON
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, Decimal):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def jsonify(data, status=200, headers=None):
+    body = json.dumps(data, default=_default, sort_keys=True, separators=(',', ':')) + "\n"
+    return Response(body, status_code=status, headers=headers, media_type='application/json')
+
+
+def accepts_layout(view):
+    """
+    Validates ?layout=rows|columnar (default rows) before the view runs.
+    """
+    @wraps(view)
+    async def wrapper(request):
+        try:
+            columnar.check_layout(request.query_params.get('layout', 'rows'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+        return await view(request)
+    return wrapper
+
+
+def rows_response(request, rows, time_column, **extra):
+    """
+    jsonify(rows), or with ?layout=columnar one array per column (see columnar.py).
+    """
+    if request.query_params.get('layout', 'rows') == 'columnar':
+        return Response(columnar.dumps(columnar.to_columnar(rows, time_column, **extra)), media_type='application/json')
+    return jsonify(rows)
+
+
+def require_auth(house=True):
+    """
+    server-api.require_auth for coroutines; the context is set on request.state.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request):
+            auth_header = request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith("Bearer "):
+                return jsonify({'error': 'Missing token'}, 401)
+
+            token = auth_header.split(" ")[1]
+            try:
+                claims = api.token_verifier.verify(token)
+                user_id = claims['id']
+            except jwt.ExpiredSignatureError:
+                return jsonify({'error': 'Token expired'}, 401)
+            except (jwt.InvalidTokenError, KeyError):
+                return jsonify({'error': 'Invalid token'}, 401)
+
+            request.state.user_id = user_id
+            request.state.claims = claims
+            if house:
+                house_ids = claims.get('house_ids')
+                if house_ids is None:
+                    try:
+                        rows = await fetch("SELECT id FROM houses WHERE user_id = %s ORDER BY id", (user_id,))
+                    except Exception as e:
+                        return jsonify({'error': str(e)}, 500)
+                    house_ids = [row['id'] for row in rows]
+                    claims = dict(claims, house_ids=house_ids)
+                    api.token_verifier.remember(token, claims)
+                    request.state.claims = claims
+                if not house_ids:
+                    return jsonify({'error': 'No house registered for this user'}, 404)
+                request.state.house_id = house_ids[0]
+            return await view(request)
+        return wrapper
+    return decorator
+
+
+async def conditional(request, endpoint, house_id, start, end, build):
+    """
+    server-api.conditional_response for coroutines: 304 before build() runs when
+    If-None-Match holds the current ETag, otherwise the (compressed) response of build().
+    """
+    if api.query_cache.shared:
+        tag = http_cache.etag(house_id, endpoint, start, end, api.query_cache.version(house_id),
+                              http_cache.variant(request.query_params.multi_items()))
+        headers = http_cache.cache_headers(tag, end, api.DATE_TODAY)
+        if http_cache.if_none_match(request.headers.get('If-None-Match'), tag):
+            return Response(status_code=304, headers=headers)
+    else:
+        headers = {'Cache-Control': http_cache.UNCACHED, 'Vary': 'Authorization, Accept-Encoding'}
+    response = await build()
+    if response.status_code != 200:
+        return response
+    response.headers.update(headers)
+    encoding = http_cache.pick_encoding(request.headers.get('Accept-Encoding'))
+    if encoding and http_cache.should_compress(response.media_type, response.body):
+        response.body = http_cache.compress(response.body, encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(response.body))
+    return response
+
+
+async def cached_json(endpoint, house_id, start, end, query, args=None):
+    return jsonify(await api.query_cache.get_or_compute_async(
+        house_id, endpoint, start, end, api.DATE_TODAY, lambda: fetch(query, args)))
+
+
+async def series_rows(request, endpoint, house_id, start, end, resolution, max_points, method):
+    """
+    server-api.series_rows for coroutines, as a (layout-aware) response.
+    """
+    query, args = downsample.series_query(house_id, start, end, resolution)
+    rows = await api.query_cache.get_or_compute_async(
+        house_id, f"{endpoint}:{resolution}", start, end, api.DATE_TODAY, lambda: fetch(query, args))
+    return rows_response(request, downsample.finish(rows, resolution, max_points, method),
+                         downsample.time_column(resolution))
+
+
+@require_auth()
+@accepts_layout
+async def get_today_data(request):
+    today = api.DATE_TODAY
+    start = datetime(today.year, today.month, today.day, 0, 0, 0)
+    try:
+        max_points, method = downsample.downsample_params(request.query_params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    try:
+        rows = await fetch(api.TODAY_READINGS_QUERY, (request.state.house_id, start, today))
+        rows = downsample.downsample(rows, max_points, method, 'date_time', 'total_energy')
+        return rows_response(request, rows, 'date_time', exclude=('house_id',), house_id=request.state.house_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}, 500)
+
+
+@require_auth()
+@accepts_layout
+async def get_weekly_totals(request):
+    start = api.DATE_TODAY - timedelta(days=7)
+    start = datetime(start.year, start.month, start.day, 0, 0, 0)
+    try:
+        resolution, max_points, method = downsample.series_params(request.query_params, 'daily', start, api.DATE_TODAY)
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    try:
+        rows = await fetch(*downsample.series_query(request.state.house_id, start, api.DATE_TODAY, resolution))
+        rows = downsample.finish(rows, resolution, max_points, method)
+        return rows_response(request, rows, downsample.time_column(resolution))
+    except Exception as e:
+        return jsonify({'error': str(e)}, 500)
+
+
+@require_auth()
+@accepts_layout
+async def get_range_total(request):
+    house_id = request.state.house_id
+    try:
+        start, end = api.range_bounds(request.path_params['start'], request.path_params['end'],
+                                      request.query_params.get('preset', 'N/A'))
+        resolution, max_points, method = downsample.series_params(request.query_params, 'daily', start, end)
+    except api.InvalidRange as e:
+        return jsonify({'error': str(e)}, e.status)
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    try:
+        return await conditional(request, 'range', house_id, start, end, lambda: series_rows(
+            request, 'range', house_id, start, end, resolution, max_points, method))
+    except Exception as e:
+        return jsonify({'error': str(e)}, 500)
+
+
+@require_auth()
+@accepts_layout
+async def get_quarter_data(request):
+    house_id = request.state.house_id
+    try:
+        start, end = api.quarter_bounds(request.path_params['quarter'], request.path_params['year'])
+        resolution, max_points, method = downsample.series_params(request.query_params, 'daily', start, end)
+    except api.InvalidRange as e:
+        return jsonify({'error': str(e)}, e.status)
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    try:
+        return await conditional(request, 'quarter', house_id, start, end, lambda: series_rows(
+            request, 'quarter', house_id, start, end, resolution, max_points, method))
+    except Exception as e:
+        return jsonify({'error': str(e)}, 500)
+
+
+@require_auth()
+async def get_bills_data(request):
+    house_id = request.state.house_id
+    start, end = api.BILLS_START, api.DATE_TODAY
+    try:
+        return await conditional(request, 'bills', house_id, start, end, lambda: cached_json(
+            'bills', house_id, start, end, *rollups.monthly_bills_query(house_id, start, end)))
+    except Exception as e:
+        return jsonify({'error': str(e)}, 500)
+
+
+@require_auth(house=False)
+async def get_user_data(request):
+    user_id = request.state.user_id
+    try:
+        # The user and house lookups are independent, run them side by side
+        user, house = await asyncio.gather(
+            fetch("SELECT username, email, phone_number, address FROM users WHERE id = %s",
+                  (user_id,), fetchone=True),
+            fetch("""
+                SELECT construction_year, total_square_footage, first_floor_square_footage,
+                       state, city, building_type
+                FROM houses WHERE user_id = %s ORDER BY id LIMIT 1""",
+                  (user_id,), fetchone=True))
+        return jsonify(dict(user, **house) if user and house else None)
+    except Exception as e:
+        return jsonify({'error': str(e)}, 500)
+
+
+async def report_event_stream(house_id, day, job):
+    """
+    server-api.report_event_stream without a thread per client: the job's
+    tokens are polled instead of waited on.
+    """
+    if job.status == 'queued':
+        yield api.sse_event(job.as_dict(), 'queued')
+    seen = 0
+    idle = 0.0
+    while True:
+        finished = job.done.is_set()
+        tokens = job.tokens[seen:]
+        seen += len(tokens)
+        for token in tokens:
+            yield api.sse_event(token)
+        if finished:
+            break
+        idle = 0.0 if tokens else idle + 0.1
+        if idle >= 15:
+            idle = 0.0
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(0.1)
+    if job.status != 'done':
+        yield api.sse_event({'error': job.error or 'Report generation failed'}, 'error')
+        return
+    if not seen:
+        yield api.sse_event(job.text, 'report')
+    yield api.sse_event({'status': 'done'}, 'done')
+
+
+@require_auth()
+async def get_report(request):
+    house_id = request.state.house_id
+    format_string = "%Y-%m-%d"
+    try:
+        selected_date = datetime.strptime(request.path_params['day'], format_string).date()
+    except ValueError:
+        return jsonify({'error': f"Ensure the string exactly matches the format '{format_string}'."}, 400)
+    if selected_date > api.DATE_TODAY.date():
+        return jsonify({'error': 'Date cant be after todays date'}, 404)
+
+    try:
+        api.report_store.touch(house_id)
+
+        stream = request.query_params.get('stream') in ('1', 'true')
+
+        # Finished reports are served straight from the store
+        content = api.report_jobs.report(house_id, selected_date)
+        if content is not None:
+            if stream:
+                return Response(api.sse_event(content, 'report') + api.sse_event({'status': 'done'}, 'done'),
+                                media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+            return Response(content, media_type='text/plain')
+
+        # ?stream=1 follows the (new or joined) job's model tokens as Server-Sent Events
+        if stream:
+            job = api.report_jobs.submit(house_id, selected_date)
+            return StreamingResponse(
+                report_event_stream(house_id, selected_date, job),
+                media_type='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        # Otherwise queue (or join) the generation job and let the client poll
+        job = api.report_jobs.submit(house_id, selected_date)
+        body = job.as_dict()
+        body['status_url'] = f"/api/report/jobs/{job.id}"
+        return jsonify(body, 202, {'Location': body['status_url']})
+
+    except QueueFull as e:
+        return jsonify({'error': f"Report queue is full, retry later ({e})"}, 503, {'Retry-After': '30'})
+    except Exception as e:
+        print(e)
+        return jsonify({"error": f"An error occurred while preparing the report: {str(e)}"}, 500)
+
+
+async def get_async_db_stats(request):
+    return jsonify({
+        'size': pool.size,
+        'idle': pool.freesize,
+        'in_use': pool.size - pool.freesize,
+        'min_size': pool.minsize,
+        'max_size': pool.maxsize,
+    })
+
+
+async def lifespan(app):
+    global pool
+    pool = await aiomysql.create_pool(
+        host=api.DB_HOST, port=api.DB_PORT, user=api.DB_USER, password=api.DB_PASSWORD, db=api.DB_NAME,
+        minsize=db.DB_POOL_MIN, maxsize=db.DB_POOL_MAX, pool_recycle=int(db.DB_POOL_RECYCLE), autocommit=True)
+    try:
+        yield
+    finally:
+        pool.close()
+        await pool.wait_closed()
+
+
+# Same paths as server-api.py, matched before the Flask fallback
+routes = [
+    Route('/api/consumption/today', get_today_data, methods=['GET']),
+    Route('/api/consumption/lastweek', get_weekly_totals, methods=['GET']),
+    Route('/api/consumption/quarter/{quarter:int}/{year:int}', get_quarter_data, methods=['GET']),
+    Route('/api/consumption/{start:str}/{end:str}', get_range_total, methods=['GET']),
+    Route('/api/bills', get_bills_data, methods=['GET']),
+    Route('/api/user', get_user_data, methods=['GET']),
+    Route('/api/report/{day:str}', get_report, methods=['GET']),
+    Route('/api/stats/db/async', get_async_db_stats, methods=['GET']),
+    Mount('/', app=WsgiToAsgi(api.app)),
+]
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    middleware=[Middleware(CORSMiddleware, allow_origin_regex='.*', allow_credentials=True,
+                           allow_methods=['*'], allow_headers=['*'], expose_headers=['Content-Disposition'])],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5001)
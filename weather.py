@@ -0,0 +1,137 @@
+"""
+In-memory weather store.
+
+weather_data.csv is parsed once into sorted datetime64 timestamps and float32
+columns, with per-day aggregates computed at load time. Lookups are binary
+searches over those arrays. The file's mtime is checked on access and the
+store reloads itself when the file changes.
+"""
+import os
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WEATHER_PATH = os.getenv('WEATHER_FILE', '../data/weather_data.csv')
+WEATHER_COLUMNS = ["temp", "dwpt", "rhum", "prcp", "wdir", "wspd", "pres", "coco"]
+
+
+def _to_datetime64(value):
+    if isinstance(value, datetime):
+        return np.datetime64(value, 'ns')
+    if isinstance(value, date):
+        return np.datetime64(datetime(value.year, value.month, value.day), 'ns')
+    return np.datetime64(pd.Timestamp(value), 'ns')
+
+
+class WeatherStore:
+    def __init__(self, path=WEATHER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        # (times, values, days, daily), swapped as a whole on reload:
+        #   times  datetime64[ns], sorted
+        #   values column -> float32 array aligned with times
+        #   days   datetime64[D], sorted
+        #   daily  aggregate -> float64 array aligned with days
+        self._data = None
+
+    def _load(self):
+        header = pd.read_csv(self.path, nrows=0).columns
+        columns = [c for c in WEATHER_COLUMNS if c in header]
+        df = pd.read_csv(self.path, usecols=["local_15min"] + columns, parse_dates=["local_15min"])
+        df = df.sort_values("local_15min", kind="mergesort").reset_index(drop=True)
+
+        # Daily aggregates, kept in float64 (one value per day, computed before the columns are narrowed)
+        day = df["local_15min"].dt.normalize()
+        grouped = df.groupby(day)
+        daily = {
+            "temp_min": grouped["temp"].min(),
+            "temp_mean": grouped["temp"].mean(),
+            "temp_max": grouped["temp"].max(),
+        }
+        daily.update({f"{c}_mean": grouped[c].mean() for c in columns})
+        if "coco" in columns:
+            # most frequent condition code per day, smallest code on ties (as Series.mode)
+            counts = df.assign(day=day).groupby(["day", "coco"]).size().reset_index(name="n")
+            counts = counts.sort_values(["day", "n", "coco"], ascending=[True, False, True])
+            daily["coco_mode"] = counts.drop_duplicates("day").set_index("day")["coco"]
+
+        days = daily["temp_mean"].index
+        self._data = (
+            df["local_15min"].to_numpy(dtype="datetime64[ns]"),
+            {c: df[c].to_numpy(dtype=np.float32) for c in columns},
+            days.to_numpy(dtype="datetime64[D]"),
+            {k: v.reindex(days).to_numpy(dtype=np.float64) for k, v in daily.items()},
+        )
+        print(f"Weather store loaded {len(df)} rows ({len(days)} days) from {self.path}")
+
+    def _refresh(self):
+        """
+        Loads the file on first use and again whenever its mtime changes.
+        Returns the current (times, values, days, daily) snapshot.
+        """
+        mtime = os.path.getmtime(self.path)
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load()
+                    self._mtime = mtime
+        return self._data
+
+    def ensure_loaded(self):
+        self._refresh()
+        return self
+
+    def daily_avg_temp(self, start, end):
+        """
+        [{'date', 'avg_temp'}] for every day between start and end (inclusive).
+        """
+        _, _, days, daily = self._refresh()
+        lo = np.searchsorted(days, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(days, np.datetime64(end, 'D'), side='right')
+        return [{'date': d.item(), 'avg_temp': float(t)}
+                for d, t in zip(days[lo:hi], daily["temp_mean"][lo:hi])]
+
+    def day_summary(self, day):
+        """
+        Precomputed aggregates of one day, or None if the day is not in the file.
+        """
+        _, _, days, daily = self._refresh()
+        key = np.datetime64(day, 'D')
+        i = np.searchsorted(days, key)
+        if i >= len(days) or days[i] != key:
+            return None
+        return {k: float(v[i]) for k, v in daily.items()}
+
+    def frame(self, start, end):
+        """
+        DataFrame of the 15-minute rows with start <= local_15min < end.
+        The slice is widened back to float64 so downstream results stay JSON-serializable.
+        """
+        times, values, _, _ = self._refresh()
+        lo = np.searchsorted(times, _to_datetime64(start), side='left')
+        hi = np.searchsorted(times, _to_datetime64(end), side='left')
+        data = {"local_15min": times[lo:hi]}
+        data.update({c: v[lo:hi].astype(np.float64) for c, v in values.items()})
+        return pd.DataFrame(data)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Process-wide store for WEATHER_FILE, created on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = WeatherStore()
+    return _store